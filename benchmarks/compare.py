@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+"""
+Compares two result files written by ``run.py``.
+
+Usage::
+
+    python benchmarks/compare.py before.json after.json
+"""
+
+import argparse
+import json
+import sys
+
+
+def load_results(path):
+    with open(path, mode="r") as fp:
+        return json.load(fp)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("before", help="results of the baseline")
+    parser.add_argument("after", help="results to compare")
+    args = parser.parse_args(argv)
+
+    before = load_results(args.before)
+    after = load_results(args.after)
+    if before["parameters"] != after["parameters"]:
+        print("warning: results use different parameters", file=sys.stderr)
+
+    print(
+        "{:<12} {:>10} {:>10} {:>8}".format(
+            "stage", "before", "after", "change"
+        )
+    )
+    for stage, result in after["stages"].items():
+        if stage not in before["stages"]:
+            continue
+        old = before["stages"][stage]["median"]
+        new = result["median"]
+        print(
+            "{:<12} {:>9.3f}s {:>9.3f}s {:>+7.1f}%".format(
+                stage, old, new, (new - old) / old * 100 if old else 0.0
+            )
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
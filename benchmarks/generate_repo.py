@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+"""
+Generates a local git repository with many versions of a Sphinx project.
+
+The generated history is deterministic (for the same parameters), so that
+benchmark results of different sphinx-multiversion commits can be compared.
+
+Usage::
+
+    python benchmarks/generate_repo.py /tmp/smv-bench --tags 50 --pages 100
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+
+COMMIT_DATE = 1577836800  # 2020-01-01 00:00:00 UTC
+COMMIT_INTERVAL = 86400
+
+CONF_TEMPLATE = """\
+project = "Benchmark"
+author = "sphinx-multiversion"
+version = "{version}"
+release = "{version}"
+extensions = {extensions!r}
+templates_path = ["_templates"]
+html_sidebars = {{"**": ["versioning.html"]}}
+{extra}
+"""
+
+# Variants of conf.py that are used by different versions
+CONF_VARIANTS = (
+    {"extensions": [], "extra": ""},
+    {
+        "extensions": ["sphinx.ext.todo"],
+        "extra": 'rst_prolog = ".. |project| replace:: Benchmark"\n',
+    },
+    {
+        "extensions": ["sphinx.ext.todo", "sphinx.ext.ifconfig"],
+        "extra": "todo_include_todos = True\n",
+    },
+    {"extensions": ["sphinx.ext.mathjax"], "extra": 'language = "en"\n'},
+)
+
+# Extensions of the root conf.py
+ROOT_EXTENSIONS = ["sphinx_multiversion"]
+
+VERSIONING_TEMPLATE = """\
+{% if versions %}
+<h3>{{ _('Versions') }}</h3>
+<ul>
+  {%- for item in versions %}
+  <li><a href="{{ item.url }}">{{ item.name }}</a></li>
+  {%- endfor %}
+</ul>
+{% endif %}
+"""
+
+INDEX_TEMPLATE = """\
+Benchmark {version}
+==========={underline}
+
+.. toctree::
+   :glob:
+
+   pages/*
+"""
+
+PAGE_TEMPLATE = """\
+Page {page}
+======{underline}
+
+This is page {page} of version {version}.
+
+{paragraphs}
+"""
+
+
+def size_argument(value):
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    value = value.strip().upper()
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+class FastImport:
+    """Writes commits to a ``git fast-import`` process."""
+
+    def __init__(self, gitroot):
+        self.proc = subprocess.Popen(
+            ("git", "fast-import", "--quiet"),
+            cwd=gitroot,
+            stdin=subprocess.PIPE,
+        )
+        self.mark = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.proc.stdin.write(data)
+
+    def write_data(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.write("data {}\n".format(len(data)))
+        self.write(data)
+        self.write("\n")
+
+    def commit(self, ref, message, files, parent=None, date=COMMIT_DATE):
+        self.mark += 1
+        self.write("commit {}\nmark :{}\n".format(ref, self.mark))
+        self.write(
+            "committer Benchmark <bench@example.com> {} +0000\n".format(date)
+        )
+        self.write_data(message)
+        if parent is not None:
+            self.write("from :{}\n".format(parent))
+        for path, content in sorted(files.items()):
+            self.write("M 100644 inline {}\n".format(path))
+            self.write_data(content)
+        self.write("\n")
+        return self.mark
+
+    def tag(self, name, mark, date=COMMIT_DATE):
+        self.write("tag {}\nfrom :{}\n".format(name, mark))
+        self.write(
+            "tagger Benchmark <bench@example.com> {} +0000\n".format(date)
+        )
+        self.write_data("Release {}".format(name))
+
+    def close(self):
+        self.proc.stdin.close()
+        if self.proc.wait() != 0:
+            raise subprocess.CalledProcessError(
+                self.proc.returncode, self.proc.args
+            )
+
+
+def get_version_files(version, index, pages, changed_pages, conf_variant):
+    """
+    Returns the files that change in the ``index``-th version of the
+    project. The first version contains all files.
+    """
+    files = {}
+    if index == 0 or conf_variant is not None:
+        variant = CONF_VARIANTS[(conf_variant or 0) % len(CONF_VARIANTS)]
+        files["docs/conf.py"] = CONF_TEMPLATE.format(
+            version=version, **variant
+        )
+    files["docs/index.rst"] = INDEX_TEMPLATE.format(
+        version=version, underline="=" * len(version)
+    )
+
+    rng = random.Random(index)
+    if index == 0:
+        page_numbers = range(pages)
+    else:
+        page_numbers = rng.sample(range(pages), min(changed_pages, pages))
+    for page in page_numbers:
+        paragraphs = "\n\n".join(
+            " ".join("word{}".format(rng.randrange(1000)) for _ in range(60))
+            for _ in range(5)
+        )
+        files["docs/pages/page{:05d}.rst".format(page)] = PAGE_TEMPLATE.format(
+            page=page,
+            version=version,
+            underline="=" * len(str(page)),
+            paragraphs=paragraphs,
+        )
+    return files
+
+
+def get_asset_files(assets, asset_size, seed):
+    rng = random.Random(seed)
+    return {
+        "docs/_static/asset{:03d}.bin".format(i): rng.getrandbits(
+            8 * asset_size
+        ).to_bytes(asset_size, "little")
+        for i in range(assets)
+    }
+
+
+def generate(
+    path,
+    tags=20,
+    branches=2,
+    pages=50,
+    changed_pages=5,
+    assets=2,
+    asset_size=64 * 1024,
+    conf_variants=2,
+):
+    """
+    Creates a git repository at ``path`` with a linear history of ``tags``
+    tagged releases on ``main`` and ``branches`` additional branches.
+
+    Each release changes ``changed_pages`` of the ``pages`` pages. The conf.py
+    cycles through ``conf_variants`` variants, and every 10th release
+    replaces the ``assets`` binary files of ``asset_size`` bytes each.
+    """
+    os.makedirs(path, exist_ok=True)
+    subprocess.check_call(("git", "init", "-q", path))
+
+    fast_import = FastImport(path)
+    parent = None
+    marks = []
+    for index in range(tags + 1):
+        version = "1.{}.0".format(index) if index < tags else "dev"
+        conf_variant = (
+            index % conf_variants
+            if conf_variants > 1 and index % 10 == 0
+            else None
+        )
+        files = get_version_files(
+            version, index, pages, changed_pages, conf_variant
+        )
+        if index == 0:
+            files["docs/_templates/versioning.html"] = VERSIONING_TEMPLATE
+        if index % 10 == 0:
+            files.update(get_asset_files(assets, asset_size, index))
+        if index == tags:
+            # The checked out branch needs the extension
+            files["docs/conf.py"] = CONF_TEMPLATE.format(
+                version=version, extensions=ROOT_EXTENSIONS, extra=""
+            )
+        date = COMMIT_DATE + index * COMMIT_INTERVAL
+        parent = fast_import.commit(
+            "refs/heads/main",
+            "Release {}".format(version),
+            files,
+            parent=parent,
+            date=date,
+        )
+        marks.append(parent)
+        if index < tags:
+            fast_import.tag("v{}".format(version), parent, date=date)
+
+    for branch in range(branches):
+        base = marks[(branch * len(marks)) // max(branches, 1)]
+        version = "branch{}".format(branch)
+        fast_import.commit(
+            "refs/heads/{}".format(version),
+            "Work on {}".format(version),
+            get_version_files(version, tags + branch + 1, pages, 1, None),
+            parent=base,
+        )
+    fast_import.close()
+    subprocess.check_call(("git", "checkout", "-q", "-f", "main"), cwd=path)
+
+
+def add_arguments(parser):
+    """Adds the options that control the generated repository."""
+    parser.add_argument("--tags", type=int, default=20)
+    parser.add_argument("--branches", type=int, default=2)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument(
+        "--changed-pages",
+        type=int,
+        default=5,
+        help="number of pages that change between releases",
+    )
+    parser.add_argument("--assets", type=int, default=2)
+    parser.add_argument("--asset-size", type=size_argument, default="64K")
+    parser.add_argument("--conf-variants", type=int, default=2)
+
+
+def get_generate_kwargs(args):
+    return {
+        "tags": args.tags,
+        "branches": args.branches,
+        "pages": args.pages,
+        "changed_pages": args.changed_pages,
+        "assets": args.assets,
+        "asset_size": args.asset_size,
+        "conf_variants": args.conf_variants,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("path", help="path of the new repository")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    generate(args.path, **get_generate_kwargs(args))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+"""
+Times the stages of a sphinx-multiversion run on a generated repository.
+
+The repository is generated locally (see ``generate_repo.py``), so the
+benchmark doesn't need network access. Results are written as JSON.
+
+Usage::
+
+    python benchmarks/run.py --tags 50 --pages 100 --output results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generate_repo
+import sphinx
+
+import sphinx_multiversion
+from sphinx_multiversion import git
+from sphinx_multiversion.main import (
+    create_config_pool,
+    get_docnames,
+    load_sphinx_config,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RESULTS_FORMAT = 1
+STAGES = ("refs", "copy_tree", "config", "discovery", "build")
+SOURCEDIR = "docs"
+
+
+def get_refs(gitroot):
+    return list(
+        git.get_refs(
+            gitroot,
+            r"^.*$",
+            r"^.*$",
+            None,
+            files=(SOURCEDIR, os.path.join(SOURCEDIR, "conf.py")),
+        )
+    )
+
+
+def bench_refs(gitroot, tmpdir, refs, args):
+    get_refs(gitroot)
+
+
+def bench_copy_tree(gitroot, tmpdir, refs, args):
+    shutil.rmtree(os.path.join(tmpdir, "copy"), ignore_errors=True)
+    for ref in refs:
+        dst = os.path.join(tmpdir, "copy", ref.commit)
+        if not os.path.exists(dst):
+            git.copy_tree(gitroot, gitroot, dst, ref)
+
+
+def bench_config(gitroot, tmpdir, refs, args):
+    pool = create_config_pool(processes=args.jobs)
+    try:
+        for ref in refs:
+            load_sphinx_config(
+                os.path.join(tmpdir, "copy", ref.commit, SOURCEDIR),
+                {},
+                pool=pool,
+            )
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def bench_discovery(gitroot, tmpdir, refs, args):
+    trees = git.get_object_ids(
+        gitroot,
+        ["{}:{}".format(ref.commit, SOURCEDIR) for ref in refs],
+    )
+    for tree in trees:
+        get_docnames(
+            [
+                entry.path
+                for entry in git.get_tree_entries(gitroot, tree)
+                if entry.type == "blob"
+            ],
+            (".rst",),
+        )
+
+
+def bench_build(gitroot, tmpdir, refs, args):
+    outputdir = os.path.join(tmpdir, "html")
+    shutil.rmtree(outputdir, ignore_errors=True)
+    env = os.environ.copy()
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, (ROOT, env.get("PYTHONPATH")))
+    )
+    subprocess.check_call(
+        (
+            sys.executable,
+            "-m",
+            "sphinx_multiversion",
+            SOURCEDIR,
+            outputdir,
+            "-q",
+            "-j",
+            str(args.jobs),
+            "--timings",
+            os.path.join(tmpdir, "timings.json"),
+            *args.build_args,
+        ),
+        cwd=gitroot,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def get_commit():
+    try:
+        output = subprocess.check_output(
+            ("git", "rev-parse", "HEAD"),
+            cwd=ROOT,
+            stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode().strip()
+
+
+def run_stage(func, repeat, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return {
+        "seconds": timings,
+        "min": min(timings),
+        "median": statistics.median(timings),
+    }
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "path",
+        nargs="?",
+        help="use or create the repository at this path (default: temp dir)",
+    )
+    generate_repo.add_arguments(parser)
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=STAGES,
+        default=STAGES,
+        help="stages to run (default: all)",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="value of sphinx-multiversion's -j option",
+    )
+    parser.add_argument(
+        "--build-arg",
+        dest="build_args",
+        action="append",
+        default=[],
+        help="additional argument for sphinx-multiversion (repeatable)",
+    )
+    parser.add_argument(
+        "-o", "--output", help="write results to this file (default: stdout)"
+    )
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        gitroot = args.path or os.path.join(tmpdir, "repo")
+        start = time.perf_counter()
+        if not os.path.exists(os.path.join(gitroot, ".git")):
+            generate_repo.generate(
+                gitroot, **generate_repo.get_generate_kwargs(args)
+            )
+        generate_time = time.perf_counter() - start
+
+        refs = get_refs(gitroot)
+        stages = {}
+        for stage in STAGES:
+            if stage not in args.stages:
+                continue
+            if stage == "config" and "copy_tree" not in args.stages:
+                bench_copy_tree(gitroot, tmpdir, refs, args)
+            func = globals()["bench_{}".format(stage)]
+            stages[stage] = run_stage(
+                func, args.repeat, gitroot, tmpdir, refs, args
+            )
+            print(
+                "{}: {:.3f}s".format(stage, stages[stage]["median"]),
+                file=sys.stderr,
+            )
+
+        # Breakdown of the last build as reported by --timings
+        build_timings = None
+        if "build" in stages:
+            with open(os.path.join(tmpdir, "timings.json")) as fp:
+                build_timings = json.load(fp)["stages"]
+
+    results = {
+        "format": RESULTS_FORMAT,
+        "commit": get_commit(),
+        "sphinx_multiversion_version": sphinx_multiversion.__version__,
+        "sphinx_version": sphinx.__version__,
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "parameters": {
+            **generate_repo.get_generate_kwargs(args),
+            "refs": len(refs),
+            "repeat": args.repeat,
+            "jobs": args.jobs,
+            "build_args": args.build_args,
+        },
+        "generate_seconds": generate_time,
+        "stages": stages,
+        "build_stages": build_timings,
+    }
+    if args.output:
+        with open(args.output, mode="w") as fp:
+            json.dump(results, fp, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
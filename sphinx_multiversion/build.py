@@ -0,0 +1,580 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import collections
+import ctypes
+import datetime
+import importlib
+import importlib.util
+import itertools
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+import traceback
+import urllib.parse
+
+from . import sphinx
+from . import timings
+
+BuildJob = collections.namedtuple(
+    "BuildJob",
+    [
+        "name",
+        "args",
+        "cwd",
+        "env",
+    ],
+)
+
+
+class BuildResult(
+    collections.namedtuple(
+        "BuildResult",
+        [
+            "returncode",
+            "start",
+            "end",
+            "rusage",
+            "sampled_rss",
+        ],
+    )
+):
+    def get_peak_rss(self):
+        """
+        Returns the highest RSS in bytes that was sampled for the build's
+        process tree or reported by the OS for the build process, or
+        ``None`` if neither is available.
+        """
+        values = [self.sampled_rss or 0]
+        if self.rusage is not None:
+            values.append(timings.get_maxrss(self.rusage))
+        return max(values) or None
+
+
+# Modules that every sphinx-build imports, preloaded before forking builds
+PRELOAD_MODULES = (
+    "sphinx.cmd.build",
+    "sphinx.application",
+    "sphinx.builders.html",
+    "sphinx.environment",
+    "docutils.parsers.rst",
+    "pygments.lexers",
+)
+
+POLL_INTERVAL = 0.05
+MEMORY_POLL_INTERVAL = 0.5
+
+STAGING_DIRNAME = ".smv-staging"
+
+# Flag for renameat2(2) to atomically exchange two paths on Linux
+RENAME_EXCHANGE = 2
+AT_FDCWD = -100
+
+logger = logging.getLogger(__name__)
+
+
+def split_jobs(total_jobs, num_builds):
+    """
+    Split a budget of ``total_jobs`` CPU cores between concurrent
+    sphinx-build processes.
+
+    Returns a tuple ``(concurrent_builds, sphinx_jobs)``, where
+    ``concurrent_builds`` is the number of versions that are built at the same
+    time and ``sphinx_jobs`` is the value passed to each build's ``-j`` flag.
+    """
+    concurrent_builds = max(1, min(total_jobs, num_builds))
+    sphinx_jobs = max(1, total_jobs // concurrent_builds)
+    return concurrent_builds, sphinx_jobs
+
+
+def get_priority_order(metadata, latest_version_name=None):
+    """
+    Returns the names of all versions in the order in which readers most
+    likely need them: the latest version first, then unreleased versions
+    (e.g. development branches) and then released versions, both from newest
+    to oldest.
+    """
+
+    def get_key(item):
+        name, data = item
+        return (
+            name != latest_version_name,
+            bool(data["is_released"]),
+            -datetime.datetime.strptime(
+                data["creatordate"], sphinx.DATE_FMT
+            ).timestamp(),
+        )
+
+    return [name for name, _ in sorted(metadata.items(), key=get_key)]
+
+
+def get_staging_path(outputroot, name):
+    """
+    Returns the directory in which a version is built before it is published
+    by :func:`publish`.
+    """
+    return os.path.join(
+        outputroot, STAGING_DIRNAME, urllib.parse.quote(name, safe="")
+    )
+
+
+def _exchange_paths(src, dst):
+    libc = ctypes.CDLL(None, use_errno=True)
+    renameat2 = libc.renameat2
+    if (
+        renameat2(
+            AT_FDCWD,
+            os.fsencode(src),
+            AT_FDCWD,
+            os.fsencode(dst),
+            RENAME_EXCHANGE,
+        )
+        != 0
+    ):
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno), src)
+
+
+def publish(staging, outputdir):
+    """
+    Replaces ``outputdir`` with the freshly built ``staging`` directory.
+
+    On Linux, both directories are exchanged atomically, so that the
+    published version is never incomplete. On other platforms, the old
+    output is renamed out of the way first, so it's only missing for a very
+    short moment.
+    """
+    os.makedirs(os.path.dirname(outputdir), exist_ok=True)
+    if not os.path.exists(outputdir):
+        os.rename(staging, outputdir)
+        return
+
+    try:
+        _exchange_paths(staging, outputdir)
+    except (AttributeError, OSError) as err:
+        logger.debug("Failed to exchange %s atomically: %s", outputdir, err)
+        oldpath = "{}.old".format(staging)
+        os.rename(outputdir, oldpath)
+        os.rename(staging, outputdir)
+        shutil.rmtree(oldpath)
+    else:
+        # The staging path contains the old output now
+        shutil.rmtree(staging)
+
+
+def start_subprocess(command, job, stdout=None, stderr=None):
+    """
+    Start a build by running ``command`` (e.g. ``python -m sphinx``) with the
+    job's arguments in a new process.
+    """
+    return PopenProcess(
+        subprocess.Popen(
+            [*command, *job.args],
+            cwd=job.cwd,
+            env=job.env,
+            stdout=stdout,
+            stderr=stderr,
+        )
+    )
+
+
+def preload(extensions=(), exclude_path=None):
+    """
+    Import Sphinx and the given extensions into the current process, so that
+    forked builds don't need to import them again.
+
+    Extensions that can't be imported or that are located in
+    ``exclude_path`` (e.g. local extensions in the git repository, which
+    might differ between versions) are skipped and left to the build.
+    """
+    for name in (*PRELOAD_MODULES, *extensions):
+        if name in sys.modules:
+            continue
+        try:
+            spec = importlib.util.find_spec(name)
+            if spec is None:
+                logger.debug("Not preloading %s: not found", name)
+                continue
+            if exclude_path and spec.origin and os.path.isabs(spec.origin):
+                path = os.path.abspath(spec.origin)
+                if os.path.commonpath((path, exclude_path)) == exclude_path:
+                    logger.debug("Not preloading local extension %s", name)
+                    continue
+            importlib.import_module(name)
+        except Exception as err:
+            logger.debug("Not preloading %s: %s", name, err)
+            continue
+        logger.debug("Preloaded %s", name)
+
+
+def run_sphinx_build(args):
+    from sphinx.cmd import build as sphinx_build
+
+    return sphinx_build.build_main(list(args))
+
+
+class ChildProcess:
+    """
+    Waits for a child process and keeps its resource usage (if the platform
+    supports :func:`os.wait4`). Provides the parts of the
+    :class:`subprocess.Popen` interface used by the build runners.
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+        self.rusage = None
+
+    def _reap(self, block):
+        options = 0 if block else os.WNOHANG
+        if hasattr(os, "wait4"):
+            pid, status, rusage = os.wait4(self.pid, options)
+        else:
+            (pid, status), rusage = os.waitpid(self.pid, options), None
+        if pid == 0:
+            return
+
+        if os.WIFSIGNALED(status):
+            self.returncode = -os.WTERMSIG(status)
+        else:
+            self.returncode = os.WEXITSTATUS(status)
+        self.rusage = rusage
+
+    def poll(self):
+        if self.returncode is None:
+            self._reap(block=False)
+        return self.returncode
+
+    def wait(self):
+        if self.returncode is None:
+            self._reap(block=True)
+        return self.returncode
+
+
+class PopenProcess(ChildProcess):
+    """
+    Wraps a :class:`subprocess.Popen` object, so that its resource usage can
+    be retrieved when it's reaped.
+    """
+
+    def __init__(self, popen):
+        super().__init__(popen.pid)
+        self.popen = popen
+
+    def _reap(self, block):
+        if not hasattr(os, "wait4"):
+            self.returncode = self.popen.wait() if block else self.popen.poll()
+            return
+
+        super()._reap(block)
+        if self.returncode is not None:
+            # Make sure that Popen doesn't try to reap it again
+            self.popen.returncode = self.returncode
+
+
+class ForkedProcess(ChildProcess):
+    """
+    Runs ``target(args)`` in a forked child process with the given working
+    directory, environment and output files.
+    """
+
+    def __init__(self, target, args, cwd, env, stdout=None, stderr=None):
+        self.args = args
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            self._run_child(target, args, cwd, env, stdout, stderr)
+        super().__init__(pid)
+
+    @staticmethod
+    def _run_child(target, args, cwd, env, stdout, stderr):
+        returncode = 1
+        try:
+            if stdout is not None:
+                os.dup2(stdout.fileno(), sys.stdout.fileno())
+            if stderr is not None:
+                os.dup2(stderr.fileno(), sys.stderr.fileno())
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(env)
+            # Mimic "python -m", which puts the working directory on the path
+            sys.path.insert(0, cwd)
+            returncode = target(args)
+        except SystemExit as err:
+            if err.code is None:
+                returncode = 0
+            elif isinstance(err.code, int):
+                returncode = err.code
+            else:
+                sys.stderr.write("{}\n".format(err.code))
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(returncode or 0)
+
+
+def start_fork(job, stdout=None, stderr=None):
+    """
+    Start a build by forking the current process and calling
+    :func:`sphinx.cmd.build.build_main` in the child.
+    """
+    return ForkedProcess(
+        run_sphinx_build, job.args, job.cwd, job.env, stdout, stderr
+    )
+
+
+def run_sequential(jobs, start, on_finished=None):
+    """
+    Run the jobs one after another. Jobs returned by ``on_finished`` are
+    run next. Returns the names of all jobs that failed.
+    """
+    pending = list(jobs)
+    failed = []
+    while pending:
+        job = pending.pop(0)
+        started = time.perf_counter()
+        proc = start(job)
+        returncode = proc.wait()
+        if returncode != 0:
+            logger.error(
+                "sphinx-build for %s failed with exit code %d",
+                job.name,
+                returncode,
+            )
+            failed.append(job.name)
+        if on_finished:
+            follow_ups = on_finished(
+                job,
+                BuildResult(
+                    returncode,
+                    started,
+                    time.perf_counter(),
+                    proc.rusage,
+                    None,
+                ),
+            )
+            pending[:0] = follow_ups or ()
+    return failed
+
+
+def _write_log(job, returncode, stdout_path, stderr_path):
+    sys.stdout.write(
+        "==> sphinx-build for {} (exit code {}) <==\n".format(
+            job.name, returncode
+        )
+    )
+    for path, stream in (
+        (stdout_path, sys.stdout),
+        (stderr_path, sys.stderr),
+    ):
+        stream.flush()
+        with open(path, mode="r", errors="replace") as fp:
+            shutil.copyfileobj(fp, stream)
+        stream.flush()
+
+
+def get_process_tree_rss(pids):
+    """
+    Returns a dict that maps each of the given ``pids`` to the resident set
+    size (in bytes) of that process and all of its descendants, or ``None``
+    if the platform doesn't provide :file:`/proc`.
+    """
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return None
+
+    pagesize = os.sysconf("SC_PAGE_SIZE")
+    children = collections.defaultdict(list)
+    rss = {}
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(entry), mode="rb") as fp:
+                stat = fp.read()
+        except OSError:
+            continue
+        # The command name might contain spaces, so split after it
+        fields = stat[stat.rindex(b")") + 2 :].split()
+        pid = int(entry)
+        children[int(fields[1])].append(pid)
+        rss[pid] = int(fields[21]) * pagesize
+
+    result = {}
+    for pid in pids:
+        total = 0
+        stack = [pid]
+        while stack:
+            current = stack.pop()
+            total += rss.get(current, 0)
+            stack.extend(children.get(current, ()))
+        result[pid] = total
+    return result
+
+
+def run_parallel(
+    jobs,
+    start,
+    max_workers,
+    logdir,
+    on_finished=None,
+    memory_limit=None,
+    peak_rss=None,
+):
+    """
+    Run up to ``max_workers`` jobs concurrently. Each build is started by
+    calling ``start(job, stdout, stderr)``, e.g. :func:`start_fork`.
+
+    The output of each build is captured into separate log files in
+    ``logdir`` and written to stdout/stderr as a whole once the build has
+    finished, so that the output of concurrent builds does not interleave.
+
+    If ``memory_limit`` is given, a build is only started if the predicted
+    memory usage of all running builds stays below the limit. Predictions are
+    taken from ``peak_rss`` (a dict that maps job names to the peak RSS of
+    previous builds), and the current RSS of each running build is used if
+    it's higher. Unknown jobs are expected to need as much memory as the
+    largest known job, or an even share of the limit if there is none.
+
+    If given, ``on_finished`` is called with the job and its
+    :class:`BuildResult` after each build. The jobs it returns are started
+    before the remaining ones. Returns the names of all jobs that failed.
+    """
+    peak_rss = {} if peak_rss is None else peak_rss
+
+    def predict(job):
+        if job.name in peak_rss:
+            return peak_rss[job.name]
+        if peak_rss:
+            return max(peak_rss.values())
+        return memory_limit // max_workers
+
+    counter = itertools.count()
+    pending = [(next(counter), job) for job in jobs]
+    running = []
+    failed = []
+    last_sample = 0
+    while pending or running:
+        while pending and len(running) < max_workers:
+            choice = 0
+            if memory_limit is not None and running:
+                used = sum(
+                    max(predict(item["job"]), item["rss"]) for item in running
+                )
+                # Start the first pending job that fits
+                choice = next(
+                    (
+                        i
+                        for i, (_, job) in enumerate(pending)
+                        if used + predict(job) <= memory_limit
+                    ),
+                    None,
+                )
+                if choice is None:
+                    break
+            elif memory_limit is not None:
+                if predict(pending[0][1]) > memory_limit:
+                    logger.warning(
+                        "sphinx-build for %s might exceed the memory limit",
+                        pending[0][1].name,
+                    )
+
+            index, job = pending.pop(choice)
+            stdout_path = os.path.join(logdir, "{}.out.log".format(index))
+            stderr_path = os.path.join(logdir, "{}.err.log".format(index))
+            with open(stdout_path, mode="wb") as out:
+                with open(stderr_path, mode="wb") as err:
+                    started = time.perf_counter()
+                    proc = start(job, stdout=out, stderr=err)
+            logger.debug("Started sphinx-build for %s", job.name)
+            running.append(
+                {
+                    "job": job,
+                    "proc": proc,
+                    "started": started,
+                    "stdout_path": stdout_path,
+                    "stderr_path": stderr_path,
+                    "rss": 0,
+                    "peak_rss": 0,
+                }
+            )
+
+        time.sleep(POLL_INTERVAL)
+        if memory_limit is not None and (
+            time.perf_counter() - last_sample >= MEMORY_POLL_INTERVAL
+        ):
+            last_sample = time.perf_counter()
+            rss = get_process_tree_rss(item["proc"].pid for item in running)
+            for item in running if rss is not None else ():
+                item["rss"] = rss[item["proc"].pid]
+                item["peak_rss"] = max(item["peak_rss"], item["rss"])
+
+        still_running = []
+        for item in running:
+            job, proc = item["job"], item["proc"]
+            returncode = proc.poll()
+            if returncode is None:
+                still_running.append(item)
+                continue
+
+            _write_log(
+                job, returncode, item["stdout_path"], item["stderr_path"]
+            )
+            if returncode != 0:
+                logger.error(
+                    "sphinx-build for %s failed with exit code %d",
+                    job.name,
+                    returncode,
+                )
+                failed.append(job.name)
+
+            result = BuildResult(
+                returncode,
+                item["started"],
+                time.perf_counter(),
+                proc.rusage,
+                item["peak_rss"] or None,
+            )
+            if result.get_peak_rss():
+                peak_rss[job.name] = result.get_peak_rss()
+            if on_finished:
+                pending[:0] = [
+                    (next(counter), follow_up)
+                    for follow_up in on_finished(job, result) or ()
+                ]
+        running = still_running
+
+    return failed
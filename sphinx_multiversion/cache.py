@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import string
+import time
+import types
+import urllib.parse
+
+import sphinx
+
+from . import fileutil
+from . import git
+
+STATE_FILENAME = "state.json"
+
+# Config values used for generating the metadata
+CONFIG_CACHE_FIELDS = (
+    "version",
+    "release",
+    "rst_prolog",
+    "source_suffix",
+)
+
+logger = logging.getLogger(__name__)
+
+
+def size_argument(value):
+    """
+    Parses a size like ``500M`` or ``2G`` into a number of bytes.
+    """
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    value = value.strip().upper()
+    if value.endswith("B"):
+        value = value[:-1]
+    factor = units.get(value[-1:], 1)
+    if value[-1:] in units:
+        value = value[:-1]
+    return int(float(value) * factor)
+
+
+def get_entry_path(cachedir, gitref):
+    return os.path.join(
+        cachedir, "refs", urllib.parse.quote(gitref.refname, safe="")
+    )
+
+
+def get_source_path(entry):
+    return os.path.join(entry, "src")
+
+
+def get_doctree_path(entry):
+    return os.path.join(entry, "doctrees")
+
+
+def load_state(entry):
+    try:
+        with open(os.path.join(entry, STATE_FILENAME), mode="r") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(entry, state):
+    path = os.path.join(entry, STATE_FILENAME)
+    with fileutil.atomic_write(path) as fp:
+        json.dump(state, fp)
+
+
+def update_checkout(gitroot, entry, gitref, store=None, paths=(".",)):
+    """
+    Materializes the files below ``paths`` in the tree of ``gitref`` in the
+    cache ``entry``.
+
+    The source directory of each ref stays at the same path across runs and
+    only files whose blob changed since the previous run are rewritten, so
+    that Sphinx can reuse its pickled environment and only needs to re-read
+    the changed documents.
+
+    If ``store`` is given, new checkouts are hardlinked from that object
+    store (see :func:`git.link_tree`). Changed files are always written
+    directly, because a hardlinked file might still have an old
+    modification time.
+
+    Returns the number of bytes written.
+    """
+    srcdir = get_source_path(entry)
+    state = load_state(entry)
+    paths = list(paths)
+    if (
+        state is not None
+        and state.get("commit") == gitref.commit
+        and state.get("paths", ["."]) == paths
+        and os.path.isdir(srcdir)
+    ):
+        logger.debug("Reusing cached checkout of %s", gitref.refname)
+        state["last_used"] = time.time()
+        save_state(entry, state)
+        return 0
+
+    entries = [
+        tree_entry
+        for tree_entry in git.get_tree_entries(gitroot, gitref.commit, paths)
+        if tree_entry.type == "blob"
+    ]
+    new_files = {
+        tree_entry.path: "{} {}".format(tree_entry.mode, tree_entry.object)
+        for tree_entry in entries
+    }
+    if state is None or not os.path.isdir(srcdir):
+        logger.debug("Creating cached checkout of %s", gitref.refname)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.makedirs(entry)
+        if store is not None:
+            written = git.link_tree(gitroot, srcdir, gitref, store, paths)
+        else:
+            written = git.copy_tree(gitroot, gitroot, srcdir, gitref, paths)
+    else:
+        old_files = state.get("files", {})
+        changed = [
+            tree_entry
+            for tree_entry in entries
+            if old_files.get(tree_entry.path) != new_files[tree_entry.path]
+        ]
+
+        # Forget about files that are about to change, so that they are
+        # rewritten on the next run if the update is interrupted
+        save_state(
+            entry,
+            {
+                "refname": gitref.refname,
+                "commit": None,
+                "paths": paths,
+                "files": {
+                    path: obj
+                    for path, obj in old_files.items()
+                    if path not in new_files or new_files[path] == obj
+                },
+                "last_used": time.time(),
+            },
+        )
+
+        for path in old_files:
+            if path not in new_files:
+                fileutil.remove_file(srcdir, path)
+        logger.debug(
+            "Updating %d files in cached checkout of %s",
+            len(changed),
+            gitref.refname,
+        )
+        written = git.write_blobs(gitroot, changed, srcdir)
+
+    save_state(
+        entry,
+        {
+            "refname": gitref.refname,
+            "commit": gitref.commit,
+            "paths": paths,
+            "files": new_files,
+            "last_used": time.time(),
+        },
+    )
+    return written
+
+
+def get_object_store_path(cachedir):
+    return os.path.join(cachedir, "objects")
+
+
+def get_config_fields(outputdir_format):
+    """
+    Returns the names of all config values that need to be cached, including
+    the ones referenced as ``{config.<name>}`` in ``outputdir_format``.
+    """
+    fields = list(CONFIG_CACHE_FIELDS)
+    for _, field_name, _, _ in string.Formatter().parse(outputdir_format):
+        if not field_name:
+            continue
+        obj, _, attr = field_name.partition(".")
+        name = attr.partition(".")[0].partition("[")[0]
+        if obj == "config" and name and name not in fields:
+            fields.append(name)
+    return fields
+
+
+def get_config_key(tree, confoverrides, fields):
+    """
+    Returns the cache key for the config in the confdir with the given
+    ``tree`` object ID.
+    """
+    from . import __version__
+
+    data = json.dumps(
+        {
+            "tree": tree,
+            "confoverrides": confoverrides,
+            "fields": fields,
+            "sphinx_multiversion_version": __version__,
+            "sphinx_version": sphinx.__version__,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def get_config_path(cachedir, key):
+    return os.path.join(cachedir, "configs", "{}.json".format(key))
+
+
+def load_config(cachedir, key):
+    """
+    Returns the cached config values for ``key`` as namespace object, or
+    None if they are not cached.
+    """
+    path = get_config_path(cachedir, key)
+    try:
+        with open(path, mode="r") as fp:
+            values = json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return types.SimpleNamespace(**values)
+
+
+def save_config(cachedir, key, config, fields):
+    try:
+        data = json.dumps({field: getattr(config, field) for field in fields})
+    except (AttributeError, TypeError, ValueError):
+        logger.debug("Not caching config %s, it's not serializable", key)
+        return
+
+    path = get_config_path(cachedir, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with fileutil.atomic_write(path) as fp:
+        fp.write(data)
+
+
+def get_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for filename in files:
+            try:
+                size += os.lstat(os.path.join(root, filename)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def evict(cachedir, max_age=None, max_size=None, keep=()):
+    """
+    Removes cache entries that were not used for more than ``max_age``
+    seconds, and then removes the least recently used entries until the total
+    size of the cache is below ``max_size`` bytes. Entries in ``keep`` are
+    never removed.
+    """
+    refsdir = os.path.join(cachedir, "refs")
+    if os.path.isdir(refsdir):
+        _evict_refs(refsdir, max_age, max_size, keep)
+    _collect_objects(get_object_store_path(cachedir))
+    if max_age is not None:
+        _evict_configs(os.path.join(cachedir, "configs"), max_age)
+
+
+def _evict_configs(configdir, max_age):
+    if not os.path.isdir(configdir):
+        return
+
+    now = time.time()
+    for filename in os.listdir(configdir):
+        path = os.path.join(configdir, filename)
+        try:
+            if now - os.stat(path).st_mtime > max_age:
+                os.unlink(path)
+        except OSError:
+            pass
+
+
+def _collect_objects(store):
+    """
+    Removes all objects from the object store that are no longer hardlinked
+    into any checkout.
+    """
+    if not os.path.isdir(store):
+        return
+
+    for root, dirs, files in os.walk(store):
+        for filename in files:
+            path = os.path.join(root, filename)
+            try:
+                if os.lstat(path).st_nlink == 1:
+                    os.unlink(path)
+            except OSError:
+                pass
+
+
+def _evict_refs(refsdir, max_age, max_size, keep):
+    keep = {os.path.abspath(entry) for entry in keep}
+    entries = []
+    for name in os.listdir(refsdir):
+        entry = os.path.abspath(os.path.join(refsdir, name))
+        state = load_state(entry) or {}
+        entries.append((state.get("last_used", 0), entry))
+    entries.sort()
+
+    now = time.time()
+    remaining = []
+    for last_used, entry in entries:
+        if (
+            entry not in keep
+            and max_age is not None
+            and now - last_used > max_age
+        ):
+            logger.debug("Evicting cache entry %s (too old)", entry)
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            remaining.append((last_used, entry))
+
+    if max_size is None:
+        return
+
+    sizes = {entry: get_size(entry) for _, entry in remaining}
+    total_size = sum(sizes.values())
+    for last_used, entry in remaining:
+        if total_size <= max_size:
+            break
+        if entry in keep:
+            continue
+        logger.debug("Evicting cache entry %s (cache too large)", entry)
+        shutil.rmtree(entry, ignore_errors=True)
+        total_size -= sizes[entry]
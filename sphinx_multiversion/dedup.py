@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import collections
+import functools
+import hashlib
+import logging
+import os
+import posixpath
+import re
+import shutil
+import stat
+
+from . import fileutil
+
+SHARED_DIRNAME = "_shared"
+
+# Only leaf assets are moved to the shared directory. Scripts stay in place,
+# because they often load other files relative to their own location.
+SHARED_EXTENSIONS = (
+    ".css",
+    ".gif",
+    ".ico",
+    ".jpeg",
+    ".jpg",
+    ".otf",
+    ".png",
+    ".svg",
+    ".ttf",
+    ".webp",
+    ".woff",
+    ".woff2",
+)
+
+# References in HTML attributes and CSS files, only relative URLs are
+# considered (i.e. no scheme, no absolute path and no fragment-only links)
+HTML_REF_REGEX = re.compile(
+    r"""(?P<prefix>\b(?:src|href)=(?P<quote>["']))"""
+    r"""(?P<url>(?![a-zA-Z][a-zA-Z0-9+.-]*:|/|#)[^"'?#]+)"""
+    r"""(?P<suffix>[^"']*)(?P=quote)"""
+)
+CSS_REF_REGEX = re.compile(
+    r"""url\(\s*["']?(?P<url>(?![a-zA-Z][a-zA-Z0-9+.-]*:|/|#)[^"')?#]+)"""
+)
+
+FileInfo = collections.namedtuple(
+    "FileInfo",
+    [
+        "path",
+        "size",
+        "mode",
+        "dev",
+        "ino",
+    ],
+)
+
+logger = logging.getLogger(__name__)
+
+
+def iter_files(outputdirs, exclude=()):
+    """
+    Yields a :class:`FileInfo` for each regular file in ``outputdirs``.
+
+    Hidden files and directories (e.g. :file:`.doctrees` and
+    :file:`.buildinfo`) and directories in ``exclude`` are skipped, as well
+    as nested output directories of other versions, so that each file is
+    only returned once.
+    """
+    outputdirs = sorted({os.path.abspath(path) for path in outputdirs})
+    skipped = set(outputdirs) | {os.path.abspath(path) for path in exclude}
+    for outputdir in outputdirs:
+        for root, dirs, files in os.walk(outputdir):
+            dirs[:] = sorted(
+                name
+                for name in dirs
+                if not name.startswith(".")
+                and os.path.join(root, name) not in skipped
+            )
+            for name in sorted(files):
+                if name.startswith("."):
+                    continue
+                path = os.path.join(root, name)
+                st = os.lstat(path)
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                yield FileInfo(
+                    path,
+                    st.st_size,
+                    stat.S_IMODE(st.st_mode),
+                    st.st_dev,
+                    st.st_ino,
+                )
+
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, mode="rb") as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def find_duplicates(files):
+    """
+    Returns a dict that maps content hashes to lists of :class:`FileInfo`
+    objects with identical content and permissions. Only files whose size
+    occurs more than once are hashed.
+    """
+    by_size = collections.defaultdict(list)
+    for info in files:
+        if info.size > 0:
+            by_size[(info.size, info.mode)].append(info)
+
+    groups = collections.defaultdict(list)
+    for candidates in by_size.values():
+        if len(candidates) < 2:
+            continue
+        for info in candidates:
+            groups[hash_file(info.path)].append(info)
+    return {
+        digest: group for digest, group in groups.items() if len(group) > 1
+    }
+
+
+def _replace_with_link(src, dst):
+    with fileutil.replacing(dst) as tmppath:
+        os.link(src, tmppath)
+
+
+def link_duplicates(groups):
+    """
+    Replaces all files in each group with hardlinks to the first file.
+
+    Returns the number of bytes that are saved by the new hardlinks.
+    """
+    saved = 0
+    for group in groups.values():
+        first = group[0]
+        for info in group[1:]:
+            if (info.dev, info.ino) == (first.dev, first.ino):
+                continue
+            try:
+                _replace_with_link(first.path, info.path)
+            except OSError as err:
+                logger.debug("Failed to link %s: %s", info.path, err)
+                continue
+            saved += info.size
+    return saved
+
+
+def unshare_tree(path):
+    """
+    Replaces hardlinked files in ``path`` with private copies.
+
+    Sphinx overwrites existing output files in place, so this needs to be
+    done before rebuilding a version whose output has been deduplicated, or
+    the build would modify the files of other versions, too.
+    """
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            filepath = os.path.join(root, name)
+            st = os.lstat(filepath)
+            if not stat.S_ISREG(st.st_mode) or st.st_nlink < 2:
+                continue
+            with fileutil.replacing(filepath) as tmppath:
+                shutil.copy2(filepath, tmppath)
+
+
+def _resolve(basedir, url):
+    return os.path.normpath(os.path.join(basedir, *url.split("/")))
+
+
+def _read_text(path):
+    with open(
+        path, mode="r", encoding="utf-8", errors="surrogateescape"
+    ) as fp:
+        return fp.read()
+
+
+def _write_text(path, content):
+    with fileutil.atomic_write(
+        path, mode="w", encoding="utf-8", errors="surrogateescape"
+    ) as fp:
+        fp.write(content)
+        shutil.copymode(path, fp.name)
+
+
+def iter_html_files(path):
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
+        for name in files:
+            if name.endswith(".html"):
+                yield os.path.join(root, name)
+
+
+def share_duplicates(outputroot, files, groups):
+    """
+    Moves duplicate files to a content-addressed :file:`_shared` directory
+    in ``outputroot`` and rewrites the references in HTML files.
+
+    Only leaf assets (see :data:`SHARED_EXTENSIONS`) that are exclusively
+    referenced from ``src`` or ``href`` attributes in HTML files are moved.
+    Files that are referenced from CSS files or that contain relative
+    references themselves (CSS files with ``url(...)``) stay where they
+    are. Shared files that are no longer
+    referenced from any HTML file in ``outputroot`` are removed.
+
+    Returns the number of bytes saved and the paths of the rewritten files.
+    """
+    outputroot = os.path.abspath(outputroot)
+    shareddir = os.path.join(outputroot, SHARED_DIRNAME)
+
+    referenced = set()
+    pinned = set()
+    html_files = []
+    for info in files:
+        basedir = os.path.dirname(info.path)
+        if info.path.endswith(".html"):
+            html_files.append(info.path)
+            for match in HTML_REF_REGEX.finditer(_read_text(info.path)):
+                referenced.add(_resolve(basedir, match.group("url")))
+        elif info.path.endswith(".css"):
+            content = _read_text(info.path)
+            for match in CSS_REF_REGEX.finditer(content):
+                pinned.add(_resolve(basedir, match.group("url")))
+            if CSS_REF_REGEX.search(content):
+                pinned.add(info.path)
+
+    moved = {}
+    saved = 0
+    for digest, group in groups.items():
+        paths = [info.path for info in group]
+        if any(
+            not path.lower().endswith(SHARED_EXTENSIONS)
+            or path in pinned
+            or path not in referenced
+            for path in paths
+        ):
+            continue
+
+        extension = os.path.splitext(paths[0])[1]
+        sharedpath = os.path.join(
+            shareddir, digest[:2], "{}{}".format(digest[2:], extension)
+        )
+        if not os.path.exists(sharedpath):
+            os.makedirs(os.path.dirname(sharedpath), exist_ok=True)
+            with fileutil.replacing(sharedpath) as tmppath:
+                shutil.copy2(paths[0], tmppath)
+        for path in paths:
+            moved[path] = sharedpath
+        saved += group[0].size * (len(group) - 1)
+
+    def replace_ref(basedir, match):
+        path = moved.get(_resolve(basedir, match.group("url")))
+        if path is None:
+            return match.group(0)
+        url = posixpath.join(*os.path.relpath(path, basedir).split(os.sep))
+        return "{}{}{}{}".format(
+            match.group("prefix"),
+            url,
+            match.group("suffix"),
+            match.group("quote"),
+        )
+
+    rewritten = set()
+    if moved:
+        for path in html_files:
+            basedir = os.path.dirname(path)
+            content = _read_text(path)
+            new_content = HTML_REF_REGEX.sub(
+                functools.partial(replace_ref, basedir), content
+            )
+            if new_content != content:
+                _write_text(path, new_content)
+                rewritten.add(path)
+        for path in moved:
+            os.unlink(path)
+
+    # Remove shared files that aren't used anymore
+    if os.path.isdir(shareddir):
+        used = set()
+        for path in iter_html_files(outputroot):
+            if path.startswith(shareddir + os.sep):
+                continue
+            basedir = os.path.dirname(path)
+            for match in HTML_REF_REGEX.finditer(_read_text(path)):
+                used.add(_resolve(basedir, match.group("url")))
+        for root, dirs, names in os.walk(shareddir, topdown=False):
+            for name in names:
+                path = os.path.join(root, name)
+                if path not in used:
+                    os.unlink(path)
+            if root != shareddir and not os.listdir(root):
+                os.rmdir(root)
+
+    return saved, set(moved) | rewritten
+
+
+def deduplicate(outputroot, outputdirs, mode="hardlink"):
+    """
+    Deduplicates identical files across the output directories of all
+    versions, either by hardlinking them (``hardlink``) or by moving them to
+    a shared directory (``shared``, see :func:`share_duplicates`) and
+    hardlinking the rest.
+
+    Returns the number of bytes saved by this pass.
+    """
+    shareddir = os.path.join(os.path.abspath(outputroot), SHARED_DIRNAME)
+    files = list(iter_files(outputdirs, exclude=(shareddir,)))
+    groups = find_duplicates(files)
+    saved = 0
+    if mode == "shared":
+        saved, changed = share_duplicates(outputroot, files, groups)
+        groups = {
+            digest: [info for info in group if info.path not in changed]
+            for digest, group in groups.items()
+        }
+
+    return saved + link_duplicates(
+        {digest: group for digest, group in groups.items() if len(group) > 1}
+    )
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import contextlib
+import os
+import threading
+
+
+def get_tmppath(path):
+    """
+    Returns a temporary path next to ``path``, which is unique to the
+    current process and thread.
+    """
+    return "{}.{}-{}.tmp".format(path, os.getpid(), threading.get_ident())
+
+
+@contextlib.contextmanager
+def replacing(path):
+    """
+    Yields a temporary path that atomically replaces ``path`` once the
+    ``with`` block has finished successfully.
+
+    The temporary file is removed if an exception occurs.
+    """
+    tmppath = get_tmppath(path)
+    try:
+        yield tmppath
+        os.replace(tmppath, path)
+    except BaseException:
+        try:
+            os.unlink(tmppath)
+        except OSError:
+            pass
+        raise
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode="w", **kwargs):
+    """
+    Opens a temporary file for writing that atomically replaces ``path`` once
+    the ``with`` block has finished successfully.
+    """
+    with replacing(path) as tmppath:
+        with open(tmppath, mode=mode, **kwargs) as fp:
+            yield fp
+
+
+def remove_file(root, relpath):
+    """
+    Removes the file at the ``/``-separated ``relpath`` below ``root`` and
+    all of its parent directories that became empty.
+    """
+    path = os.path.join(root, *relpath.split("/"))
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+    # Remove parent directories that became empty
+    parent = os.path.dirname(path)
+    while parent != root:
+        try:
+            os.rmdir(parent)
+        except OSError:
+            break
+        parent = os.path.dirname(parent)
@@ -27,12 +27,33 @@
 
 import collections
 import datetime
+import functools
+import io
 import logging
 import os
+import posixpath
 import re
+import shutil
 import subprocess
+import sys
 import tarfile
-import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from . import fileutil
+
+TreeEntry = collections.namedtuple(
+    "TreeEntry",
+    [
+        "mode",
+        "type",
+        "object",
+        "path",
+    ],
+)
 
 GitRef = collections.namedtuple(
     "VersionRef",
@@ -48,6 +69,9 @@ GitRef = collections.namedtuple(
 
 logger = logging.getLogger(__name__)
 
+# ioctl request code for creating a reflink on Linux (see ioctl_ficlone(2))
+FICLONE = 0x40049409 if fcntl is not None and sys.platform == "linux" else None
+
 
 def get_toplevel_path(cwd=None):
     cmd = (
@@ -59,124 +83,457 @@ def get_toplevel_path(cwd=None):
     return output.rstrip("\n")
 
 
-def get_all_refs(gitroot):
+def get_common_dir(cwd=None):
+    """
+    Returns the absolute path of the git directory that contains the refs
+    (which is shared between all worktrees).
+    """
+    cmd = (
+        "git",
+        "rev-parse",
+        "--git-common-dir",
+    )
+    output = subprocess.check_output(cmd, cwd=cwd).decode()
+    return os.path.abspath(os.path.join(cwd or ".", output.rstrip("\n")))
+
+
+def get_object_ids(gitroot, revs):
+    """
+    Resolves all ``revs`` (e.g. ``<commit>:<path>``) to object IDs using a
+    single ``git cat-file --batch-check`` call.
+
+    The revs are passed via stdin, so that the command line doesn't exceed
+    the length limit (e.g. on Windows) if there are many of them.
+    """
+    if not revs:
+        return []
+
+    cmd = (
+        "git",
+        "cat-file",
+        "--batch-check=%(objectname)",
+    )
+    proc = subprocess.run(
+        cmd,
+        cwd=gitroot,
+        input="".join("{}\n".format(rev) for rev in revs).encode(),
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    object_ids = proc.stdout.decode().splitlines()
+    for rev, object_id in zip(revs, object_ids):
+        if not re.match(r"^[0-9a-f]+$", object_id):
+            raise OSError("Failed to resolve {}".format(rev))
+    return object_ids
+
+
+def get_remotes(gitroot):
+    cmd = (
+        "git",
+        "remote",
+    )
+    output = subprocess.check_output(cmd, cwd=gitroot).decode()
+    return output.split()
+
+
+@functools.lru_cache(maxsize=None)
+def _get_timezone(offset):
+    sign = -1 if offset.startswith("-") else 1
+    hours, minutes = int(offset[1:3]), int(offset[3:5])
+    return datetime.timezone(
+        sign * datetime.timedelta(hours=hours, minutes=minutes)
+    )
+
+
+def parse_raw_date(value):
+    """
+    Parses a date in git's raw format (e.g. ``1596811520 -0700``).
+    """
+    timestamp, _, offset = value.partition(" ")
+    return datetime.datetime.fromtimestamp(
+        int(timestamp), tz=_get_timezone(offset or "+0000")
+    )
+
+
+def _iter_refs(gitroot, patterns):
+    """
+    Yields ``(commit, refname, source, name, rawdate)`` tuples for all
+    branches and tags matching ``patterns``, without parsing their dates.
+    """
     cmd = (
         "git",
         "for-each-ref",
         "--format",
-        "%(objectname)\t%(refname)\t%(creatordate:iso)",
-        "refs",
+        "%(objectname)\t%(refname)\t%(creatordate:raw)",
+        *patterns,
     )
     output = subprocess.check_output(cmd, cwd=gitroot).decode()
     for line in output.splitlines():
-        is_remote = False
-        fields = line.strip().split("\t")
+        fields = line.split("\t")
         if len(fields) != 3:
             continue
-
-        commit = fields[0]
-        refname = fields[1]
-        creatordate = datetime.datetime.strptime(
-            fields[2], "%Y-%m-%d %H:%M:%S %z"
-        )
+        commit, refname, rawdate = fields
 
         # Parse refname
-        matchobj = re.match(
-            r"^refs/(heads|tags|remotes/[^/]+)/(\S+)$", refname
-        )
-        if not matchobj:
+        if refname.startswith("refs/heads/"):
+            source = "heads"
+            name = refname[len("refs/heads/") :]
+        elif refname.startswith("refs/tags/"):
+            source = "tags"
+            name = refname[len("refs/tags/") :]
+        elif refname.startswith("refs/remotes/"):
+            remote, _, name = refname[len("refs/remotes/") :].partition("/")
+            if not remote:
+                continue
+            source = "remotes/{}".format(remote)
+        else:
             continue
-        source = matchobj.group(1)
-        name = matchobj.group(2)
 
-        if source.startswith("remotes/"):
-            is_remote = True
+        if not name or not rawdate:
+            continue
+
+        yield commit, refname, source, name, rawdate
+
+
+def _make_ref(commit, refname, source, name, rawdate):
+    return GitRef(
+        name,
+        commit,
+        source,
+        source.startswith("remotes/"),
+        refname,
+        parse_raw_date(rawdate),
+    )
+
+
+def get_all_refs(gitroot, patterns=("refs",)):
+    for fields in _iter_refs(gitroot, patterns):
+        yield _make_ref(*fields)
+
 
-        yield GitRef(name, commit, source, is_remote, refname, creatordate)
+def _compile_whitelist(pattern):
+    if pattern is None:
+        return None
+    return re.compile(pattern).match
 
 
 def get_refs(
     gitroot, tag_whitelist, branch_whitelist, remote_whitelist, files=()
 ):
-    for ref in get_all_refs(gitroot):
-        if ref.source == "tags":
-            if tag_whitelist is None or not re.match(tag_whitelist, ref.name):
+    tag_match = _compile_whitelist(tag_whitelist)
+    branch_match = _compile_whitelist(branch_whitelist)
+    remote_match = _compile_whitelist(remote_whitelist)
+
+    # Only ask git for the namespaces that can contain matching refs
+    patterns = []
+    if tag_match is not None:
+        patterns.append("refs/tags")
+    if branch_match is not None:
+        patterns.append("refs/heads")
+        if remote_match is not None:
+            for remote in get_remotes(gitroot):
+                if not remote_match(remote):
+                    logger.debug(
+                        "Skipping remote '%s' because it doesn't match the "
+                        "whitelist pattern",
+                        remote,
+                    )
+                    continue
+                patterns.append("refs/remotes/{}".format(remote))
+    if not patterns:
+        return
+
+    candidates = []
+    for fields in _iter_refs(gitroot, patterns):
+        refname, source, name = fields[1:4]
+        if source == "tags":
+            if not tag_match(name):
                 logger.debug(
                     "Skipping '%s' because tag '%s' doesn't match the "
                     "whitelist pattern",
-                    ref.refname,
-                    ref.name,
-                )
-                continue
-        elif ref.source == "heads":
-            if branch_whitelist is None or not re.match(
-                branch_whitelist, ref.name
-            ):
-                logger.debug(
-                    "Skipping '%s' because branch '%s' doesn't match the "
-                    "whitelist pattern",
-                    ref.refname,
-                    ref.name,
+                    refname,
+                    name,
                 )
                 continue
-        elif ref.is_remote and remote_whitelist is not None:
-            remote_name = ref.source.partition("/")[2]
-            if not re.match(remote_whitelist, remote_name):
-                logger.debug(
-                    "Skipping '%s' because remote '%s' doesn't match the "
-                    "whitelist pattern",
-                    ref.refname,
-                    remote_name,
-                )
-                continue
-            if branch_whitelist is None or not re.match(
-                branch_whitelist, ref.name
-            ):
-                logger.debug(
-                    "Skipping '%s' because branch '%s' doesn't match the "
-                    "whitelist pattern",
-                    ref.refname,
-                    ref.name,
-                )
-                continue
-        else:
+        elif not branch_match(name):
             logger.debug(
-                "Skipping '%s' because its not a branch or tag", ref.refname
+                "Skipping '%s' because branch '%s' doesn't match the "
+                "whitelist pattern",
+                refname,
+                name,
             )
             continue
 
-        missing_files = [
-            filename
-            for filename in files
-            if filename != "."
-            and not file_exists(gitroot, ref.refname, filename)
-        ]
+        candidates.append(fields)
+
+    # Check all required files of all candidates in one go
+    files = [filename for filename in files if filename != "."]
+    existing = iter(
+        files_exist(
+            gitroot,
+            [
+                (fields[1], filename)
+                for fields in candidates
+                for filename in files
+            ],
+        )
+    )
+    for fields in candidates:
+        missing_files = [filename for filename in files if not next(existing)]
         if missing_files:
             logger.debug(
                 "Skipping '%s' because it lacks required files: %r",
-                ref.refname,
+                fields[1],
                 missing_files,
             )
             continue
 
-        yield ref
+        yield _make_ref(*fields)
 
 
 def file_exists(gitroot, refname, filename):
-    if os.sep != "/":
-        # Git requires / path sep, make sure we use that
-        filename = filename.replace(os.sep, "/")
+    return files_exist(gitroot, [(refname, filename)])[0]
+
+
+def files_exist(gitroot, queries):
+    """
+    Checks if the ``(refname, filename)`` pairs in ``queries`` exist.
+
+    All queries are streamed into a single ``git cat-file --batch-check``
+    process instead of spawning a new process for each of them.
+    """
+    if not queries:
+        return []
+
+    lines = []
+    for refname, filename in queries:
+        if os.sep != "/":
+            # Git requires / path sep, make sure we use that
+            filename = filename.replace(os.sep, "/")
+        lines.append("{}:{}\n".format(refname, filename))
 
     cmd = (
         "git",
         "cat-file",
-        "-e",
-        "{}:{}".format(refname, filename),
+        "--batch-check",
     )
     proc = subprocess.run(
-        cmd, cwd=gitroot, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        cmd,
+        cwd=gitroot,
+        input="".join(lines).encode(),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        check=True,
     )
-    return proc.returncode == 0
+    return [
+        bool(re.match(r"^[0-9a-f]+ \w+ \d+$", line))
+        for line in proc.stdout.decode().splitlines()
+    ]
+
+
+def get_tree_entries(gitroot, commit, paths=(".",)):
+    """
+    Returns the ``TreeEntry`` objects of all files below ``paths`` in the
+    given commit.
+    """
+    cmd = (
+        "git",
+        "ls-tree",
+        "-r",
+        "-z",
+        "--full-tree",
+        commit,
+        "--",
+        *paths,
+    )
+    output = subprocess.check_output(cmd, cwd=gitroot)
+    entries = []
+    for line in output.split(b"\0"):
+        if not line:
+            continue
+        info, _, path = line.partition(b"\t")
+        mode, objtype, obj = info.decode().split(" ")
+        entries.append(TreeEntry(mode, objtype, obj, os.fsdecode(path)))
+    return entries
+
+
+def get_tree_files(gitroot, commit, path="."):
+    """
+    Returns the sorted paths (relative to ``path``) of all files below
+    ``path`` in the given commit.
+
+    Symlinks to directories in the same commit are followed, like
+    :func:`os.walk` does with ``followlinks=True``. Symlinks that point
+    outside of the repository are listed as files, and dangling symlinks
+    and cycles are skipped.
+    """
+    root = posixpath.normpath(path)
+    files = []
+    pending = [(root, "", frozenset((root,)))]
+    while pending:
+        realpath, prefix, seen = pending.pop()
+        for entry in get_tree_entries(gitroot, commit, (realpath,)):
+            if entry.type != "blob":
+                continue
+            if entry.path == realpath:
+                # The symlink points to a file
+                relpath = prefix
+            elif realpath == ".":
+                relpath = entry.path
+            else:
+                relpath = posixpath.join(
+                    prefix, entry.path[len(realpath) + 1 :]
+                )
+            if entry.mode != "120000":
+                files.append(relpath)
+                continue
+
+            target = os.fsdecode(
+                subprocess.check_output(
+                    ("git", "cat-file", "blob", entry.object), cwd=gitroot
+                )
+            )
+            target = posixpath.normpath(
+                posixpath.join(posixpath.dirname(entry.path), target)
+            )
+            if posixpath.isabs(target) or target.split("/")[0] == "..":
+                files.append(relpath)
+            elif target not in seen:
+                pending.append((target, relpath, seen | {target}))
+    return sorted(files)
+
+
+def write_blobs(gitroot, entries, dst):
+    """
+    Writes the contents of the blob ``entries`` to their paths below ``dst``
+    using a single ``git cat-file --batch`` process.
+
+    Files are written to a temporary file first and then moved into place,
+    so that concurrent readers never see partially written files.
+
+    Returns the number of bytes written.
+    """
+    cmd = ("git", "cat-file", "--batch")
+    written = 0
+    with subprocess.Popen(
+        cmd, cwd=gitroot, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    ) as proc:
+        for entry in entries:
+            proc.stdin.write("{}\n".format(entry.object).encode())
+            proc.stdin.flush()
+            header = proc.stdout.readline().decode().split()
+            if len(header) != 3:
+                raise OSError(
+                    "Failed to read object {} for {}".format(
+                        entry.object, entry.path
+                    )
+                )
+            size = int(header[2])
+
+            path = os.path.join(dst, *entry.path.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with fileutil.replacing(path) as tmppath:
+                if entry.mode == "120000":
+                    os.symlink(os.fsdecode(proc.stdout.read(size)), tmppath)
+                else:
+                    with open(tmppath, mode="wb") as fp:
+                        remaining = size
+                        while remaining:
+                            chunk = proc.stdout.read(
+                                min(remaining, io.DEFAULT_BUFFER_SIZE)
+                            )
+                            if not chunk:
+                                raise OSError(
+                                    "Unexpected end of object {}".format(
+                                        entry.object
+                                    )
+                                )
+                            fp.write(chunk)
+                            remaining -= len(chunk)
+                    if entry.mode == "100755":
+                        os.chmod(tmppath, 0o755)
+            proc.stdout.read(1)  # Trailing newline
+            written += size
+        proc.stdin.close()
+    return written
+
+
+def get_object_path(store, entry):
+    """
+    Returns the path of a blob in the content-addressed object ``store``.
+
+    Executable files are stored separately, because all hardlinks to a file
+    share the same permissions.
+    """
+    suffix = "-x" if entry.mode == "100755" else ""
+    return os.path.join(
+        store, entry.object[:2], "{}{}".format(entry.object[2:], suffix)
+    )
+
+
+def _clone_file(src, dst):
+    """
+    Creates a copy of ``src`` at ``dst``, using a reflink if the filesystem
+    supports it.
+    """
+    if FICLONE is not None:
+        try:
+            with open(src, mode="rb") as srcfp, open(dst, mode="wb") as dstfp:
+                fcntl.ioctl(dstfp.fileno(), FICLONE, srcfp.fileno())
+            shutil.copymode(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+
+
+def link_tree(gitroot, dst, reference, store, paths=(".",)):
+    """
+    Materializes the files below ``paths`` in the tree of ``reference`` in
+    ``dst`` by hardlinking files from the content-addressed object ``store``.
+
+    Each blob is only written to the store once and shared between all
+    trees that contain it. If hardlinks are not possible (e.g. because the
+    store is on a different filesystem), files are reflinked or copied.
+    Files in the store are read-only, because modifying a hardlinked file
+    would modify it in all trees.
+
+    Returns the number of bytes written to the store.
+    """
+    entries = get_tree_entries(gitroot, reference.commit, paths)
+    missing = {}
+    for entry in entries:
+        if entry.type != "blob" or entry.mode == "120000":
+            continue
+        objpath = get_object_path(store, entry)
+        if objpath not in missing and not os.path.exists(objpath):
+            missing[objpath] = entry._replace(
+                path=os.path.relpath(objpath, store).replace(os.sep, "/")
+            )
+    written = write_blobs(gitroot, missing.values(), store)
+    for objpath in missing:
+        os.chmod(objpath, 0o555 if objpath.endswith("-x") else 0o444)
+
+    os.makedirs(dst, exist_ok=True)
+    symlinks = []
+    for entry in entries:
+        path = os.path.join(dst, *entry.path.split("/"))
+        if entry.type == "commit":
+            # Submodules are not included, just like with git archive
+            os.makedirs(path, exist_ok=True)
+            continue
+        if entry.mode == "120000":
+            symlinks.append(entry)
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        objpath = get_object_path(store, entry)
+        with fileutil.replacing(path) as tmppath:
+            try:
+                os.link(objpath, tmppath)
+            except OSError:
+                _clone_file(objpath, tmppath)
+    written += write_blobs(gitroot, symlinks, dst)
+    return written
 
 
 def no_fs_traversal(member: tarfile.TarInfo):
@@ -193,28 +550,54 @@ def no_fs_traversal(member: tarfile.TarInfo):
     )
 
 
-def copy_tree(gitroot, src, dst, reference, sourcepath="."):
-    with tempfile.SpooledTemporaryFile() as fp:
-        cmd = (
-            "git",
-            "archive",
-            "--format",
-            "tar",
-            reference.commit,
-            "--",
-            sourcepath,
-        )
-        subprocess.check_call(cmd, cwd=gitroot, stdout=fp)
-        fp.seek(0)
-        with tarfile.TarFile(fileobj=fp) as tarfp:
-            # This should be safe, but still causes a warning with medium
-            # severity due to <https://github.com/PyCQA/bandit/issues/1038>.
-            # Therefore we'll silence the warning.
-            tarfp.extractall(  # nosec
-                dst,
-                members=[
-                    member
-                    for member in tarfp.getmembers()
-                    if no_fs_traversal(member)
-                ],
-            )
+def copy_tree(gitroot, src, dst, reference, paths=(".",)):
+    """
+    Extracts the files below ``paths`` in the tree of ``reference`` to
+    ``dst`` using ``git archive``.
+
+    Returns the number of bytes of all extracted files.
+    """
+    cmd = (
+        "git",
+        "archive",
+        "--format",
+        "tar",
+        reference.commit,
+        "--",
+        *paths,
+    )
+    extracted = 0
+
+    def get_members(tarfp):
+        nonlocal extracted
+        for member in tarfp:
+            if no_fs_traversal(member):
+                if member.isfile():
+                    extracted += member.size
+                yield member
+
+    with subprocess.Popen(cmd, cwd=gitroot, stdout=subprocess.PIPE) as proc:
+        # Read the archive as a stream, so that members are extracted while
+        # git is still generating the rest of the archive.
+        try:
+            with tarfile.open(fileobj=proc.stdout, mode="r|") as tarfp:
+                # This should be safe, but still causes a warning with medium
+                # severity due to
+                # <https://github.com/PyCQA/bandit/issues/1038>.
+                # Therefore we'll silence the warning.
+                tarfp.extractall(dst, members=get_members(tarfp))  # nosec
+        except tarfile.TarError:
+            # The archive is empty or truncated if git failed
+            proc.communicate()
+            if proc.returncode != 0:
+                raise subprocess.CalledProcessError(proc.returncode, cmd)
+            raise
+
+        # Consume the end-of-archive padding, so that git doesn't fail with a
+        # broken pipe
+        while proc.stdout.read(io.DEFAULT_BUFFER_SIZE):
+            pass
+
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return extracted
@@ -27,23 +27,42 @@
 
 import itertools
 import argparse
+import concurrent.futures
 import multiprocessing
 import contextlib
+import functools
+import importlib.machinery
 import json
 import logging
 import os
 import pathlib
+import posixpath
 import re
+import shutil
 import string
 import subprocess
 import sys
 import tempfile
+import unicodedata
+import urllib.parse
+import threading
+import time
 
 from sphinx import config as sphinx_config
 from sphinx import project as sphinx_project
+from sphinx.util import matching as sphinx_matching
 
 from . import sphinx
 from . import git
+from . import build
+from . import cache
+from . import dedup
+from . import manifest
+from . import metadata as metadata_store
+from . import shard
+from . import timings
+from . import watch
+from . import workdir
 
 
 @contextlib.contextmanager
@@ -56,64 +75,163 @@ def working_dir(path):
         os.chdir(prev_cwd)
 
 
+def read_sphinx_config(confpath, confoverrides, add_defaults):
+    with working_dir(confpath):
+        current_config = sphinx_config.Config.read(
+            confpath,
+            confoverrides,
+        )
+
+    if add_defaults:
+        current_config.add(
+            "smv_tag_whitelist", sphinx.DEFAULT_TAG_WHITELIST, "html", str
+        )
+        current_config.add(
+            "smv_branch_whitelist",
+            sphinx.DEFAULT_TAG_WHITELIST,
+            "html",
+            str,
+        )
+        current_config.add(
+            "smv_remote_whitelist",
+            sphinx.DEFAULT_REMOTE_WHITELIST,
+            "html",
+            str,
+        )
+        current_config.add(
+            "smv_released_pattern",
+            sphinx.DEFAULT_RELEASED_PATTERN,
+            "html",
+            str,
+        )
+        current_config.add(
+            "smv_outputdir_format",
+            sphinx.DEFAULT_OUTPUTDIR_FORMAT,
+            "html",
+            str,
+        )
+        current_config.add("smv_prefer_remote_refs", False, "html", bool)
+        current_config.add("smv_latest_version", "master", "html", str)
+        current_config.add("smv_materialize_paths", [], "html", (list, tuple))
+        current_config.add("smv_static_versions", False, "html", bool)
+    current_config.pre_init_values()
+    current_config.init_values()
+    return current_config
+
+
 def load_sphinx_config_worker(q, confpath, confoverrides, add_defaults):
+    cpu_start = time.process_time()
     try:
-        with working_dir(confpath):
-            current_config = sphinx_config.Config.read(
-                confpath,
-                confoverrides,
-            )
-
-        if add_defaults:
-            current_config.add(
-                "smv_tag_whitelist", sphinx.DEFAULT_TAG_WHITELIST, "html", str
-            )
-            current_config.add(
-                "smv_branch_whitelist",
-                sphinx.DEFAULT_TAG_WHITELIST,
-                "html",
-                str,
-            )
-            current_config.add(
-                "smv_remote_whitelist",
-                sphinx.DEFAULT_REMOTE_WHITELIST,
-                "html",
-                str,
-            )
-            current_config.add(
-                "smv_released_pattern",
-                sphinx.DEFAULT_RELEASED_PATTERN,
-                "html",
-                str,
-            )
-            current_config.add(
-                "smv_outputdir_format",
-                sphinx.DEFAULT_OUTPUTDIR_FORMAT,
-                "html",
-                str,
-            )
-            current_config.add("smv_prefer_remote_refs", False, "html", bool)
-        current_config.pre_init_values()
-        current_config.init_values()
+        current_config = read_sphinx_config(
+            confpath, confoverrides, add_defaults
+        )
     except Exception as err:
         q.put(err)
         return
 
-    q.put(current_config)
+    q.put((current_config, time.process_time() - cpu_start))
 
 
-def load_sphinx_config(confpath, confoverrides, add_defaults=False):
-    q = multiprocessing.Queue()
-    proc = multiprocessing.Process(
-        target=load_sphinx_config_worker,
-        args=(q, confpath, confoverrides, add_defaults),
+def _is_local_module(module, roots):
+    """
+    Returns True if ``module`` is a pure-Python module or a namespace package
+    that has been loaded from below one of the ``roots``.
+    """
+    spec = getattr(module, "__spec__", None)
+    if spec is None or isinstance(
+        spec.loader, importlib.machinery.ExtensionFileLoader
+    ):
+        return False
+    if spec.has_location:
+        locations = [spec.origin]
+    else:
+        locations = list(spec.submodule_search_locations or ())
+    return bool(locations) and all(
+        os.path.abspath(location).startswith(roots) for location in locations
     )
-    proc.start()
-    proc.join()
-    result = q.get_nowait()
-    if isinstance(result, Exception):
-        raise result
-    return result
+
+
+def load_sphinx_config_task(confpath, confoverrides, add_defaults):
+    """
+    Reads a config inside a worker of the config loader pool. Returns the
+    config and the CPU time spent reading it.
+
+    Changes made to ``sys.path`` and ``os.environ`` by the :file:`conf.py`
+    are reverted afterwards, and pure-Python modules that were imported from
+    the conf dir or from a path that it added to ``sys.path`` are removed, so
+    that the next config imports its own version of them. Other modules
+    (e.g. installed packages with C extensions, which often can't be loaded
+    twice) stay loaded, so that they are only imported once per worker.
+    """
+    modules = set(sys.modules)
+    path = sys.path.copy()
+    environ = os.environ.copy()
+    cpu_start = time.process_time()
+    try:
+        current_config = read_sphinx_config(
+            confpath, confoverrides, add_defaults
+        )
+        return current_config, time.process_time() - cpu_start
+    finally:
+        roots = tuple(
+            os.path.join(os.path.abspath(entry), "")
+            for entry in (
+                confpath,
+                *(entry for entry in sys.path if entry and entry not in path),
+            )
+        )
+        for name in set(sys.modules) - modules:
+            if _is_local_module(sys.modules[name], roots):
+                del sys.modules[name]
+        sys.path[:] = path
+        os.environ.clear()
+        os.environ.update(environ)
+
+
+def create_config_pool(processes=1, maxtasksperchild=None):
+    """
+    Creates a pool of worker processes for loading configs.
+
+    Workers are started using the forkserver method if available (and spawn
+    otherwise), because the main process might already be running threads.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(["sphinx.config", __name__])
+    else:
+        ctx = multiprocessing.get_context("spawn")
+    return ctx.Pool(processes, maxtasksperchild=maxtasksperchild)
+
+
+def load_sphinx_config(
+    confpath, confoverrides, add_defaults=False, pool=None, span=None
+):
+    """
+    Reads the config in a separate process, either in a worker of ``pool``
+    or in a new process. If ``span`` (a dict yielded by
+    :meth:`timings.Recorder.span`) is given, the CPU time spent in that
+    process is stored in it.
+    """
+    if pool is not None:
+        result = pool.apply(
+            load_sphinx_config_task, (confpath, confoverrides, add_defaults)
+        )
+    else:
+        q = multiprocessing.Queue()
+        proc = multiprocessing.Process(
+            target=load_sphinx_config_worker,
+            args=(q, confpath, confoverrides, add_defaults),
+        )
+        proc.start()
+        proc.join()
+        result = q.get_nowait()
+        if isinstance(result, Exception):
+            raise result
+
+    current_config, cpu = result
+    if span is not None:
+        span["cpu"] = cpu
+    return current_config
 
 
 def get_python_flags():
@@ -146,10 +264,107 @@ def get_python_flags():
             yield from ("-X", "{}={}".format(option, value))
 
 
+def get_docnames(filenames, source_suffixes):
+    """
+    Returns the sorted list of docnames for the given source ``filenames``.
+
+    This mirrors :meth:`sphinx.project.Project.discover`, but works on a list
+    of filenames (e.g. from :func:`git.get_tree_files`) instead of the file
+    system.
+    """
+    matcher = sphinx_matching.Matcher(sphinx_project.EXCLUDE_PATHS)
+    excluded_dirs = {"": False}
+
+    def is_excluded_dir(dirname):
+        # Sphinx doesn't descend into excluded directories
+        if dirname not in excluded_dirs:
+            excluded_dirs[dirname] = matcher(dirname) or is_excluded_dir(
+                posixpath.dirname(dirname)
+            )
+        return excluded_dirs[dirname]
+
+    docnames = set()
+    for filename in sorted(filenames):
+        filename = unicodedata.normalize("NFC", filename)
+        if matcher(filename) or is_excluded_dir(posixpath.dirname(filename)):
+            continue
+        for suffix in source_suffixes:
+            if filename.endswith(suffix):
+                docnames.add(filename[: -len(suffix)])
+                break
+    return sorted(docnames)
+
+
+def get_materialize_paths(sourcedir, confdir, extra_paths=()):
+    """
+    Returns the sorted paths (relative to the git root, using ``/`` as
+    separator) that need to be copied from each ref to build the docs, i.e.
+    the ``sourcedir``, the ``confdir`` and the ``extra_paths``.
+
+    Paths below other paths are omitted.
+    """
+    paths = {
+        posixpath.normpath(path.replace(os.sep, "/"))
+        for path in (sourcedir, confdir, *extra_paths)
+    }
+    if "." in paths:
+        return ["."]
+    return sorted(
+        path
+        for path in paths
+        if not any(path.startswith(other + "/") for other in paths)
+    )
+
+
+def run_concurrently(func, items, jobs=None):
+    """
+    Calls ``func`` for each of the ``items`` using up to ``jobs`` threads and
+    returns the results in the same order as the items.
+    """
+    if jobs is not None and jobs > 1:
+        with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+            return list(executor.map(func, items))
+    return [func(item) for item in items]
+
+
+def jobs_argument(value):
+    if value == "auto":
+        return multiprocessing.cpu_count()
+    jobs = int(value)
+    if jobs <= 0:
+        raise argparse.ArgumentTypeError(
+            "job number should be a positive number"
+        )
+    return jobs
+
+
+def merge_main(argv):
+    parser = argparse.ArgumentParser(prog="sphinx-multiversion merge")
+    parser.add_argument("outputdir", help="path to output directory")
+    parser.add_argument(
+        "sharddirs",
+        nargs="+",
+        help="output directories of the shards (built with --shard)",
+    )
+    args = parser.parse_args(argv)
+
+    logger = logging.getLogger(__name__)
+    conflicts = shard.merge(
+        os.path.abspath(args.outputdir),
+        [os.path.abspath(sharddir) for sharddir in args.sharddirs],
+    )
+    for path in conflicts:
+        logger.error("Conflicting file in shard outputs: %s", path)
+    return 1 if conflicts else 0
+
+
 def main(argv=None):
     if not argv:
         argv = sys.argv[1:]
 
+    if argv[:1] == ["merge"]:
+        return merge_main(argv[1:])
+
     parser = argparse.ArgumentParser()
     parser.add_argument("sourcedir", help="path to documentation source files")
     parser.add_argument("outputdir", help="path to output directory")
@@ -181,6 +396,218 @@ def main(argv=None):
         default=[],
         help="override a setting in configuration file",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="N",
+        type=jobs_argument,
+        dest="jobs",
+        help=(
+            "number of CPU cores to use, split between concurrent builds of "
+            "different versions and sphinx-build's own -j option "
+            '(special value "auto" will set N to cpu-count)'
+        ),
+    )
+    parser.add_argument(
+        "--config-worker-max-tasks",
+        metavar="N",
+        type=int,
+        default=50,
+        help=(
+            "restart config loader processes after loading N configs "
+            "(default: 50, 0 means never)"
+        ),
+    )
+    parser.add_argument(
+        "--materialize",
+        choices=("archive", "link"),
+        default="archive",
+        help=(
+            "how to copy the files of each ref: extract a git archive "
+            "(default) or hardlink them from a shared store that contains "
+            "each file only once"
+        ),
+    )
+    parser.add_argument(
+        "--build-mode",
+        choices=("subprocess", "fork"),
+        default="subprocess",
+        help=(
+            "how to run sphinx-build for each version: in a new Python "
+            "process (default) or in a child forked from this process, "
+            "which imports Sphinx and the extensions only once"
+        ),
+    )
+    parser.add_argument(
+        "--memory-limit",
+        metavar="SIZE",
+        type=cache.size_argument,
+        help=(
+            "only start concurrent builds while their predicted memory usage "
+            "stays below SIZE (e.g. 8G)"
+        ),
+    )
+    parser.add_argument(
+        "--build-order",
+        choices=("refs", "priority"),
+        default="refs",
+        help=(
+            "order in which versions are built: sorted by ref (default) or "
+            "latest version first, then unreleased versions, then releases "
+            "from newest to oldest"
+        ),
+    )
+    parser.add_argument(
+        "--shard",
+        metavar="K/N",
+        type=shard.shard_argument,
+        help=(
+            "split the versions into N balanced shards and only build the "
+            "K-th of them (combine the outputs with the merge subcommand)"
+        ),
+    )
+    parser.add_argument(
+        "--shard-timings",
+        metavar="PATH",
+        action="append",
+        default=[],
+        help=(
+            "balance shards by the build times recorded in this --timings "
+            "file instead of the page counts (can be given multiple times)"
+        ),
+    )
+    parser.add_argument(
+        "--atomic-publish",
+        action="store_true",
+        help=(
+            "build each version in a staging dir and replace its output dir "
+            "as soon as the build succeeded"
+        ),
+    )
+    parser.add_argument(
+        "--alias-commits",
+        action="store_true",
+        help=(
+            "only build one version of refs that point to the same commit and "
+            "re-render the others using its environment"
+        ),
+    )
+    parser.add_argument(
+        "--dedup",
+        choices=("hardlink", "shared"),
+        help=(
+            "after building, replace identical files in the output dirs of "
+            "different versions with hardlinks, or move them to a shared "
+            "directory and rewrite the references in HTML files"
+        ),
+    )
+    parser.add_argument(
+        "--cache-dir",
+        metavar="PATH",
+        help=(
+            "keep checkouts and doctrees of each ref in this directory to "
+            "speed up subsequent builds"
+        ),
+    )
+    parser.add_argument(
+        "--cache-max-age",
+        metavar="DAYS",
+        type=float,
+        help="remove cache entries that were not used for DAYS days",
+    )
+    parser.add_argument(
+        "--cache-max-size",
+        metavar="SIZE",
+        type=cache.size_argument,
+        help=(
+            "remove least recently used cache entries until the cache is "
+            "smaller than SIZE (e.g. 500M or 2G)"
+        ),
+    )
+    parser.add_argument(
+        "--workdir",
+        metavar="PATH",
+        help=(
+            "keep the checkouts of each commit in this directory across runs "
+            "instead of using a temporary directory"
+        ),
+    )
+    parser.add_argument(
+        "--workdir-max-size",
+        metavar="SIZE",
+        type=cache.size_argument,
+        help=(
+            "remove least recently used checkouts until the workdir is "
+            "smaller than SIZE (e.g. 500M or 2G)"
+        ),
+    )
+    parser.add_argument(
+        "--no-config-cache",
+        action="store_true",
+        help=(
+            "don't cache config values in the cache dir (use this if your "
+            "conf.py reads files outside of the conf dir)"
+        ),
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help=(
+            "skip versions that are unchanged since the last build and "
+            "remove output of versions that no longer exist"
+        ),
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help=(
+            "print the versions that would be built as JSON and exit "
+            "(without copying any trees if configs are cached)"
+        ),
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help=(
+            "keep running and rebuild the versions whose refs changed "
+            "(implies --incremental)"
+        ),
+    )
+    parser.add_argument(
+        "--watch-interval",
+        metavar="SECONDS",
+        type=float,
+        default=1.0,
+        help="how often to check for changed refs in watch mode",
+    )
+    parser.add_argument(
+        "--watch-debounce",
+        metavar="SECONDS",
+        type=float,
+        default=2.0,
+        help="wait until the refs haven't changed for SECONDS before building",
+    )
+    parser.add_argument(
+        "--watch-status",
+        metavar="FILE",
+        help="write the state and counters of watch mode as JSON to FILE",
+    )
+    parser.add_argument(
+        "--timings",
+        metavar="FILE",
+        help=(
+            "write wall time, CPU time, peak RSS and bytes extracted of each "
+            "stage and ref as JSON to FILE"
+        ),
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help=(
+            "write a timeline of all stages as Chrome trace events to FILE "
+            "(viewable in chrome://tracing or Perfetto)"
+        ),
+    )
     parser.add_argument(
         "--dump-metadata",
         action="store_true",
@@ -189,7 +616,49 @@ def main(argv=None):
     args, argv = parser.parse_known_args(argv)
     if args.noconfig:
         return 1
+    if args.build_mode == "fork" and not hasattr(os, "fork"):
+        parser.error("--build-mode fork is not supported on this platform")
+
+    if args.watch and (args.plan or args.dump_metadata):
+        parser.error("--watch can't be combined with --plan/--dump-metadata")
+
+    if args.workdir and args.cache_dir:
+        parser.error("--workdir can't be combined with --cache-dir")
+
+    def run_once():
+        recorder = timings.Recorder()
+        config_pool = create_config_pool(
+            processes=args.jobs or 1,
+            maxtasksperchild=args.config_worker_max_tasks or None,
+        )
+        try:
+            # The arguments are modified by run(), so pass a copy
+            return run(args, list(argv), recorder, config_pool)
+        finally:
+            # Usually, run() terminates the pool as soon as all configs are
+            # loaded, but it must not leak if run() fails before that
+            config_pool.terminate()
+            config_pool.join()
+            if args.timings:
+                recorder.write_timings(args.timings)
+            if args.trace:
+                recorder.write_trace(args.trace)
+
+    if not args.watch:
+        return run_once()
+
+    # Only rebuild versions whose refs moved
+    args.incremental = True
+    return watch.watch(
+        run_once,
+        git.get_common_dir(cwd=os.path.abspath(args.sourcedir)),
+        interval=args.watch_interval,
+        debounce=args.watch_debounce,
+        status_path=args.watch_status,
+    )
+
 
+def run(args, argv, recorder, config_pool):
     logger = logging.getLogger(__name__)
 
     sourcedir_absolute = os.path.abspath(args.sourcedir)
@@ -206,9 +675,14 @@ def main(argv=None):
         confoverrides[key] = value
 
     # Parse config
-    config = load_sphinx_config(
-        confdir_absolute, confoverrides, add_defaults=True
-    )
+    with recorder.span("root_config") as span:
+        config = load_sphinx_config(
+            confdir_absolute,
+            confoverrides,
+            add_defaults=True,
+            pool=config_pool,
+            span=span,
+        )
 
     # Get relative paths to root of git repository
     gitroot = pathlib.Path(
@@ -228,66 +702,206 @@ def main(argv=None):
         confdir = sourcedir
     logger.debug("Conf dir (relative to git toplevel path): %s", str(confdir))
     conffile = os.path.join(confdir, "conf.py")
+    materialize_paths = get_materialize_paths(
+        sourcedir, confdir, config.smv_materialize_paths
+    )
+    logger.debug(
+        "Materialized paths (relative to git toplevel path): %s",
+        ", ".join(materialize_paths),
+    )
 
     # Get git references
-    gitrefs = git.get_refs(
-        str(gitroot),
-        config.smv_tag_whitelist,
-        config.smv_branch_whitelist,
-        config.smv_remote_whitelist,
-        files=(sourcedir, conffile),
-    )
+    with recorder.span("refs"):
+        gitrefs = git.get_refs(
+            str(gitroot),
+            config.smv_tag_whitelist,
+            config.smv_branch_whitelist,
+            config.smv_remote_whitelist,
+            files=(sourcedir, conffile),
+        )
 
-    # Order git refs
-    if config.smv_prefer_remote_refs:
-        gitrefs = sorted(gitrefs, key=lambda x: (not x.is_remote, *x))
-    else:
-        gitrefs = sorted(gitrefs, key=lambda x: (x.is_remote, *x))
+        # Order git refs
+        if config.smv_prefer_remote_refs:
+            gitrefs = sorted(gitrefs, key=lambda x: (not x.is_remote, *x))
+        else:
+            gitrefs = sorted(gitrefs, key=lambda x: (x.is_remote, *x))
+
+        # Skip paths that don't exist in a ref (e.g. a package that was added
+        # later), because git archive fails on pathspecs that match nothing
+        if materialize_paths == ["."]:
+            ref_paths = {gitref: materialize_paths for gitref in gitrefs}
+        else:
+            exists = iter(
+                git.files_exist(
+                    str(gitroot),
+                    [
+                        (gitref.commit, path)
+                        for gitref in gitrefs
+                        for path in materialize_paths
+                    ],
+                )
+            )
+            ref_paths = {
+                gitref: [path for path in materialize_paths if next(exists)]
+                for gitref in gitrefs
+            }
 
     logger = logging.getLogger(__name__)
 
-    with tempfile.TemporaryDirectory() as tmp:
+    config_keys = {}
+    if args.cache_dir:
+        cachedir = os.path.abspath(args.cache_dir)
+        os.makedirs(cachedir, exist_ok=True)
+
+        # Config values are cached by the tree hash of the conf dir
+        if not args.no_config_cache:
+            config_fields = cache.get_config_fields(
+                config.smv_outputdir_format
+            )
+            conftree = "" if confdir == "." else confdir.replace(os.sep, "/")
+            trees = git.get_object_ids(
+                str(gitroot),
+                [
+                    "{}:{}".format(gitref.commit, conftree)
+                    for gitref in gitrefs
+                ],
+            )
+            config_keys = {
+                gitref: cache.get_config_key(
+                    tree, confoverrides, config_fields
+                )
+                for gitref, tree in zip(gitrefs, trees)
+            }
+
+    with contextlib.ExitStack() as stack:
+        tmp = stack.enter_context(tempfile.TemporaryDirectory())
+        checkouts = None
+        if args.workdir:
+            checkouts = stack.enter_context(workdir.Workdir(args.workdir))
+
+        if args.materialize != "link":
+            store = None
+        elif args.cache_dir:
+            store = cache.get_object_store_path(cachedir)
+        else:
+            store = os.path.join(tmp, "objects")
+
         # Generate Metadata
-        metadata = {}
-        outputdirs = set()
-        for gitref in gitrefs:
-            # Clone Git repo
-            repopath = os.path.join(tmp, gitref.commit)
+        materialized = {}
+        materialized_lock = threading.Lock()
+
+        def materialize(gitref, repopath):
+            # Refs that point to the same commit share their repopath, so
+            # make sure that each tree is only copied once.
+            with materialized_lock:
+                future = materialized.get(repopath)
+                is_owner = future is None
+                if is_owner:
+                    future = concurrent.futures.Future()
+                    materialized[repopath] = future
+            if not is_owner:
+                return future.result()
+
             try:
-                git.copy_tree(str(gitroot), gitroot.as_uri(), repopath, gitref)
-            except (OSError, subprocess.CalledProcessError):
-                logger.error(
-                    "Failed to copy git tree for %s to %s",
-                    gitref.refname,
-                    repopath,
+                with recorder.span("materialize", gitref.name) as span:
+                    # Most of the work is done by git processes, so the CPU
+                    # time of this thread would be misleading
+                    span["cpu"] = None
+                    if args.cache_dir:
+                        written = cache.update_checkout(
+                            str(gitroot),
+                            os.path.dirname(repopath),
+                            gitref,
+                            store=store,
+                            paths=ref_paths[gitref],
+                        )
+                    elif checkouts is not None:
+                        written = checkouts.checkout(
+                            str(gitroot), gitref, ref_paths[gitref], store
+                        )
+                    elif store is not None:
+                        written = git.link_tree(
+                            str(gitroot),
+                            repopath,
+                            gitref,
+                            store,
+                            ref_paths[gitref],
+                        )
+                    else:
+                        written = git.copy_tree(
+                            str(gitroot),
+                            gitroot.as_uri(),
+                            repopath,
+                            gitref,
+                            ref_paths[gitref],
+                        )
+                    span["bytes"] = written
+            except BaseException as err:
+                future.set_exception(err)
+                raise
+            future.set_result(None)
+
+        def collect_version(gitref):
+            if args.cache_dir:
+                cache_entry = cache.get_entry_path(cachedir, gitref)
+                repopath = cache.get_source_path(cache_entry)
+            elif checkouts is not None:
+                repopath = checkouts.get_checkout_path(
+                    gitref.commit, ref_paths[gitref]
                 )
-                continue
+            else:
+                repopath = os.path.join(tmp, gitref.commit)
 
             # Find config
             confpath = os.path.join(repopath, confdir)
-            try:
-                current_config = load_sphinx_config(confpath, confoverrides)
-            except (OSError, sphinx_config.ConfigError):
-                logger.error(
-                    "Failed load config for %s from %s",
-                    gitref.refname,
-                    confpath,
+            current_config = None
+            if config_keys:
+                current_config = cache.load_config(
+                    cachedir, config_keys[gitref]
                 )
-                continue
+            if current_config is None:
+                # Evaluating the config requires a copy of the git tree
+                try:
+                    materialize(gitref, repopath)
+                except (OSError, subprocess.CalledProcessError):
+                    logger.error(
+                        "Failed to copy git tree for %s to %s",
+                        gitref.refname,
+                        repopath,
+                    )
+                    return None
+
+                try:
+                    with recorder.span("config", gitref.name) as span:
+                        current_config = load_sphinx_config(
+                            confpath,
+                            confoverrides,
+                            pool=config_pool,
+                            span=span,
+                        )
+                except (OSError, sphinx_config.ConfigError):
+                    logger.error(
+                        "Failed load config for %s from %s",
+                        gitref.refname,
+                        confpath,
+                    )
+                    return None
+                if config_keys:
+                    cache.save_config(
+                        cachedir,
+                        config_keys[gitref],
+                        current_config,
+                        config_fields,
+                    )
+                config_status = "miss" if config_keys else "disabled"
+            else:
+                logger.debug("Using cached config for %s", gitref.refname)
+                config_status = "hit"
 
-            # Ensure that there are not duplicate output dirs
             outputdir = config.smv_outputdir_format.format(
                 ref=gitref,
                 config=current_config,
             )
-            if outputdir in outputdirs:
-                logger.warning(
-                    "outputdir '%s' for %s conflicts with other versions",
-                    outputdir,
-                    gitref.refname,
-                )
-                continue
-            outputdirs.add(outputdir)
 
             # Get List of files
             source_suffixes = current_config.source_suffix
@@ -295,27 +909,129 @@ def main(argv=None):
                 source_suffixes = [current_config.source_suffix]
 
             current_sourcedir = os.path.join(repopath, sourcedir)
-            project = sphinx_project.Project(
-                current_sourcedir, source_suffixes
-            )
-            metadata[gitref.name] = {
-                "name": gitref.name,
-                "version": current_config.version,
-                "release": current_config.release,
-                "rst_prolog": current_config.rst_prolog,
-                "is_released": bool(
-                    re.match(config.smv_released_pattern, gitref.refname)
-                ),
-                "source": gitref.source,
-                "creatordate": gitref.creatordate.strftime(sphinx.DATE_FMT),
-                "basedir": repopath,
-                "sourcedir": current_sourcedir,
-                "outputdir": os.path.join(
-                    os.path.abspath(args.outputdir), outputdir
+            current_outputdir = os.path.join(
+                os.path.abspath(args.outputdir), outputdir
+            )
+            if args.cache_dir:
+                current_doctreedir = cache.get_doctree_path(cache_entry)
+            elif args.atomic_publish:
+                # Keep doctrees outside of the staged output dir, so that
+                # they can be reused by the next build
+                current_doctreedir = os.path.join(
+                    os.path.abspath(args.outputdir),
+                    ".smv-doctrees",
+                    urllib.parse.quote(gitref.name, safe=""),
+                )
+            else:
+                current_doctreedir = os.path.join(
+                    current_outputdir, ".doctrees"
+                )
+            with recorder.span("discovery", gitref.name):
+                docnames = get_source_docnames(gitref, tuple(source_suffixes))
+            return (
+                outputdir,
+                config_status,
+                {
+                    "name": gitref.name,
+                    "version": current_config.version,
+                    "release": current_config.release,
+                    "rst_prolog": current_config.rst_prolog,
+                    "is_released": bool(
+                        re.match(config.smv_released_pattern, gitref.refname)
+                    ),
+                    "source": gitref.source,
+                    "commit": gitref.commit,
+                    "creatordate": gitref.creatordate.strftime(
+                        sphinx.DATE_FMT
+                    ),
+                    "basedir": repopath,
+                    "materialized_paths": [
+                        os.path.normpath(
+                            os.path.join(repopath, *path.split("/"))
+                        )
+                        for path in ref_paths[gitref]
+                    ],
+                    "sourcedir": current_sourcedir,
+                    "outputdir": current_outputdir,
+                    "doctreedir": current_doctreedir,
+                    "confdir": confpath,
+                    "docnames": docnames,
+                },
+            )
+
+        # Documents are listed from the git objects, so that trees only need
+        # to be copied for versions that are actually built.
+        sourcetree = "" if sourcedir == "." else sourcedir.replace(os.sep, "/")
+        source_trees = dict(
+            zip(
+                gitrefs,
+                git.get_object_ids(
+                    str(gitroot),
+                    [
+                        "{}:{}".format(gitref.commit, sourcetree)
+                        for gitref in gitrefs
+                    ],
                 ),
-                "confdir": confpath,
-                "docnames": list(project.discover()),
-            }
+            )
+        )
+
+        @functools.lru_cache(maxsize=None)
+        def get_source_entries(tree):
+            return git.get_tree_entries(str(gitroot), tree)
+
+        @functools.lru_cache(maxsize=None)
+        def get_tree_docnames(tree, commit, source_suffixes):
+            if commit is None:
+                filenames = [
+                    entry.path
+                    for entry in get_source_entries(tree)
+                    if entry.type == "blob"
+                ]
+            else:
+                filenames = git.get_tree_files(
+                    str(gitroot), commit, sourcetree or "."
+                )
+            return get_docnames(filenames, source_suffixes)
+
+        def get_source_docnames(gitref, source_suffixes):
+            tree = source_trees[gitref]
+            # Sphinx follows symlinks to directories, which may point
+            # anywhere in the commit
+            has_symlinks = any(
+                entry.mode == "120000" for entry in get_source_entries(tree)
+            )
+            return get_tree_docnames(
+                tree, gitref.commit if has_symlinks else None, source_suffixes
+            )
+
+        try:
+            results = run_concurrently(collect_version, gitrefs, args.jobs)
+        finally:
+            config_pool.terminate()
+            config_pool.join()
+
+        # Merge results in the same order as the git refs
+        metadata = {}
+        metadata_refs = {}
+        config_statuses = {}
+        outputdirs = set()
+        for gitref, result in zip(gitrefs, results):
+            if result is None:
+                continue
+
+            # Ensure that there are not duplicate output dirs
+            outputdir, config_status, data = result
+            if outputdir in outputdirs:
+                logger.warning(
+                    "outputdir '%s' for %s conflicts with other versions",
+                    outputdir,
+                    gitref.refname,
+                )
+                continue
+            outputdirs.add(outputdir)
+            metadata[gitref.name] = data
+            metadata_refs[gitref.name] = gitref
+            config_statuses[gitref.name] = config_status
 
         if args.dump_metadata:
             print(json.dumps(metadata, indent=2))
@@ -325,21 +1041,316 @@ def main(argv=None):
             logger.error("No matching refs found!")
             return 2
 
+        # Find versions that need to be built
+        outputroot = os.path.abspath(args.outputdir)
+        manifest_path = manifest.get_manifest_path(outputroot)
+        build_manifest = manifest.load_manifest(manifest_path)
+        config_hash = manifest.get_config_hash(
+            confdir_absolute, confoverrides, [*argv, *args.filenames]
+        )
+        if config.smv_static_versions:
+            # Pages don't contain the other versions, so they don't need to
+            # be rebuilt if the set of versions changes
+            versions_hash = None
+        else:
+            versions_hash = manifest.get_versions_hash(metadata, outputroot)
+        version_keys = {
+            version_name: manifest.get_version_key(
+                data, outputroot, config_hash, versions_hash
+            )
+            for version_name, data in metadata.items()
+        }
+        up_to_date = {
+            version_name: manifest.is_up_to_date(
+                build_manifest,
+                version_name,
+                version_keys[version_name],
+                data["outputdir"],
+            )
+            for version_name, data in metadata.items()
+        }
+        if args.incremental:
+            versions_to_build = [
+                version_name
+                for version_name in metadata
+                if not up_to_date[version_name]
+            ]
+        else:
+            versions_to_build = list(metadata)
+
+        if args.build_order == "priority":
+            priorities = build.get_priority_order(
+                metadata, config.smv_latest_version
+            )
+            versions_to_build = [
+                version_name
+                for version_name in priorities
+                if version_name in versions_to_build
+            ]
+
+        shards = None
+        if args.shard is not None:
+            shard_index, shard_count = args.shard
+            shards = shard.partition(
+                shard.get_weights(
+                    metadata, shard.load_build_times(args.shard_timings)
+                ),
+                shard_count,
+            )
+            versions_to_build = [
+                version_name
+                for version_name in versions_to_build
+                if shards[version_name] == shard_index - 1
+            ]
+
+        def get_defines(data):
+            return [
+                string.Template(d).safe_substitute(data) for d in args.define
+            ]
+
+        # Refs that point to the same commit are only read once. The other
+        # versions use the checkout and a copy of the environment of the
+        # first one, so that Sphinx only needs to write their pages.
+        aliases = {}
+        if args.alias_commits:
+            primaries = {}
+            for version_name in versions_to_build:
+                data = metadata[version_name]
+                primary = primaries.setdefault(data["commit"], version_name)
+                if primary == version_name:
+                    continue
+                shared = {
+                    key: metadata[primary][key]
+                    for key in (
+                        "basedir",
+                        "sourcedir",
+                        "confdir",
+                        "materialized_paths",
+                    )
+                }
+                # Different config values would make Sphinx read all
+                # sources again anyway
+                if get_defines(dict(data, **shared)) != get_defines(
+                    metadata[primary]
+                ):
+                    logger.debug(
+                        "Not reusing %s for %s, because the defines differ",
+                        primary,
+                        version_name,
+                    )
+                    continue
+                aliases[version_name] = primary
+                data.update(shared)
+
+        if args.plan:
+            plan = [
+                {
+                    "name": version_name,
+                    "refname": metadata_refs[version_name].refname,
+                    "commit": data["commit"],
+                    "outputdir": os.path.relpath(
+                        data["outputdir"], outputroot
+                    ),
+                    "config_cache": config_statuses[version_name],
+                    "manifest": (
+                        "up-to-date" if up_to_date[version_name] else "stale"
+                    ),
+                    "action": (
+                        "build"
+                        if version_name in versions_to_build
+                        else "skip"
+                    ),
+                }
+                for version_name, data in metadata.items()
+            ]
+            for entry in plan:
+                if shards is not None:
+                    entry["shard"] = shards[entry["name"]] + 1
+                if entry["name"] in aliases:
+                    entry["alias_of"] = aliases[entry["name"]]
+            print(json.dumps(plan, indent=2))
+            return 0
+
+        if args.incremental:
+            # Versions that moved to another shard are pruned as well, so
+            # that they don't conflict when merging the shards
+            manifest.prune_versions(
+                build_manifest,
+                outputroot,
+                [
+                    data["outputdir"]
+                    for version_name, data in metadata.items()
+                    if shards is None
+                    or shards[version_name] == args.shard[0] - 1
+                ],
+            )
+
+        # Copy the git trees of all versions that need to be built
+        def materialize_version(version_name):
+            try:
+                materialize(
+                    metadata_refs[version_name],
+                    metadata[version_name]["basedir"],
+                )
+            except (OSError, subprocess.CalledProcessError):
+                logger.error(
+                    "Failed to copy git tree for %s to %s",
+                    metadata_refs[version_name].refname,
+                    metadata[version_name]["basedir"],
+                )
+                return False
+            return True
+
+        primary_versions = [
+            version_name
+            for version_name in versions_to_build
+            if version_name not in aliases
+        ]
+        materialized_versions = run_concurrently(
+            materialize_version, primary_versions, args.jobs
+        )
+        failed = [
+            version_name
+            for version_name, success in zip(
+                primary_versions, materialized_versions
+            )
+            if not success
+        ]
+        failed.extend(
+            version_name
+            for version_name, primary in aliases.items()
+            if primary in failed
+        )
+        versions_to_build = [
+            version_name
+            for version_name in versions_to_build
+            if version_name not in failed
+        ]
+
         # Write Metadata
-        metadata_path = os.path.abspath(os.path.join(tmp, "versions.json"))
-        with open(metadata_path, mode="w") as fp:
-            json.dump(metadata, fp, indent=2)
+        metadata_path = os.path.abspath(os.path.join(tmp, "versions.smv"))
+        metadata_store.write(metadata_path, metadata)
+
+        os.makedirs(outputroot, exist_ok=True)
+        if config.smv_static_versions:
+            versions_index_path = os.path.join(
+                outputroot, sphinx.VERSIONS_INDEX_FILENAME
+            )
+            sphinx.write_versions_index(versions_index_path, metadata)
+            argv.extend(
+                [
+                    "-D",
+                    "smv_versions_index_path={}".format(versions_index_path),
+                ]
+            )
+        build_manifest["versions_hash"] = versions_hash
+        # Peak memory usage of previous builds, used for admission control
+        peak_rss = {
+            version_name: value
+            for version_name, value in build_manifest.get(
+                "peak_rss", {}
+            ).items()
+            if version_name in metadata
+        }
+        build_manifest["peak_rss"] = peak_rss
+        for version_name in versions_to_build:
+            build_manifest["versions"].pop(version_name, None)
+        manifest.save_manifest(manifest_path, build_manifest)
+
+        if not versions_to_build and not failed:
+            logger.info("All versions are up to date")
+            return 0
+
+        def build_finished(job, result):
+            span = {}
+            if result.rusage is not None:
+                span["cpu"] = result.rusage.ru_utime + result.rusage.ru_stime
+            if result.get_peak_rss():
+                span["peak_rss"] = result.get_peak_rss()
+                peak_rss[job.name] = span["peak_rss"]
+            recorder.add(
+                "build",
+                job.name,
+                result.start,
+                result.end,
+                thread=timings.CHILD_THREAD_OFFSET + len(recorder.spans),
+                returncode=result.returncode,
+                **span,
+            )
+            staging = stagingdirs.get(job.name)
+            if staging is not None:
+                if result.returncode == 0:
+                    build.publish(staging, metadata[job.name]["outputdir"])
+                else:
+                    shutil.rmtree(staging, ignore_errors=True)
+            if result.returncode == 0:
+                build_manifest["versions"][job.name] = {
+                    "key": version_keys[job.name],
+                }
+            manifest.save_manifest(manifest_path, build_manifest)
+
+            follow_ups = []
+            for alias_job in alias_builds.pop(job.name, ()):
+                if result.returncode != 0:
+                    logger.error(
+                        "Not building %s, because the build of %s failed",
+                        alias_job.name,
+                        job.name,
+                    )
+                    failed.append(alias_job.name)
+                    continue
+                logger.debug(
+                    "Reusing environment of %s for %s",
+                    job.name,
+                    alias_job.name,
+                )
+                doctreedir = metadata[alias_job.name]["doctreedir"]
+                shutil.rmtree(doctreedir, ignore_errors=True)
+                shutil.copytree(metadata[job.name]["doctreedir"], doctreedir)
+                follow_ups.append(alias_job)
+            return follow_ups
 
         # Run Sphinx
         argv.extend(["-D", "smv_metadata_path={}".format(metadata_path)])
-        for version_name, data in metadata.items():
-            os.makedirs(data["outputdir"], exist_ok=True)
+        if args.jobs is not None:
+            concurrent_builds, sphinx_jobs = build.split_jobs(
+                args.jobs, len(versions_to_build)
+            )
+            if sphinx_jobs > 1:
+                argv.extend(["-j", str(sphinx_jobs)])
+        else:
+            concurrent_builds = 1
 
-            defines = itertools.chain(
-                *(
-                    ("-D", string.Template(d).safe_substitute(data))
-                    for d in args.define
+        stagingdirs = {}
+        if args.atomic_publish:
+            shutil.rmtree(
+                os.path.join(outputroot, build.STAGING_DIRNAME),
+                ignore_errors=True,
+            )
+
+        builds = []
+        build_outputdirs = {}
+        for version_name in versions_to_build:
+            data = metadata[version_name]
+            current_outputdir = data["outputdir"]
+            if args.atomic_publish and not any(
+                other["outputdir"].startswith(data["outputdir"] + os.sep)
+                for other in metadata.values()
+            ):
+                current_outputdir = build.get_staging_path(
+                    outputroot, version_name
                 )
+                stagingdirs[version_name] = current_outputdir
+            elif args.atomic_publish:
+                logger.warning(
+                    "Building %s in place, because its output dir contains "
+                    "the output of other versions",
+                    version_name,
+                )
+            build_outputdirs[version_name] = current_outputdir
+
+            defines = itertools.chain(
+                *(("-D", define) for define in get_defines(data))
             )
 
             current_argv = argv.copy()
@@ -348,22 +1359,25 @@ def main(argv=None):
                     *defines,
                     "-D",
                     "smv_current_version={}".format(version_name),
+                    *(
+                        ("-d", data["doctreedir"])
+                        if args.cache_dir or args.atomic_publish
+                        else ()
+                    ),
                     "-c",
                     confdir_absolute,
                     data["sourcedir"],
-                    data["outputdir"],
+                    current_outputdir,
                     *args.filenames,
                 ]
             )
             logger.debug("Running sphinx-build with args: %r", current_argv)
-            cmd = (
-                sys.executable,
-                *get_python_flags(),
-                "-m",
-                "sphinx",
-                *current_argv,
-            )
-            current_cwd = os.path.join(data["basedir"], cwd_relative)
+            # Only the materialized paths have been copied, so the working
+            # directory might be missing in the checkout
+            current_cwd = data["basedir"]
+            if cwd_relative.split(os.sep)[0] != os.pardir:
+                current_cwd = os.path.join(current_cwd, cwd_relative)
+                os.makedirs(current_cwd, exist_ok=True)
             env = os.environ.copy()
             env.update(
                 {
@@ -375,6 +1389,101 @@ def main(argv=None):
                     "SPHINX_MULTIVERSION_CONFDIR": data["confdir"],
                 }
             )
-            subprocess.check_call(cmd, cwd=current_cwd, env=env)
+            builds.append(
+                build.BuildJob(version_name, current_argv, current_cwd, env)
+            )
+
+        if args.build_mode == "fork":
+            build.preload(config.extensions, exclude_path=str(gitroot))
+            start = build.start_fork
+        else:
+            start = functools.partial(
+                build.start_subprocess,
+                (sys.executable, *get_python_flags(), "-m", "sphinx"),
+            )
+
+        def start_build(job, **kwargs):
+            # Output dirs are only created once their build starts, so that
+            # versions that aren't built don't leave empty dirs behind
+            current_outputdir = build_outputdirs[job.name]
+            os.makedirs(current_outputdir, exist_ok=True)
+            # Sphinx overwrites files in place, so files that have been
+            # hardlinked to other versions need to be copied first
+            dedup.unshare_tree(current_outputdir)
+            return start(job, **kwargs)
+
+        # Aliases are started by build_finished once their primary is done
+        alias_builds = {}
+        for job in builds:
+            if job.name in aliases:
+                alias_builds.setdefault(aliases[job.name], []).append(job)
+        primary_builds = [job for job in builds if job.name not in aliases]
+
+        if concurrent_builds == 1:
+            failed.extend(
+                build.run_sequential(
+                    primary_builds, start_build, on_finished=build_finished
+                )
+            )
+        else:
+            logdir = os.path.join(tmp, "logs")
+            os.makedirs(logdir)
+            failed.extend(
+                build.run_parallel(
+                    primary_builds,
+                    start_build,
+                    concurrent_builds,
+                    logdir,
+                    on_finished=build_finished,
+                    memory_limit=args.memory_limit,
+                    peak_rss=peak_rss,
+                )
+            )
+
+        if stagingdirs:
+            try:
+                os.rmdir(os.path.join(outputroot, build.STAGING_DIRNAME))
+            except OSError:
+                pass
+
+        if args.dedup:
+            with recorder.span("dedup") as span:
+                span["bytes"] = dedup.deduplicate(
+                    outputroot,
+                    [data["outputdir"] for data in metadata.values()],
+                    mode=args.dedup,
+                )
+            print(
+                "Deduplicated output files, saved {} bytes".format(
+                    span["bytes"]
+                )
+            )
+
+        if args.cache_dir:
+            cache.evict(
+                cachedir,
+                max_age=(
+                    args.cache_max_age * 86400
+                    if args.cache_max_age is not None
+                    else None
+                ),
+                max_size=args.cache_max_size,
+                keep=[
+                    cache.get_entry_path(cachedir, gitref)
+                    for gitref in gitrefs
+                ],
+            )
+
+        if checkouts is not None and args.workdir_max_size is not None:
+            checkouts.evict(args.workdir_max_size)
+
+        if failed:
+            logger.error(
+                "Failed to build %d of %d versions: %s",
+                len(failed),
+                len(set(failed).union(job.name for job in builds)),
+                ", ".join(failed),
+            )
+            return 1
 
     return 0
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import sphinx
+
+from . import fileutil
+
+MANIFEST_FILENAME = ".smv-manifest.json"
+MANIFEST_FORMAT = 1
+
+# Metadata fields that affect the output of a single version
+VERSION_KEY_FIELDS = (
+    "name",
+    "version",
+    "release",
+    "rst_prolog",
+    "is_released",
+    "source",
+    "creatordate",
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _hash_json(obj):
+    data = json.dumps(obj, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def get_manifest_path(outputroot):
+    return os.path.join(outputroot, MANIFEST_FILENAME)
+
+
+def load_manifest(path):
+    try:
+        with open(path, mode="r") as fp:
+            manifest = json.load(fp)
+    except FileNotFoundError:
+        manifest = None
+    except (OSError, ValueError):
+        logger.warning("Ignoring unreadable build manifest %s", path)
+        manifest = None
+
+    if not manifest or manifest.get("format") != MANIFEST_FORMAT:
+        manifest = {"format": MANIFEST_FORMAT, "versions": {}}
+    return manifest
+
+
+def save_manifest(path, manifest):
+    with fileutil.atomic_write(path) as fp:
+        json.dump(manifest, fp, indent=2, sort_keys=True)
+
+
+def get_config_hash(confdir, confoverrides, argv):
+    """
+    Returns a hash of the effective configuration used for all builds, i.e.
+    the contents of the :file:`conf.py` in the ``confdir``, the ``-D``
+    overrides and all other command line arguments passed to sphinx-build.
+    """
+    hasher = hashlib.sha256()
+    try:
+        with open(os.path.join(confdir, "conf.py"), mode="rb") as fp:
+            hasher.update(fp.read())
+    except OSError:
+        pass
+    hasher.update(
+        _hash_json(
+            {"confoverrides": confoverrides, "argv": list(argv)}
+        ).encode()
+    )
+    return hasher.hexdigest()
+
+
+def get_versions_hash(metadata, outputroot):
+    """
+    Returns a hash of the set of versions.
+
+    Each page links to all other versions (e.g. in the version switcher), so
+    every version needs to be rebuilt if this hash changes.
+    """
+    return _hash_json(
+        [
+            {
+                "name": data["name"],
+                "version": data["version"],
+                "release": data["release"],
+                "is_released": data["is_released"],
+                "source": data["source"],
+                "outputdir": os.path.relpath(data["outputdir"], outputroot),
+                "docnames": sorted(data["docnames"]),
+            }
+            for data in metadata.values()
+        ]
+    )
+
+
+def get_version_key(data, outputroot, config_hash, versions_hash):
+    from . import __version__
+
+    key = {field: data[field] for field in VERSION_KEY_FIELDS}
+    key.update(
+        {
+            "commit": data["commit"],
+            "outputdir": os.path.relpath(data["outputdir"], outputroot),
+            "config_hash": config_hash,
+            "versions_hash": versions_hash,
+            "sphinx_multiversion_version": __version__,
+            "sphinx_version": sphinx.__version__,
+        }
+    )
+    return key
+
+
+def get_changed_fields(old_key, new_key):
+    return sorted(
+        field
+        for field in set(old_key) | set(new_key)
+        if old_key.get(field) != new_key.get(field)
+    )
+
+
+def is_up_to_date(manifest, name, key, outputdir):
+    """
+    Returns True if the version ``name`` has already been built with the same
+    build key and its output directory still exists and is not empty.
+    """
+    entry = manifest["versions"].get(name)
+    if entry is None:
+        logger.debug("Building %s because it was not built before", name)
+        return False
+
+    changed_fields = get_changed_fields(entry["key"], key)
+    if changed_fields:
+        if "versions_hash" in changed_fields:
+            logger.debug(
+                "Building %s because the set of versions changed", name
+            )
+        logger.debug(
+            "Building %s because its build key changed: %s",
+            name,
+            ", ".join(changed_fields),
+        )
+        return False
+
+    # The output dir of an interrupted build might exist, but be empty
+    if not os.path.isdir(outputdir) or not os.listdir(outputdir):
+        logger.debug(
+            "Building %s because its output dir is missing or empty", name
+        )
+        return False
+
+    return True
+
+
+def prune_versions(manifest, outputroot, current_outputdirs):
+    """
+    Removes the output directories of versions that were recorded in the
+    manifest but are no longer part of the current set of versions.
+    """
+    outputroot = os.path.normpath(os.path.abspath(outputroot))
+    current_outputdirs = {
+        os.path.normpath(os.path.abspath(outputdir))
+        for outputdir in current_outputdirs
+    }
+    for name in sorted(manifest["versions"]):
+        entry = manifest["versions"][name]
+        outputdir = os.path.normpath(
+            os.path.join(outputroot, entry["key"]["outputdir"])
+        )
+        if outputdir in current_outputdirs:
+            continue
+
+        if os.path.commonpath((outputdir, outputroot)) != outputroot:
+            logger.warning(
+                "Not pruning output dir '%s' of removed version %s because "
+                "it is outside of the output directory",
+                outputdir,
+                name,
+            )
+        elif any(
+            os.path.commonpath((outputdir, current)) == outputdir
+            for current in current_outputdirs
+        ):
+            logger.warning(
+                "Not pruning output dir '%s' of removed version %s because "
+                "it contains other versions",
+                outputdir,
+                name,
+            )
+        elif os.path.isdir(outputdir):
+            logger.debug(
+                "Pruning output dir '%s' of removed version %s",
+                outputdir,
+                name,
+            )
+            shutil.rmtree(outputdir)
+        del manifest["versions"][name]
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import json
+import mmap
+import os
+import struct
+import threading
+
+from collections.abc import Mapping
+
+from . import fileutil
+
+MAGIC = b"SMVMETA1"
+
+# magic, version count, docname count, records offset, records size,
+# docname offsets offset, bitsets offset
+HEADER = struct.Struct("<8sIIQQQQ")
+OFFSET = struct.Struct("<I")
+
+
+def write(path, metadata):
+    """
+    Writes ``metadata`` to ``path`` in the compact binary format.
+
+    The file consists of a JSON document with the records of all versions
+    (without their docnames), a sorted table of all distinct docnames and a
+    bitset for each version that marks which of these docnames it contains.
+    """
+    docnames = sorted(
+        {
+            docname.encode()
+            for data in metadata.values()
+            for docname in data["docnames"]
+        }
+    )
+    docname_index = {docname: i for i, docname in enumerate(docnames)}
+    bitset_size = (len(docnames) + 7) // 8
+
+    records = {}
+    bitsets = []
+    for index, (name, data) in enumerate(metadata.items()):
+        record = {k: v for k, v in data.items() if k != "docnames"}
+        record["index"] = index
+        records[name] = record
+
+        bitset = bytearray(bitset_size)
+        for docname in data["docnames"]:
+            i = docname_index[docname.encode()]
+            bitset[i // 8] |= 1 << (i % 8)
+        bitsets.append(bytes(bitset))
+
+    records_data = json.dumps(records).encode()
+    records_offset = HEADER.size
+    offsets_offset = records_offset + len(records_data)
+    strings_offset = offsets_offset + OFFSET.size * (len(docnames) + 1)
+    offsets = [strings_offset]
+    for docname in docnames:
+        offsets.append(offsets[-1] + len(docname))
+    bitsets_offset = offsets[-1]
+
+    with fileutil.atomic_write(path, mode="wb") as fp:
+        fp.write(
+            HEADER.pack(
+                MAGIC,
+                len(metadata),
+                len(docnames),
+                records_offset,
+                len(records_data),
+                offsets_offset,
+                bitsets_offset,
+            )
+        )
+        fp.write(records_data)
+        fp.write(b"".join(OFFSET.pack(offset) for offset in offsets))
+        fp.write(b"".join(docnames))
+        fp.write(b"".join(bitsets))
+
+
+def load(path):
+    """
+    Loads metadata from ``path``, which may either be a JSON file or a file in
+    the binary format written by :func:`write`.
+    """
+    with open(path, mode="rb") as fp:
+        is_binary = fp.read(len(MAGIC)) == MAGIC
+
+    if is_binary:
+        return MetadataStore(path)
+
+    with open(path, mode="r") as fp:
+        return json.load(fp)
+
+
+class DocnameSet:
+    """
+    Set-like view of the docnames of a single version in a
+    :class:`MetadataStore`.
+    """
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __contains__(self, docname):
+        i = self.store._find_docname(docname)
+        return i is not None and self.store._has_docname(self.index, i)
+
+    def __iter__(self):
+        for i in range(self.store._docname_count):
+            if self.store._has_docname(self.index, i):
+                yield self.store._get_docname(i)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return "<DocnameSet of {!r}>".format(self.store.path)
+
+
+class MetadataStore(Mapping):
+    """
+    Read-only mapping of version names to version metadata that is backed by
+    a memory-mapped file in the binary format written by :func:`write`.
+
+    Only the small per-version records are parsed when the file is opened.
+    Docnames are looked up in the mapped docname table on demand, so a build
+    doesn't need to parse the docnames of all other versions.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self._lock = threading.Lock()
+        self._mmap = None
+        self._records = None
+
+    def __reduce__(self):
+        # The file is opened lazily, so pickling (e.g. as part of the Sphinx
+        # environment) works even if the file doesn't exist anymore later.
+        return (type(self), (self.path,))
+
+    def __repr__(self):
+        return "<MetadataStore {!r}>".format(self.path)
+
+    def _open(self):
+        with self._lock:
+            if self._records is not None:
+                return
+
+            with open(self.path, mode="rb") as fp:
+                data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            (
+                magic,
+                self._version_count,
+                self._docname_count,
+                records_offset,
+                records_size,
+                self._offsets_offset,
+                self._bitsets_offset,
+            ) = HEADER.unpack_from(data, 0)
+            if magic != MAGIC:
+                raise ValueError("Invalid metadata file {}".format(self.path))
+            self._bitset_size = (self._docname_count + 7) // 8
+            records = json.loads(
+                data[records_offset : records_offset + records_size].decode()
+            )
+            for record in records.values():
+                record["docnames"] = DocnameSet(self, record.pop("index"))
+            self._mmap = data
+            self._records = records
+
+    @property
+    def records(self):
+        if self._records is None:
+            self._open()
+        return self._records
+
+    def _get_docname_bytes(self, i):
+        start, end = struct.unpack_from(
+            "<II", self._mmap, self._offsets_offset + OFFSET.size * i
+        )
+        return self._mmap[start:end]
+
+    def _get_docname(self, i):
+        return self._get_docname_bytes(i).decode()
+
+    def _find_docname(self, docname):
+        if self._records is None:
+            self._open()
+        needle = docname.encode()
+        lo, hi = 0, self._docname_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._get_docname_bytes(mid) < needle:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._docname_count and self._get_docname_bytes(lo) == needle:
+            return lo
+        return None
+
+    def _has_docname(self, index, i):
+        offset = self._bitsets_offset + index * self._bitset_size + i // 8
+        return bool(self._mmap[offset] & (1 << (i % 8)))
+
+    def __getitem__(self, name):
+        return self.records[name]
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
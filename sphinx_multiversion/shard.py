@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import argparse
+import filecmp
+import json
+import logging
+import os
+import posixpath
+import shutil
+
+from . import build
+from . import fileutil
+from . import manifest
+
+logger = logging.getLogger(__name__)
+
+
+def shard_argument(value):
+    """
+    Parses a shard like ``2/4`` into a ``(index, count)`` tuple, where
+    ``index`` is 1-based.
+    """
+    index, sep, count = value.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        index, count = 0, 0
+    if not sep or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(
+            "shard should be K/N with 1 <= K <= N"
+        )
+    return index, count
+
+
+def load_build_times(paths):
+    """
+    Returns a dict that maps version names to the wall time in seconds of
+    their build, read from the JSON files written by ``--timings``.
+    """
+    build_times = {}
+    for path in paths:
+        try:
+            with open(path, mode="r") as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            logger.warning("Ignoring unreadable timings file %s", path)
+            continue
+        for span in data.get("spans", ()):
+            if span.get("stage") == "build" and span.get("ref"):
+                build_times[span["ref"]] = span["wall_seconds"]
+    return build_times
+
+
+def get_weights(metadata, build_times=None):
+    """
+    Returns the expected cost of building each version.
+
+    This is the recorded build time if available. Otherwise, the number of
+    pages is used (scaled by the average build time per page of the versions
+    with recorded times, if there are any).
+    """
+    pages = {
+        name: max(len(data["docnames"]), 1) for name, data in metadata.items()
+    }
+    known = [name for name in metadata if name in (build_times or {})]
+    if not known:
+        return pages
+
+    seconds_per_page = sum(build_times[name] for name in known) / sum(
+        pages[name] for name in known
+    )
+    return {
+        name: build_times.get(name, pages[name] * seconds_per_page)
+        for name in metadata
+    }
+
+
+def partition(weights, count):
+    """
+    Assigns each version to one of ``count`` shards, so that the total
+    weight of all shards is balanced. Returns a dict that maps version names
+    to 0-based shard indices.
+
+    The assignment only depends on the weights and names, so all shards
+    compute the same result independently.
+    """
+    loads = [0] * count
+    shards = {}
+    for name in sorted(weights, key=lambda name: (-weights[name], name)):
+        index = min(range(count), key=lambda i: (loads[i], i))
+        shards[name] = index
+        loads[index] += weights[name]
+    return shards
+
+
+def merge(outputroot, sharddirs):
+    """
+    Copies the output of all ``sharddirs`` into ``outputroot`` and merges
+    their build manifests.
+
+    Files that exist in several shards (e.g. shared files written by
+    ``--dedup shared``) need to be identical. Files from a previous merge
+    into the same ``outputroot`` are replaced, or removed if no shard
+    contains them anymore. Returns the relative paths of all conflicting
+    files.
+    """
+    conflicts = []
+    manifests = []
+    merged_files = {}
+    os.makedirs(outputroot, exist_ok=True)
+    old_manifest = manifest.load_manifest(
+        manifest.get_manifest_path(outputroot)
+    )
+    for sharddir in sharddirs:
+        manifests.append(
+            manifest.load_manifest(manifest.get_manifest_path(sharddir))
+        )
+        for root, dirs, files in os.walk(sharddir):
+            if root == sharddir:
+                dirs[:] = [d for d in dirs if d != build.STAGING_DIRNAME]
+                files = [f for f in files if f != manifest.MANIFEST_FILENAME]
+            relroot = os.path.relpath(root, sharddir)
+            os.makedirs(os.path.join(outputroot, relroot), exist_ok=True)
+            for filename in files:
+                src = os.path.join(root, filename)
+                dst = os.path.join(outputroot, relroot, filename)
+                relpath = posixpath.normpath(
+                    posixpath.join(relroot.replace(os.sep, "/"), filename)
+                )
+                if relpath in merged_files:
+                    # Written by a previous shard of this merge
+                    if not filecmp.cmp(
+                        src, merged_files[relpath], shallow=False
+                    ):
+                        conflicts.append(relpath)
+                    continue
+
+                merged_files[relpath] = src
+                with fileutil.replacing(dst) as tmppath:
+                    shutil.copy2(src, tmppath, follow_symlinks=False)
+
+    # Remove files of a previous merge that are no longer part of any shard
+    for relpath in old_manifest.get("merged_files", ()):
+        if relpath not in merged_files:
+            fileutil.remove_file(outputroot, relpath)
+
+    merged = {
+        "format": manifest.MANIFEST_FORMAT,
+        "versions": {},
+        "peak_rss": {},
+        "merged_files": sorted(merged_files),
+    }
+    for shard_manifest in manifests:
+        merged["versions"].update(shard_manifest["versions"])
+        merged["peak_rss"].update(shard_manifest.get("peak_rss", {}))
+    versions_hashes = [
+        shard_manifest["versions_hash"]
+        for shard_manifest in manifests
+        if "versions_hash" in shard_manifest
+    ]
+    if versions_hashes:
+        merged["versions_hash"] = versions_hashes[0]
+        if len(set(versions_hashes)) > 1:
+            logger.warning("Shards were built from different sets of versions")
+    manifest.save_manifest(manifest.get_manifest_path(outputroot), merged)
+    return conflicts
@@ -25,17 +25,24 @@
 #
 # SPDX-License-Identifier: BSD-2-Clause
 
+import base64
 import datetime
-import json
+import functools
 import collections
+import html
+import json
 import logging
 import os
 import posixpath
+import sys
 
 from sphinx import config as sphinx_config
 from sphinx.util import i18n as sphinx_i18n
 from sphinx.locale import _
 
+from . import fileutil
+from . import metadata as metadata_store
+
 logger = logging.getLogger(__name__)
 
 DATE_FMT = "%Y-%m-%d %H:%M:%S %z"
@@ -44,6 +51,9 @@ DEFAULT_BRANCH_WHITELIST = r"^.*$"
 DEFAULT_REMOTE_WHITELIST = None
 DEFAULT_RELEASED_PATTERN = r"^tags/.*$"
 DEFAULT_OUTPUTDIR_FORMAT = r"{ref.name}"
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+VERSIONS_INDEX_FILENAME = "versions.json"
+VERSIONS_INDEX_FORMAT = 1
 
 Version = collections.namedtuple(
     "Version",
@@ -57,53 +67,148 @@ Version = collections.namedtuple(
 )
 
 
+class VersionTable:
+    """
+    Per-build data of all versions that doesn't depend on the current page.
+
+    It is computed once in ``config-inited``, so that rendering a page only
+    needs to look up names and join paths.
+    """
+
+    def __init__(self, metadata, current_version_name):
+        self.metadata = metadata
+        self.current_version_name = current_version_name
+
+        self.tags = []
+        self.branches = []
+        self.releases = []
+        self.in_development = []
+        for name, v in metadata.items():
+            if v["source"] == "tags":
+                self.tags.append(name)
+            else:
+                self.branches.append(name)
+            if v["is_released"]:
+                self.releases.append(name)
+            else:
+                self.in_development.append(name)
+
+        # Relative paths from the current version's outputdir to the
+        # outputdirs of all versions, using POSIX separators (for the HTML
+        # code)
+        current_outputdir = os.path.abspath(
+            metadata[current_version_name]["outputdir"]
+        )
+        self.outputdirs = {}
+        self.docnames = {}
+        for name, v in metadata.items():
+            outputdir = os.path.relpath(
+                os.path.abspath(v["outputdir"]), start=current_outputdir
+            )
+            self.outputdirs[name] = outputdir.replace(os.sep, posixpath.sep)
+
+            docnames = v["docnames"]
+            if isinstance(docnames, list):
+                docnames = frozenset(docnames)
+            self.docnames[name] = docnames
+
+
+def get_versions_index(metadata, outputroot):
+    """
+    Returns the version index that is read by the client-side version
+    switcher.
+
+    The docnames of all versions are stored in a single sorted list, and each
+    version has a base64-encoded bitset that marks which of them it contains.
+    """
+    docnames = sorted(
+        {docname for data in metadata.values() for docname in data["docnames"]}
+    )
+    docname_index = {docname: i for i, docname in enumerate(docnames)}
+    versions = []
+    for name, data in metadata.items():
+        bitset = bytearray((len(docnames) + 7) // 8)
+        for docname in data["docnames"]:
+            i = docname_index[docname]
+            bitset[i // 8] |= 1 << (i % 8)
+        outputdir = os.path.relpath(
+            os.path.abspath(data["outputdir"]), start=outputroot
+        )
+        versions.append(
+            {
+                "name": name,
+                "version": data["version"],
+                "release": data["release"],
+                "is_released": data["is_released"],
+                "source": data["source"],
+                "outputdir": outputdir.replace(os.sep, posixpath.sep),
+                "docnames": base64.b64encode(bytes(bitset)).decode(),
+            }
+        )
+    return {
+        "format": VERSIONS_INDEX_FORMAT,
+        "docnames": docnames,
+        "versions": versions,
+    }
+
+
+def write_versions_index(path, metadata):
+    """
+    Writes the version index for all versions in ``metadata`` to ``path``.
+    """
+    index = get_versions_index(metadata, os.path.dirname(path))
+    with fileutil.atomic_write(path) as fp:
+        json.dump(index, fp, separators=(",", ":"))
+
+
 class VersionInfo:
-    def __init__(self, app, context, metadata, current_version_name):
+    def __init__(
+        self, app, context, metadata, current_version_name, table=None
+    ):
         self.app = app
         self.context = context
         self.metadata = metadata
         self.current_version_name = current_version_name
-
-    def _dict_to_versionobj(self, v):
-        return Version(
-            name=v["name"],
-            url=self.vpathto(v["name"]),
-            version=v["version"],
-            release=v["release"],
-            is_released=v["is_released"],
-        )
+        if table is None:
+            table = VersionTable(metadata, current_version_name)
+        self.table = table
+        self._pagename = None
+        self._versions = {}
+
+    def _get_version(self, name):
+        pagename = self.context["pagename"]
+        if pagename != self._pagename:
+            self._pagename = pagename
+            self._versions = {}
+
+        version = self._versions.get(name)
+        if version is None:
+            v = self.metadata[name]
+            version = Version(
+                name=v["name"],
+                url=self.vpathto(name),
+                version=v["version"],
+                release=v["release"],
+                is_released=v["is_released"],
+            )
+            self._versions[name] = version
+        return version
 
     @property
     def tags(self):
-        return [
-            self._dict_to_versionobj(v)
-            for v in self.metadata.values()
-            if v["source"] == "tags"
-        ]
+        return [self._get_version(name) for name in self.table.tags]
 
     @property
     def branches(self):
-        return [
-            self._dict_to_versionobj(v)
-            for v in self.metadata.values()
-            if v["source"] != "tags"
-        ]
+        return [self._get_version(name) for name in self.table.branches]
 
     @property
     def releases(self):
-        return [
-            self._dict_to_versionobj(v)
-            for v in self.metadata.values()
-            if v["is_released"]
-        ]
+        return [self._get_version(name) for name in self.table.releases]
 
     @property
     def in_development(self):
-        return [
-            self._dict_to_versionobj(v)
-            for v in self.metadata.values()
-            if not v["is_released"]
-        ]
+        return [self._get_version(name) for name in self.table.in_development]
 
     def __iter__(self):
         for item in self.tags:
@@ -112,64 +217,119 @@ class VersionInfo:
             yield item
 
     def __getitem__(self, name):
-        v = self.metadata.get(name)
-        if v:
-            return self._dict_to_versionobj(v)
+        if name in self.table.outputdirs:
+            return self._get_version(name)
 
     def vhasdoc(self, other_version_name):
         if self.current_version_name == other_version_name:
             return True
 
-        other_version = self.metadata[other_version_name]
-        return self.context["pagename"] in other_version["docnames"]
+        docnames = self.table.docnames[other_version_name]
+        return self.context["pagename"] in docnames
 
     def vpathto(self, other_version_name):
+        pagename = self.context["pagename"]
         if self.current_version_name == other_version_name:
-            return "{}.html".format(
-                posixpath.split(self.context["pagename"])[-1]
-            )
+            return "{}.html".format(posixpath.split(pagename)[-1])
+
+        # Find relative path to root of other_version's outputdir
+        other_outputdir = "../" * pagename.count(posixpath.sep)
+        other_outputdir += self.table.outputdirs[other_version_name]
 
-        # Find relative outputdir paths from common output root
-        current_version = self.metadata[self.current_version_name]
-        other_version = self.metadata[other_version_name]
+        if not self.vhasdoc(other_version_name):
+            return posixpath.join(other_outputdir, "index.html")
 
-        current_outputroot = os.path.abspath(current_version["outputdir"])
-        other_outputroot = os.path.abspath(other_version["outputdir"])
-        outputroot = os.path.commonpath((current_outputroot, other_outputroot))
+        return posixpath.join(other_outputdir, "{}.html".format(pagename))
 
-        current_outputroot = os.path.relpath(
-            current_outputroot, start=outputroot
-        )
-        other_outputroot = os.path.relpath(other_outputroot, start=outputroot)
 
-        # Ensure that we use POSIX separators in the path (for the HTML code)
-        if os.sep != posixpath.sep:
-            current_outputroot = posixpath.join(
-                *os.path.split(current_outputroot)
-            )
-            other_outputroot = posixpath.join(*os.path.split(other_outputroot))
+class ReadMonitor:
+    """
+    Audit hook that warns about files and directories below ``basedir`` that
+    are read during the build, but are not below any of the materialized
+    ``paths`` (and therefore are missing from the checkout).
+    """
 
-        # Find relative path to root of other_version's outputdir
-        current_outputdir = posixpath.dirname(
-            posixpath.join(current_outputroot, self.context["pagename"])
-        )
-        other_outputdir = posixpath.relpath(
-            other_outputroot, start=current_outputdir
+    EVENTS = frozenset(("open", "os.listdir", "os.scandir"))
+    WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_CREAT
+
+    def __init__(self, basedir, paths, cwd=None):
+        self.basedir = os.path.join(os.path.abspath(basedir), "")
+        self.paths = tuple(os.path.abspath(path) for path in paths)
+        self.cwd = os.path.abspath(cwd or os.getcwd())
+        self.reported = set()
+
+    def is_missing(self, path, listing=False):
+        path = os.path.abspath(path)
+        # The build's working dir is created even if it's not materialized
+        if not path.startswith(self.basedir) or path == self.cwd:
+            return False
+        # The import system lists the directories on sys.path
+        if listing and path in {os.path.abspath(entry) for entry in sys.path}:
+            return False
+        # Parents of materialized paths exist as well
+        return not any(
+            path == other
+            or path.startswith(os.path.join(other, ""))
+            or other.startswith(os.path.join(path, ""))
+            for other in self.paths
         )
 
-        if not self.vhasdoc(other_version_name):
-            return posixpath.join(other_outputdir, "index.html")
+    def __call__(self, event, args):
+        if event not in self.EVENTS:
+            return
 
-        return posixpath.join(
-            other_outputdir, "{}.html".format(self.context["pagename"])
-        )
+        path = args[0]
+        if event == "open":
+            mode, flags = args[1], args[2]
+            if isinstance(mode, str):
+                if set(mode) & set("wax+"):
+                    return
+            elif flags & self.WRITE_FLAGS:
+                return
+        if isinstance(path, (bytes, os.PathLike)):
+            path = os.fsdecode(path)
+        if not isinstance(path, str) or path in self.reported:
+            return
+
+        if self.is_missing(path, listing=event != "open"):
+            self.reported.add(path)
+            logger.warning(
+                "%s is read during the build, but is not included in "
+                "smv_materialize_paths",
+                path,
+            )
 
 
-def html_page_context(app, pagename, templatename, context, doctree):
+def html_page_context(
+    app, pagename, templatename, context, doctree, table, versions_index=None
+):
     versioninfo = VersionInfo(
-        app, context, app.config.smv_metadata, app.config.smv_current_version
+        app,
+        context,
+        app.config.smv_metadata,
+        app.config.smv_current_version,
+        table=table,
     )
-    context["versions"] = versioninfo
+    if versions_index is not None:
+        # The version switcher is rendered client-side, so that pages don't
+        # depend on the other versions. The index path is relative to the
+        # page, because the script might be moved by --dedup shared.
+        context["versions"] = None
+        metatags = [
+            '<meta name="smv-pagename" content="{}">'.format(
+                html.escape(pagename)
+            ),
+            '<meta name="smv-versions-index" content="{}">'.format(
+                html.escape(
+                    "../" * pagename.count(posixpath.sep) + versions_index
+                )
+            ),
+        ]
+        context["metatags"] = "\n".join(
+            [context.get("metatags", ""), *metatags]
+        )
+    else:
+        context["versions"] = versioninfo
     context["vhasdoc"] = versioninfo.vhasdoc
     context["vpathto"] = versioninfo.vpathto
 
@@ -187,10 +347,7 @@ def config_inited(app, config):
         if not config.smv_metadata_path:
             return
 
-        with open(config.smv_metadata_path, mode="r") as f:
-            metadata = json.load(f)
-
-        config.smv_metadata = metadata
+        config.smv_metadata = metadata_store.load(config.smv_metadata_path)
 
     if not config.smv_current_version:
         return
@@ -200,7 +357,34 @@ def config_inited(app, config):
     except KeyError:
         return
 
-    app.connect("html-page-context", html_page_context)
+    # Nothing can be missing if the whole tree was materialized
+    materialized_paths = data.get("materialized_paths")
+    if (
+        materialized_paths
+        and os.path.normpath(data["basedir"]) not in materialized_paths
+        and hasattr(sys, "addaudithook")
+    ):
+        sys.addaudithook(ReadMonitor(data["basedir"], materialized_paths))
+
+    versions_index = None
+    if config.smv_versions_index_path:
+        versions_index = os.path.relpath(
+            config.smv_versions_index_path,
+            start=os.path.abspath(data["outputdir"]),
+        ).replace(os.sep, posixpath.sep)
+        config.html_static_path = [*config.html_static_path, STATIC_DIR]
+        app.add_js_file(
+            "smv_versions.js",
+            **{"data-current-version": config.smv_current_version},
+        )
+
+    table = VersionTable(app.config.smv_metadata, config.smv_current_version)
+    app.connect(
+        "html-page-context",
+        functools.partial(
+            html_page_context, table=table, versions_index=versions_index
+        ),
+    )
 
     # Restore config values
     old_config = sphinx_config.Config.read(data["confdir"])
@@ -219,10 +403,17 @@ def config_inited(app, config):
 
 
 def setup(app):
-    app.add_config_value("smv_metadata", {}, "html")
+    app.add_config_value(
+        "smv_metadata",
+        {},
+        "html",
+        types=(dict, metadata_store.MetadataStore),
+    )
     app.add_config_value("smv_metadata_path", "", "html")
     app.add_config_value("smv_current_version", "", "html")
     app.add_config_value("smv_latest_version", "master", "html")
+    app.add_config_value("smv_static_versions", False, "html")
+    app.add_config_value("smv_versions_index_path", "", "html")
     app.add_config_value("smv_tag_whitelist", DEFAULT_TAG_WHITELIST, "html")
     app.add_config_value(
         "smv_branch_whitelist", DEFAULT_BRANCH_WHITELIST, "html"
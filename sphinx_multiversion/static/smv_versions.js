@@ -0,0 +1,120 @@
+/*
+ * Client-side version switcher of sphinx-multiversion.
+ *
+ * Reads the version index (versions.json) from the output root and renders
+ * links to the current page in all other versions into each element with the
+ * "smv-versions" class. The loaded versions are also passed to listeners of
+ * the "smv-versions-loaded" event, so that themes can render them on their
+ * own.
+ *
+ * SPDX-License-Identifier: BSD-2-Clause
+ */
+(function () {
+  "use strict";
+
+  var script = document.currentScript;
+  var currentVersion = script.dataset.currentVersion;
+
+  function getMeta(name, fallback) {
+    var meta = document.querySelector('meta[name="' + name + '"]');
+    return meta ? meta.content : fallback;
+  }
+
+  // The index path is relative to the page, because the script itself might
+  // have been moved (e.g. by --dedup shared)
+  var indexUrl = new URL(
+    getMeta("smv-versions-index", "../versions.json"),
+    document.baseURI
+  );
+
+  function hasDoc(bitset, i) {
+    return i >= 0 && (bitset.charCodeAt(i >> 3) & (1 << (i & 7))) !== 0;
+  }
+
+  function getVersions(index, pagename) {
+    var docnameIndex = index.docnames.indexOf(pagename);
+    return index.versions.map(function (version) {
+      var isCurrent = version.name === currentVersion;
+      var hasdoc = isCurrent || hasDoc(atob(version.docnames), docnameIndex);
+      var path = version.outputdir + "/" + (hasdoc ? pagename : "index");
+      return {
+        name: version.name,
+        version: version.version,
+        release: version.release,
+        is_released: version.is_released,
+        source: version.source,
+        is_current: isCurrent,
+        hasdoc: hasdoc,
+        url: new URL(path + ".html", indexUrl).href,
+      };
+    });
+  }
+
+  function renderList(container, title, versions) {
+    if (!versions.length) {
+      return;
+    }
+    var heading = document.createElement("h3");
+    heading.textContent = title;
+    var list = document.createElement("ul");
+    versions.forEach(function (version) {
+      var item = document.createElement("li");
+      var link = document.createElement("a");
+      link.href = version.url;
+      link.textContent = version.name;
+      if (version.is_current) {
+        item.className = "current";
+      }
+      item.appendChild(link);
+      list.appendChild(item);
+    });
+    container.appendChild(heading);
+    container.appendChild(list);
+  }
+
+  function render(versions) {
+    var containers = document.querySelectorAll(".smv-versions");
+    Array.prototype.forEach.call(containers, function (container) {
+      renderList(
+        container,
+        "Branches",
+        versions.filter(function (version) {
+          return version.source !== "tags";
+        })
+      );
+      renderList(
+        container,
+        "Tags",
+        versions.filter(function (version) {
+          return version.source === "tags";
+        })
+      );
+    });
+    document.dispatchEvent(
+      new CustomEvent("smv-versions-loaded", { detail: versions })
+    );
+  }
+
+  var versions = fetch(indexUrl)
+    .then(function (response) {
+      if (!response.ok) {
+        throw new Error("Failed to load " + indexUrl);
+      }
+      return response.json();
+    })
+    .then(function (index) {
+      return getVersions(index, getMeta("smv-pagename", "index"));
+    });
+
+  function onReady() {
+    versions.then(render).catch(function (err) {
+      console.error("sphinx-multiversion:", err);
+    });
+  }
+
+  if (document.readyState === "loading") {
+    document.addEventListener("DOMContentLoaded", onReady);
+  } else {
+    onReady();
+  }
+})();
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import collections
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from . import fileutil
+
+TIMINGS_FORMAT = 1
+
+Span = collections.namedtuple(
+    "Span",
+    [
+        "stage",
+        "ref",
+        "start",
+        "end",
+        "cpu",
+        "thread",
+        "args",
+    ],
+)
+
+# Thread IDs of spans that have been recorded for child processes
+CHILD_THREAD_OFFSET = 1 << 32
+
+
+def get_maxrss(rusage):
+    """Returns the peak RSS in bytes from a ``resource.struct_rusage``."""
+    # Linux reports kilobytes, macOS reports bytes
+    if sys.platform == "darwin":
+        return rusage.ru_maxrss
+    return rusage.ru_maxrss * 1024
+
+
+class Recorder:
+    """
+    Records the wall time and CPU time of the stages of a run, optionally
+    per ref, and writes them as JSON or as Chrome trace events.
+
+    CPU time is measured for the recording thread only. Stages that run in
+    child processes (i.e. builds) are recorded with :meth:`add` together with
+    the resource usage reported for the child. Spans whose work is done
+    elsewhere set their ``cpu`` argument to the CPU time measured there, or
+    to ``None`` if it is unknown.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.threads = {}
+        self.lock = threading.Lock()
+
+    def _get_thread(self):
+        thread = threading.current_thread()
+        with self.lock:
+            return self.threads.setdefault(
+                thread.ident, (len(self.threads) + 1, thread.name)
+            )[0]
+
+    @contextlib.contextmanager
+    def span(self, stage, ref=None):
+        """
+        Records the time spent in the ``with`` block. The yielded dict can be
+        used to add arguments to the span (e.g. the number of bytes), and to
+        override the CPU time using the ``cpu`` key.
+        """
+        args = {}
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield args
+        finally:
+            cpu = args.pop("cpu", time.thread_time() - cpu_start)
+            self.add(
+                stage,
+                ref,
+                start,
+                time.perf_counter(),
+                cpu=cpu,
+                thread=self._get_thread(),
+                **args,
+            )
+
+    def add(self, stage, ref, start, end, cpu=None, thread=None, **args):
+        """
+        Adds a span that started and ended at the given
+        :func:`time.perf_counter` values.
+        """
+        if thread is None:
+            thread = self._get_thread()
+        with self.lock:
+            self.spans.append(Span(stage, ref, start, end, cpu, thread, args))
+
+    def get_summary(self):
+        stages = collections.OrderedDict()
+        for span in sorted(self.spans, key=lambda span: span.start):
+            stage = stages.setdefault(
+                span.stage,
+                {"count": 0, "wall_seconds": 0.0, "cpu_seconds": None},
+            )
+            stage["count"] += 1
+            stage["wall_seconds"] += span.end - span.start
+            if span.cpu is not None:
+                stage["cpu_seconds"] = (stage["cpu_seconds"] or 0.0) + span.cpu
+            if "bytes" in span.args:
+                stage["bytes"] = stage.get("bytes", 0) + span.args["bytes"]
+            if "peak_rss" in span.args:
+                stage["peak_rss"] = max(
+                    stage.get("peak_rss", 0), span.args["peak_rss"]
+                )
+        return stages
+
+    def write_timings(self, path):
+        """
+        Writes the recorded spans and a per-stage summary as JSON.
+        """
+        data = {
+            "format": TIMINGS_FORMAT,
+            "wall_seconds": time.perf_counter() - self.origin,
+            "cpu_seconds": time.process_time(),
+            "stages": self.get_summary(),
+            "spans": [
+                {
+                    "stage": span.stage,
+                    "ref": span.ref,
+                    "start": span.start - self.origin,
+                    "wall_seconds": span.end - span.start,
+                    "cpu_seconds": span.cpu,
+                    **span.args,
+                }
+                for span in sorted(self.spans, key=lambda span: span.start)
+            ],
+        }
+        if resource is not None:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            data["peak_rss"] = get_maxrss(usage)
+            data["peak_child_rss"] = get_maxrss(children)
+            data["child_cpu_seconds"] = children.ru_utime + children.ru_stime
+
+        with fileutil.atomic_write(path) as fp:
+            json.dump(data, fp, indent=2)
+
+    def write_trace(self, path):
+        """
+        Writes the recorded spans in the Chrome trace event format, which can
+        be viewed with ``chrome://tracing`` or https://ui.perfetto.dev.
+        """
+        pid = os.getpid()
+        events = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": 0,
+                "args": {"name": "sphinx-multiversion"},
+            }
+        ]
+        for tid, name in self.threads.values():
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+            )
+        for span in self.spans:
+            if span.thread >= CHILD_THREAD_OFFSET:
+                events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": pid,
+                        "tid": span.thread,
+                        "args": {"name": "{} {}".format(span.stage, span.ref)},
+                    }
+                )
+            events.append(
+                {
+                    "name": (
+                        span.stage
+                        if span.ref is None
+                        else "{} {}".format(span.stage, span.ref)
+                    ),
+                    "cat": span.stage,
+                    "ph": "X",
+                    "ts": (span.start - self.origin) * 1e6,
+                    "dur": (span.end - span.start) * 1e6,
+                    "pid": pid,
+                    "tid": span.thread,
+                    "args": dict(span.args, cpu_seconds=span.cpu),
+                }
+            )
+
+        with fileutil.atomic_write(path) as fp:
+            json.dump({"traceEvents": events}, fp)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import json
+import logging
+import os
+import time
+
+from . import fileutil
+
+STATUS_FORMAT = 1
+
+logger = logging.getLogger(__name__)
+
+
+def get_refs_state(gitdir):
+    """
+    Returns the modification times and sizes of the loose refs and the
+    :file:`packed-refs` file in ``gitdir``.
+    """
+    state = {}
+    packed_refs = os.path.join(gitdir, "packed-refs")
+    try:
+        st = os.stat(packed_refs)
+    except FileNotFoundError:
+        pass
+    else:
+        state[packed_refs] = (st.st_mtime_ns, st.st_size)
+
+    for root, dirs, files in os.walk(os.path.join(gitdir, "refs")):
+        for name in files:
+            if name.endswith(".lock"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            state[path] = (st.st_mtime_ns, st.st_size)
+    return state
+
+
+def get_changes(old_state, new_state):
+    """Returns the paths that were added, removed or modified."""
+    return {
+        path
+        for path in old_state.keys() | new_state.keys()
+        if old_state.get(path) != new_state.get(path)
+    }
+
+
+class Status:
+    """
+    Status and counters of the watch loop, optionally written as JSON to
+    ``path`` whenever they change.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.data = {
+            "format": STATUS_FORMAT,
+            "pid": os.getpid(),
+            "state": "starting",
+            "pending_changes": 0,
+            "changes_detected": 0,
+            "builds": 0,
+            "failed_builds": 0,
+            "last_change": None,
+            "last_build_started": None,
+            "last_build_finished": None,
+            "last_build_seconds": None,
+            "last_build_latency": None,
+            "last_exit_code": None,
+        }
+
+    def update(self, **kwargs):
+        self.data.update(kwargs)
+        if self.path is None:
+            return
+        with fileutil.atomic_write(self.path) as fp:
+            json.dump(self.data, fp, indent=2)
+
+
+def watch(
+    run, gitdir, interval=1.0, debounce=2.0, status_path=None, max_builds=None
+):
+    """
+    Calls ``run()`` once and then again whenever the refs in ``gitdir``
+    change, until interrupted.
+
+    Changes are debounced, i.e. ``run()`` is only called once the refs
+    haven't changed for ``debounce`` seconds, so that a push of several refs
+    only triggers a single rebuild. Returns the exit code of the last run.
+    """
+    status = Status(status_path)
+    state = get_refs_state(gitdir)
+    pending = set()
+    first_change = None
+    last_change = None
+    returncode = None
+
+    def build():
+        nonlocal returncode
+        started = time.time()
+        status.update(
+            state="building",
+            pending_changes=0,
+            last_build_started=started,
+        )
+        try:
+            returncode = run()
+        except Exception:
+            logger.exception("Build failed")
+            returncode = 1
+        finished = time.time()
+        status.update(
+            state="idle",
+            builds=status.data["builds"] + 1,
+            failed_builds=status.data["failed_builds"] + bool(returncode),
+            last_build_finished=finished,
+            last_build_seconds=finished - started,
+            last_build_latency=(
+                finished - first_change if first_change is not None else None
+            ),
+            last_exit_code=returncode,
+        )
+
+    try:
+        build()
+        logger.info("Watching %s for changed refs", gitdir)
+        while max_builds is None or status.data["builds"] < max_builds:
+            time.sleep(interval)
+            new_state = get_refs_state(gitdir)
+            changes = get_changes(state, new_state)
+            state = new_state
+            now = time.monotonic()
+            if changes:
+                logger.debug("Changed refs: %s", ", ".join(sorted(changes)))
+                pending |= changes
+                last_change = now
+                if first_change is None:
+                    first_change = time.time()
+                status.update(
+                    state="waiting",
+                    pending_changes=len(pending),
+                    changes_detected=(
+                        status.data["changes_detected"] + len(changes)
+                    ),
+                    last_change=time.time(),
+                )
+                continue
+
+            if pending and now - last_change >= debounce:
+                logger.info("Rebuilding after %d changed refs", len(pending))
+                pending = set()
+                build()
+                first_change = None
+    except KeyboardInterrupt:
+        logger.info("Stopped watching")
+    finally:
+        status.update(state="stopped")
+    return returncode
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from . import cache
+from . import fileutil
+from . import git
+
+LOCK_SUFFIX = ".lock"
+STATE_SUFFIX = ".json"
+
+logger = logging.getLogger(__name__)
+
+
+def _lock(path, shared=True, blocking=True):
+    """
+    Opens the lock file at ``path`` and locks it using :func:`fcntl.flock`.
+
+    If the lock file was removed while waiting for the lock (because the
+    tree was evicted), it is recreated and locked again. Returns the open
+    lock file, or ``None`` if ``blocking`` is false and the file is locked by
+    someone else.
+    """
+    operation = 0
+    if fcntl is not None:
+        operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            operation |= fcntl.LOCK_NB
+
+    while True:
+        fp = open(path, mode="a")
+        if fcntl is None:
+            return fp
+        try:
+            fcntl.flock(fp.fileno(), operation)
+            if os.path.samestat(os.fstat(fp.fileno()), os.stat(path)):
+                return fp
+        except BlockingIOError:
+            fp.close()
+            return None
+        except FileNotFoundError:
+            pass
+        except BaseException:
+            fp.close()
+            raise
+        fp.close()
+
+
+def _load_state(path):
+    try:
+        with open(path + STATE_SUFFIX, mode="r") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+class Workdir:
+    """
+    Directory that keeps the materialized trees of commits across runs.
+
+    Each tree has a lock file next to it. Runs hold a shared lock on all
+    trees they use, so that concurrent runs can use the same trees, but
+    never evict a tree that is still in use. Materializing a tree requires an
+    exclusive lock, and a tree is only considered complete once its state
+    file has been written.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.locks = {}
+        os.makedirs(self.path, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_checkout_path(self, commit, paths=(".",)):
+        """
+        Returns the path of the tree of ``commit``, which contains the files
+        below ``paths``.
+        """
+        paths = list(paths)
+        if paths == ["."]:
+            return os.path.join(self.path, commit)
+        digest = hashlib.sha256("\0".join(paths).encode()).hexdigest()
+        return os.path.join(self.path, "{}-{}".format(commit, digest[:12]))
+
+    def checkout(self, gitroot, gitref, paths=(".",), store=None):
+        """
+        Materializes the files below ``paths`` in the tree of ``gitref``
+        (see :func:`git.copy_tree` and :func:`git.link_tree`), unless the
+        workdir already contains them, and locks the tree until
+        :meth:`close` is called.
+
+        Returns the number of bytes written.
+        """
+        paths = list(paths)
+        path = self.get_checkout_path(gitref.commit, paths)
+        if path in self.locks:
+            return 0
+
+        lockpath = path + LOCK_SUFFIX
+        written = 0
+        while True:
+            lockfp = _lock(lockpath)
+            if _load_state(path) is not None:
+                break
+
+            # Upgrading the lock isn't atomic, so check again afterwards
+            lockfp.close()
+            lockfp = _lock(lockpath, shared=False)
+            try:
+                if _load_state(path) is None:
+                    logger.debug(
+                        "Materializing %s in workdir %s", gitref.refname, path
+                    )
+                    shutil.rmtree(path, ignore_errors=True)
+                    if store is not None:
+                        written += git.link_tree(
+                            gitroot, path, gitref, store, paths
+                        )
+                    else:
+                        written += git.copy_tree(
+                            gitroot, gitroot, path, gitref, paths
+                        )
+                    with fileutil.atomic_write(path + STATE_SUFFIX) as fp:
+                        json.dump(
+                            {
+                                "commit": gitref.commit,
+                                "paths": paths,
+                                "size": cache.get_size(path),
+                            },
+                            fp,
+                        )
+            finally:
+                lockfp.close()
+
+        # The modification time of the state file marks the last use
+        os.utime(path + STATE_SUFFIX)
+        self.locks[path] = lockfp
+        return written
+
+    def evict(self, max_size):
+        """
+        Removes the least recently used trees until the total size of the
+        workdir is below ``max_size`` bytes. Trees that are locked by this or
+        any other run are never removed.
+        """
+        entries = []
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if not os.path.isdir(path):
+                continue
+            state = _load_state(path)
+            try:
+                last_used = os.stat(path + STATE_SUFFIX).st_mtime
+            except OSError:
+                # Incomplete trees are removed first
+                state, last_used = None, 0
+            size = state.get("size", 0) if state else cache.get_size(path)
+            entries.append((last_used, path, size))
+        entries.sort()
+
+        total_size = sum(size for _, _, size in entries)
+        for last_used, path, size in entries:
+            if total_size <= max_size and last_used:
+                break
+            if path in self.locks:
+                continue
+            lockfp = _lock(path + LOCK_SUFFIX, shared=False, blocking=False)
+            if lockfp is None:
+                continue
+            try:
+                logger.debug("Evicting %s from workdir", path)
+                # Remove the state first, so that the tree is considered
+                # incomplete if this is interrupted
+                try:
+                    os.unlink(path + STATE_SUFFIX)
+                except FileNotFoundError:
+                    pass
+                shutil.rmtree(path, ignore_errors=True)
+                os.unlink(path + LOCK_SUFFIX)
+            finally:
+                lockfp.close()
+            total_size -= size
+
+    def close(self):
+        """
+        Releases the locks of all trees used by this run.
+        """
+        for lockfp in self.locks.values():
+            lockfp.close()
+        self.locks = {}
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import os
+import tempfile
+import unittest
+
+import sphinx_multiversion
+
+
+class GetPriorityOrderTestCase(unittest.TestCase):
+    def test_get_priority_order(self):
+        metadata = {
+            "dev": {
+                "is_released": False,
+                "creatordate": "2020-08-01 10:00:00 +0000",
+            },
+            "master": {
+                "is_released": False,
+                "creatordate": "2020-08-07 07:45:20 -0700",
+            },
+            "v0.1.0": {
+                "is_released": True,
+                "creatordate": "2020-07-16 08:45:20 -0100",
+            },
+            "v0.2.0": {
+                "is_released": True,
+                "creatordate": "2020-08-06 11:53:06 -0400",
+            },
+            "v0.2.1": {
+                "is_released": True,
+                "creatordate": "2020-08-06 16:00:00 +0200",
+            },
+        }
+        self.assertEqual(
+            sphinx_multiversion.build.get_priority_order(metadata, "v0.2.0"),
+            ["v0.2.0", "master", "dev", "v0.2.1", "v0.1.0"],
+        )
+
+
+class PublishTestCase(unittest.TestCase):
+    def test_publish(self):
+        with tempfile.TemporaryDirectory() as outputroot:
+            outputdir = os.path.join(outputroot, "v1.0")
+            for content in ("old", "new"):
+                staging = sphinx_multiversion.build.get_staging_path(
+                    outputroot, "v1.0"
+                )
+                os.makedirs(staging)
+                with open(os.path.join(staging, "index.html"), "w") as fp:
+                    fp.write(content)
+                sphinx_multiversion.build.publish(staging, outputdir)
+                self.assertFalse(os.path.exists(staging))
+
+            with open(os.path.join(outputdir, "index.html")) as fp:
+                self.assertEqual(fp.read(), "new")
+
+
+class FakeProcess:
+    def __init__(self, events, name, duration, returncode=0):
+        self.pid = os.getpid()
+        self.rusage = None
+        self.events = events
+        self.name = name
+        self.remaining = duration
+        self.returncode = returncode
+        events.append(("start", name))
+
+    def poll(self):
+        self.remaining -= 1
+        if self.remaining > 0:
+            return None
+        self.events.append(("end", self.name))
+        return self.returncode
+
+    def wait(self):
+        returncode = self.poll()
+        while returncode is None:
+            returncode = self.poll()
+        return returncode
+
+
+class RunSequentialTestCase(unittest.TestCase):
+    def test_failure(self):
+        events = []
+        jobs = [
+            sphinx_multiversion.build.BuildJob(name, [], None, None)
+            for name in ("a", "b")
+        ]
+
+        def start(job):
+            return FakeProcess(events, job.name, 1, int(job.name == "a"))
+
+        with self.assertLogs(sphinx_multiversion.build.logger):
+            failed = sphinx_multiversion.build.run_sequential(jobs, start)
+        # The remaining jobs still run after a failure
+        self.assertEqual(failed, ["a"])
+        self.assertIn(("end", "b"), events)
+
+
+class RunParallelTestCase(unittest.TestCase):
+    def run_jobs(self, durations, **kwargs):
+        events = []
+        jobs = [
+            sphinx_multiversion.build.BuildJob(name, [], None, None)
+            for name in durations
+        ]
+
+        def start(job, stdout, stderr):
+            return FakeProcess(events, job.name, durations[job.name])
+
+        with tempfile.TemporaryDirectory() as logdir:
+            failed = sphinx_multiversion.build.run_parallel(
+                jobs, start, len(jobs), logdir, **kwargs
+            )
+        self.assertEqual(failed, [])
+        return events
+
+    def test_memory_limit(self):
+        peak_rss = {"a": 600, "b": 600, "c": 300}
+        events = self.run_jobs(
+            {"a": 3, "b": 1, "c": 1},
+            memory_limit=1000,
+            peak_rss=peak_rss,
+        )
+        # b doesn't fit next to a, but c does
+        self.assertEqual(
+            events[:3],
+            [("start", "a"), ("start", "c"), ("end", "c")],
+        )
+        self.assertLess(
+            events.index(("end", "a")), events.index(("start", "b"))
+        )
+        if os.path.isdir("/proc"):
+            # The sampled RSS (of the test process) is learned
+            self.assertGreater(peak_rss["a"], 600)
+
+    def test_no_memory_limit(self):
+        events = self.run_jobs({"a": 2, "b": 1})
+        self.assertEqual(events[:2], [("start", "a"), ("start", "b")])
+
+    def test_follow_ups(self):
+        events = []
+        jobs = [
+            sphinx_multiversion.build.BuildJob(name, [], None, None)
+            for name in ("a", "b")
+        ]
+
+        def start(job, stdout, stderr):
+            return FakeProcess(events, job.name, 1)
+
+        def on_finished(job, result):
+            if job.name == "a":
+                return [
+                    sphinx_multiversion.build.BuildJob("c", [], None, None)
+                ]
+
+        with tempfile.TemporaryDirectory() as logdir:
+            sphinx_multiversion.build.run_parallel(
+                jobs, start, 1, logdir, on_finished=on_finished
+            )
+        # Follow-ups are started before the remaining jobs
+        self.assertEqual(
+            [name for event, name in events if event == "start"],
+            ["a", "c", "b"],
+        )
+
+
+@unittest.skipUnless(os.path.isdir("/proc"), "requires /proc")
+class GetProcessTreeRssTestCase(unittest.TestCase):
+    def test_get_process_tree_rss(self):
+        rss = sphinx_multiversion.build.get_process_tree_rss([os.getppid()])
+        own_rss = sphinx_multiversion.build.get_process_tree_rss([os.getpid()])
+        self.assertGreater(own_rss[os.getpid()], 0)
+        self.assertGreaterEqual(rss[os.getppid()], own_rss[os.getpid()])
+
+
+class SplitJobsTestCase(unittest.TestCase):
+    def test_more_versions_than_jobs(self):
+        self.assertEqual(sphinx_multiversion.build.split_jobs(4, 10), (4, 1))
+
+    def test_more_jobs_than_versions(self):
+        self.assertEqual(sphinx_multiversion.build.split_jobs(8, 3), (3, 2))
+        self.assertEqual(sphinx_multiversion.build.split_jobs(8, 1), (1, 8))
+
+    def test_single_job(self):
+        self.assertEqual(sphinx_multiversion.build.split_jobs(1, 5), (1, 1))
+
+
+def _print_environment(args):
+    print(os.getcwd(), os.environ["SMV_TEST"], *args)
+    return 3
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+class ForkedProcessTestCase(unittest.TestCase):
+    def test_forked_process(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmpdir = os.path.realpath(tmpdir)
+            stdout_path = os.path.join(tmpdir, "out.log")
+            with open(stdout_path, mode="w") as stdout:
+                proc = sphinx_multiversion.build.ForkedProcess(
+                    _print_environment,
+                    ["a", "b"],
+                    cwd=tmpdir,
+                    env={"SMV_TEST": "value"},
+                    stdout=stdout,
+                )
+                self.assertEqual(proc.wait(), 3)
+            self.assertEqual(proc.poll(), 3)
+            self.assertNotIn("SMV_TEST", os.environ)
+
+            with open(stdout_path, mode="r") as fp:
+                self.assertEqual(fp.read(), "{} value a b\n".format(tmpdir))
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import os
+import tempfile
+import time
+import types
+import unittest
+
+from sphinx_multiversion import cache, git
+
+from .test_git import _git
+
+
+class ConfigCacheTestCase(unittest.TestCase):
+    def test_get_config_fields(self):
+        fields = cache.get_config_fields(
+            "{ref.name}/{config.html_theme}/{config.release}"
+        )
+        self.assertEqual(fields, [*cache.CONFIG_CACHE_FIELDS, "html_theme"])
+
+    def test_get_config_key(self):
+        fields = list(cache.CONFIG_CACHE_FIELDS)
+        key = cache.get_config_key("a" * 40, {"release": "1.0"}, fields)
+        self.assertEqual(
+            key, cache.get_config_key("a" * 40, {"release": "1.0"}, fields)
+        )
+        # A changed conf dir, override or field invalidates the key
+        for other in (
+            cache.get_config_key("b" * 40, {"release": "1.0"}, fields),
+            cache.get_config_key("a" * 40, {"release": "2.0"}, fields),
+            cache.get_config_key("a" * 40, {}, fields),
+            cache.get_config_key("a" * 40, {"release": "1.0"}, ["version"]),
+        ):
+            self.assertNotEqual(key, other)
+
+    def test_save_and_load(self):
+        fields = cache.get_config_fields("{ref.name}-{config.html_theme}")
+        config = types.SimpleNamespace(
+            version="1.0",
+            release="1.0.1",
+            rst_prolog=None,
+            source_suffix={".rst": "restructuredtext"},
+            html_theme="alabaster",
+            extensions=["sphinx_multiversion"],
+        )
+        with tempfile.TemporaryDirectory() as cachedir:
+            self.assertIsNone(cache.load_config(cachedir, "key"))
+            cache.save_config(cachedir, "key", config, fields)
+            loaded = cache.load_config(cachedir, "key")
+            for field in fields:
+                self.assertEqual(
+                    getattr(loaded, field), getattr(config, field)
+                )
+            self.assertFalse(hasattr(loaded, "extensions"))
+            self.assertEqual(
+                "{ref}-{config.html_theme}".format(ref="main", config=loaded),
+                "main-alabaster",
+            )
+
+            # Unserializable configs are not cached
+            config.rst_prolog = object()
+            cache.save_config(cachedir, "other", config, fields)
+            self.assertIsNone(cache.load_config(cachedir, "other"))
+
+
+class UpdateCheckoutTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.gitroot = os.path.join(self.tmpdir.name, "repo")
+        self.entry = os.path.join(self.tmpdir.name, "cache", "main")
+        os.makedirs(os.path.join(self.gitroot, "docs"))
+        _git(self.gitroot, "init", "-q", "-b", "main")
+        self.commit(
+            {"docs/conf.py": "", "docs/index.rst": "1", "docs/old.rst": "old"}
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def commit(self, files):
+        for filename, content in files.items():
+            path = os.path.join(self.gitroot, filename)
+            if content is None:
+                os.unlink(path)
+            else:
+                with open(path, mode="w") as fp:
+                    fp.write(content)
+        _git(self.gitroot, "add", "-A")
+        _git(self.gitroot, "commit", "-q", "-m", "Commit")
+        (ref,) = git.get_refs(self.gitroot, None, r"^main$", None)
+        return ref
+
+    def get_path(self, filename):
+        return os.path.join(cache.get_source_path(self.entry), filename)
+
+    def test_update_checkout(self):
+        (ref,) = git.get_refs(self.gitroot, None, r"^main$", None)
+        self.assertEqual(
+            cache.update_checkout(self.gitroot, self.entry, ref), len("1old")
+        )
+        conf_stat = os.stat(self.get_path("docs/conf.py"))
+
+        # An unchanged checkout is reused
+        self.assertEqual(
+            cache.update_checkout(self.gitroot, self.entry, ref), 0
+        )
+
+        # Only changed files are rewritten, and removed files are deleted
+        ref = self.commit({"docs/index.rst": "22", "docs/old.rst": None})
+        self.assertEqual(
+            cache.update_checkout(self.gitroot, self.entry, ref), len("22")
+        )
+        with open(self.get_path("docs/index.rst")) as fp:
+            self.assertEqual(fp.read(), "22")
+        self.assertFalse(os.path.exists(self.get_path("docs/old.rst")))
+        self.assertTrue(
+            os.path.samestat(conf_stat, os.stat(self.get_path("docs/conf.py")))
+        )
+        self.assertEqual(cache.load_state(self.entry)["commit"], ref.commit)
+
+        # Changed paths create a new checkout
+        cache.update_checkout(self.gitroot, self.entry, ref, paths=["docs"])
+        self.assertEqual(cache.load_state(self.entry)["paths"], ["docs"])
+
+
+class EvictTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cachedir = self.tmpdir.name
+        now = time.time()
+        # Least recently used first
+        for name, age in (("a", 300), ("b", 200), ("c", 100), ("d", 0)):
+            entry = os.path.join(self.cachedir, "refs", name)
+            os.makedirs(cache.get_source_path(entry))
+            with open(
+                os.path.join(cache.get_source_path(entry), "file"), "w"
+            ) as fp:
+                fp.write("x" * 1000)
+            cache.save_state(entry, {"last_used": now - age})
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def get_entries(self):
+        return sorted(os.listdir(os.path.join(self.cachedir, "refs")))
+
+    def test_max_age(self):
+        cache.evict(
+            self.cachedir,
+            max_age=150,
+            keep=[os.path.join(self.cachedir, "refs", "a")],
+        )
+        self.assertEqual(self.get_entries(), ["a", "c", "d"])
+
+    def test_max_size(self):
+        cache.evict(
+            self.cachedir,
+            max_size=2500,
+            keep=[os.path.join(self.cachedir, "refs", "b")],
+        )
+        # The least recently used entries are removed first
+        self.assertEqual(self.get_entries(), ["b", "d"])
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import os
+import tempfile
+import unittest
+
+from sphinx_multiversion import dedup
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode="w") as fp:
+        fp.write(content)
+
+
+def _read(path):
+    with open(path, mode="r") as fp:
+        return fp.read()
+
+
+class DeduplicateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.outputroot = self.tmpdir.name
+        self.outputdirs = []
+        for name in ("v1.0", "v2.0"):
+            outputdir = os.path.join(self.outputroot, name)
+            self.outputdirs.append(outputdir)
+            _write(
+                os.path.join(outputdir, "index.html"),
+                '<link href="_static/style.css?v=1" />'
+                '<script src="_static/theme.css"></script>'
+                '<script src="_static/app.js"></script>'
+                '<a href="https://example.com/_static/style.css">'
+                "{}</a>".format(name),
+            )
+            _write(os.path.join(outputdir, "_static", "style.css"), "body{}")
+            _write(
+                os.path.join(outputdir, "_static", "theme.css"),
+                "@font-face{src: url(font.woff)}",
+            )
+            _write(os.path.join(outputdir, "_static", "font.woff"), "font")
+            _write(
+                os.path.join(outputdir, "_static", "app.js"),
+                'import("./chunk.js")',
+            )
+            _write(os.path.join(outputdir, "_static", "chunk.js"), "chunk")
+            _write(os.path.join(outputdir, ".buildinfo"), "config")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_hardlink(self):
+        saved = dedup.deduplicate(self.outputroot, self.outputdirs)
+        self.assertEqual(
+            saved, len("body{}") + len("font") + 31 + len("chunk") + 20
+        )
+
+        for name in ("style.css", "theme.css", "font.woff"):
+            paths = [
+                os.path.join(outputdir, "_static", name)
+                for outputdir in self.outputdirs
+            ]
+            self.assertTrue(os.path.samefile(*paths))
+        self.assertFalse(
+            os.path.samefile(
+                *(
+                    os.path.join(outputdir, ".buildinfo")
+                    for outputdir in self.outputdirs
+                )
+            )
+        )
+
+        # Rebuilding a version must not modify the other versions
+        dedup.unshare_tree(self.outputdirs[0])
+        _write(os.path.join(self.outputdirs[0], "_static", "style.css"), "new")
+        self.assertEqual(
+            _read(os.path.join(self.outputdirs[1], "_static", "style.css")),
+            "body{}",
+        )
+
+    def test_shared(self):
+        saved = dedup.deduplicate(
+            self.outputroot, self.outputdirs, mode="shared"
+        )
+        self.assertEqual(
+            saved, len("body{}") + len("font") + 31 + len("chunk") + 20
+        )
+
+        content = _read(os.path.join(self.outputdirs[0], "index.html"))
+        self.assertIn('href="../_shared/', content)
+        self.assertIn('.css?v=1"', content)
+        self.assertIn("https://example.com/_static/style.css", content)
+        self.assertIn('src="_static/app.js"', content)
+        self.assertFalse(
+            os.path.exists(
+                os.path.join(self.outputdirs[0], "_static", "style.css")
+            )
+        )
+
+        # Scripts, and files with or referenced by relative CSS urls stay in
+        # place, so that their relative references still work
+        for name in ("theme.css", "font.woff", "app.js", "chunk.js"):
+            paths = [
+                os.path.join(outputdir, "_static", name)
+                for outputdir in self.outputdirs
+            ]
+            self.assertTrue(os.path.samefile(*paths))
+
+        shareddir = os.path.join(self.outputroot, dedup.SHARED_DIRNAME)
+        shared = [
+            os.path.join(root, name)
+            for root, _, names in os.walk(shareddir)
+            for name in names
+        ]
+        self.assertEqual(len(shared), 1)
+        self.assertEqual(_read(shared[0]), "body{}")
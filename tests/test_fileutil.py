@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import os
+import tempfile
+import threading
+import unittest
+
+from sphinx_multiversion import fileutil
+
+
+class AtomicWriteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "data.json")
+        with open(self.path, mode="w") as fp:
+            fp.write("old")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_write(self):
+        with fileutil.atomic_write(self.path) as fp:
+            fp.write("new")
+            # The file is only replaced once the block has finished
+            with open(self.path) as oldfp:
+                self.assertEqual(oldfp.read(), "old")
+        with open(self.path) as fp:
+            self.assertEqual(fp.read(), "new")
+        self.assertEqual(os.listdir(self.tmpdir.name), ["data.json"])
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            with fileutil.atomic_write(self.path) as fp:
+                fp.write("new")
+                raise ValueError()
+        with open(self.path) as fp:
+            self.assertEqual(fp.read(), "old")
+        self.assertEqual(os.listdir(self.tmpdir.name), ["data.json"])
+
+    def test_tmppath(self):
+        # Concurrent writers in other threads use other temporary files
+        tmppaths = [fileutil.get_tmppath(self.path)]
+        thread = threading.Thread(
+            target=lambda: tmppaths.append(fileutil.get_tmppath(self.path))
+        )
+        thread.start()
+        thread.join()
+        self.assertNotEqual(tmppaths[0], tmppaths[1])
+        self.assertTrue(tmppaths[0].startswith(self.path))
+
+
+class RemoveFileTestCase(unittest.TestCase):
+    def test_remove_file(self):
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(os.path.join(root, "a", "b", "c"))
+            os.makedirs(os.path.join(root, "a", "d"))
+            with open(os.path.join(root, "a", "b", "c", "file"), "w"):
+                pass
+
+            fileutil.remove_file(root, "a/b/c/file")
+            # Only directories that became empty are removed
+            self.assertEqual(os.listdir(root), ["a"])
+            self.assertEqual(os.listdir(os.path.join(root, "a")), ["d"])
+
+            # Missing files are ignored
+            fileutil.remove_file(root, "a/d/missing")
+            self.assertEqual(os.listdir(root), [])
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import datetime
+import os
+import subprocess
+import tempfile
+import unittest
+
+import sphinx_multiversion
+
+
+def _git(cwd, *args):
+    env = dict(
+        os.environ,
+        GIT_AUTHOR_NAME="Test",
+        GIT_AUTHOR_EMAIL="test@example.com",
+        GIT_AUTHOR_DATE="1596811520 -0700",
+        GIT_COMMITTER_NAME="Test",
+        GIT_COMMITTER_EMAIL="test@example.com",
+        GIT_COMMITTER_DATE="1596811520 -0700",
+    )
+    subprocess.check_call(
+        ("git", *args), cwd=cwd, env=env, stdout=subprocess.DEVNULL
+    )
+
+
+class ParseRawDateTestCase(unittest.TestCase):
+    def test_parse_raw_date(self):
+        date = sphinx_multiversion.git.parse_raw_date("1596811520 -0700")
+        self.assertEqual(
+            date.strftime("%Y-%m-%d %H:%M:%S %z"),
+            "2020-08-07 07:45:20 -0700",
+        )
+        self.assertEqual(
+            sphinx_multiversion.git.parse_raw_date("0 +0530").utcoffset(),
+            datetime.timedelta(hours=5, minutes=30),
+        )
+
+
+class GetRefsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.gitroot = self.tmpdir.name
+        _git(self.gitroot, "init", "-q", "-b", "main")
+        os.makedirs(os.path.join(self.gitroot, "docs"))
+        with open(os.path.join(self.gitroot, "docs", "conf.py"), "w"):
+            pass
+        _git(self.gitroot, "add", "docs")
+        _git(self.gitroot, "commit", "-q", "-m", "Initial commit")
+        _git(self.gitroot, "branch", "dev")
+        _git(self.gitroot, "tag", "v1.0")
+        _git(self.gitroot, "notes", "add", "-m", "Note")
+        for remote in ("origin", "fork"):
+            _git(self.gitroot, "remote", "add", remote, self.gitroot)
+            _git(self.gitroot, "fetch", "-q", remote)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def get_refnames(self, *args):
+        return sorted(
+            ref.refname
+            for ref in sphinx_multiversion.git.get_refs(
+                self.gitroot, *args, files=("docs/conf.py",)
+            )
+        )
+
+    def test_whitelists(self):
+        self.assertEqual(
+            self.get_refnames(r"^v", r"^main$", None),
+            ["refs/heads/main", "refs/tags/v1.0"],
+        )
+        self.assertEqual(
+            self.get_refnames(None, r"^d", r"^origin$"),
+            ["refs/heads/dev", "refs/remotes/origin/dev"],
+        )
+        self.assertEqual(self.get_refnames(None, None, r"^.*$"), [])
+
+    def test_missing_files(self):
+        _git(self.gitroot, "checkout", "-q", "-b", "nodocs")
+        _git(self.gitroot, "rm", "-q", "-r", "docs")
+        _git(self.gitroot, "commit", "-q", "-m", "Remove docs")
+        _git(self.gitroot, "checkout", "-q", "main")
+
+        # Refs without the conf.py are skipped
+        self.assertEqual(
+            self.get_refnames(None, r"^.*$", None),
+            ["refs/heads/dev", "refs/heads/main"],
+        )
+        self.assertEqual(
+            sphinx_multiversion.git.files_exist(
+                self.gitroot,
+                [
+                    ("main", "docs/conf.py"),
+                    ("nodocs", "docs/conf.py"),
+                    ("main", os.path.join("docs", "missing.py")),
+                ],
+            ),
+            [True, False, False],
+        )
+
+    def test_ref_fields(self):
+        refs = sphinx_multiversion.git.get_refs(
+            self.gitroot, None, r"^main$", r"^fork$"
+        )
+        (ref,) = [ref for ref in refs if ref.is_remote]
+        self.assertEqual(ref.name, "main")
+        self.assertEqual(ref.source, "remotes/fork")
+        self.assertEqual(
+            ref.creatordate.strftime("%Y-%m-%d %H:%M:%S %z"),
+            "2020-08-07 07:45:20 -0700",
+        )
+
+
+class GetObjectIdsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.gitroot = self.tmpdir.name
+        _git(self.gitroot, "init", "-q", "-b", "main")
+        os.makedirs(os.path.join(self.gitroot, "docs"))
+        with open(os.path.join(self.gitroot, "docs", "conf.py"), "w"):
+            pass
+        _git(self.gitroot, "add", "docs")
+        _git(self.gitroot, "commit", "-q", "-m", "Initial commit")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_get_object_ids(self):
+        revs = ["main:", "main:docs", "main:docs/conf.py"]
+        expected = (
+            subprocess.check_output(
+                ("git", "rev-parse", *revs), cwd=self.gitroot
+            )
+            .decode()
+            .splitlines()
+        )
+        self.assertEqual(
+            sphinx_multiversion.git.get_object_ids(self.gitroot, revs),
+            expected,
+        )
+        self.assertEqual(
+            sphinx_multiversion.git.get_object_ids(self.gitroot, []), []
+        )
+        with self.assertRaises(OSError):
+            sphinx_multiversion.git.get_object_ids(
+                self.gitroot, ["main:missing"]
+            )
+
+
+class CopyTreeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.gitroot = os.path.join(self.tmpdir.name, "repo")
+        os.makedirs(os.path.join(self.gitroot, "docs"))
+        _git(self.gitroot, "init", "-q", "-b", "main")
+        for filename, content in (
+            ("docs/conf.py", "project = 'test'\n"),
+            ("docs/index.rst", "Test\n"),
+            ("README.rst", "Readme\n"),
+        ):
+            with open(os.path.join(self.gitroot, filename), "w") as fp:
+                fp.write(content)
+        _git(self.gitroot, "add", ".")
+        _git(self.gitroot, "commit", "-q", "-m", "Initial commit")
+        (self.ref,) = sphinx_multiversion.git.get_refs(
+            self.gitroot, None, r"^main$", None
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_copy_tree(self):
+        dst = os.path.join(self.tmpdir.name, "dst")
+        extracted = sphinx_multiversion.git.copy_tree(
+            self.gitroot, self.gitroot, dst, self.ref, paths=("docs",)
+        )
+        self.assertEqual(extracted, len("project = 'test'\n") + len("Test\n"))
+        self.assertEqual(sorted(os.listdir(dst)), ["docs"])
+        with open(os.path.join(dst, "docs", "index.rst")) as fp:
+            self.assertEqual(fp.read(), "Test\n")
+
+    def test_copy_tree_failure(self):
+        dst = os.path.join(self.tmpdir.name, "dst")
+        with self.assertRaises(subprocess.CalledProcessError):
+            sphinx_multiversion.git.copy_tree(
+                self.gitroot, self.gitroot, dst, self.ref, paths=("missing",)
+            )
+
+
+class LinkTreeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.gitroot = os.path.join(self.tmpdir.name, "repo")
+        self.store = os.path.join(self.tmpdir.name, "objects")
+        os.makedirs(os.path.join(self.gitroot, "docs"))
+        _git(self.gitroot, "init", "-q", "-b", "main")
+        for filename, content in (
+            ("docs/conf.py", "project = 'test'\n"),
+            ("docs/index.rst", "1"),
+            ("docs/build.sh", "#!/bin/sh\n"),
+        ):
+            with open(os.path.join(self.gitroot, filename), "w") as fp:
+                fp.write(content)
+        os.chmod(os.path.join(self.gitroot, "docs", "build.sh"), 0o755)
+        _git(self.gitroot, "add", ".")
+        _git(self.gitroot, "commit", "-q", "-m", "Initial commit")
+        _git(self.gitroot, "tag", "v1.0")
+        with open(os.path.join(self.gitroot, "docs", "index.rst"), "w") as fp:
+            fp.write("22")
+        _git(self.gitroot, "commit", "-q", "-a", "-m", "Change index")
+        self.refs = {
+            ref.name: ref
+            for ref in sphinx_multiversion.git.get_refs(
+                self.gitroot, r"^v", r"^main$", None
+            )
+        }
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_link_tree(self):
+        dsts = {}
+        written = {}
+        for name in ("v1.0", "main"):
+            dsts[name] = os.path.join(self.tmpdir.name, name)
+            written[name] = sphinx_multiversion.git.link_tree(
+                self.gitroot, dsts[name], self.refs[name], self.store
+            )
+        # The second tree only adds the changed blob to the store
+        self.assertEqual(
+            written["v1.0"], len("project = 'test'\n") + len("1#!/bin/sh\n")
+        )
+        self.assertEqual(written["main"], len("22"))
+
+        def get_path(name, filename):
+            return os.path.join(dsts[name], "docs", filename)
+
+        # Blobs that are shared between refs are stored once
+        for filename in ("conf.py", "build.sh"):
+            self.assertTrue(
+                os.path.samefile(
+                    get_path("v1.0", filename), get_path("main", filename)
+                )
+            )
+        self.assertFalse(
+            os.path.samefile(
+                get_path("v1.0", "index.rst"), get_path("main", "index.rst")
+            )
+        )
+
+        for name, content in (("v1.0", "1"), ("main", "22")):
+            with open(get_path(name, "index.rst")) as fp:
+                self.assertEqual(fp.read(), content)
+        self.assertTrue(os.access(get_path("main", "build.sh"), os.X_OK))
+        self.assertFalse(os.access(get_path("main", "conf.py"), os.X_OK))
+        # Files in the store are read-only
+        self.assertFalse(os.stat(get_path("main", "conf.py")).st_mode & 0o222)
+
+
+class GetTreeFilesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.gitroot = self.tmpdir.name
+        _git(self.gitroot, "init", "-q", "-b", "main")
+        for dirname in ("docs", os.path.join("src", "api")):
+            os.makedirs(os.path.join(self.gitroot, dirname))
+        for filename in ("docs/index.rst", "src/api/mod.rst"):
+            with open(os.path.join(self.gitroot, filename), "w"):
+                pass
+        for target, filename in (
+            ("../src/api", "docs/api"),
+            ("index.rst", "docs/alias.rst"),
+            (".", "docs/loop"),
+            ("missing", "docs/dangling"),
+            ("../../outside", "docs/outside"),
+        ):
+            os.symlink(target, os.path.join(self.gitroot, filename))
+        _git(self.gitroot, "add", ".")
+        _git(self.gitroot, "commit", "-q", "-m", "Initial commit")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_get_tree_files(self):
+        self.assertEqual(
+            sphinx_multiversion.git.get_tree_files(
+                self.gitroot, "main", "docs"
+            ),
+            ["alias.rst", "api/mod.rst", "index.rst", "outside"],
+        )
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from sphinx_multiversion.main import (
+    get_docnames,
+    load_sphinx_config_task,
+    main,
+    run_concurrently,
+    working_dir,
+)
+
+from .test_git import _git
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONF_PY = """
+extensions = ["sphinx_multiversion"]
+templates_path = ["_templates"]
+smv_tag_whitelist = r"^v.*$"
+smv_branch_whitelist = r"^main$"
+smv_remote_whitelist = None
+"""
+
+LAYOUT_HTML = """
+{% extends "!layout.html" %}
+{% block footer %}current={{ current_version.name }}{% endblock %}
+"""
+
+
+class MainTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.gitroot = os.path.join(self.tmpdir.name, "repo")
+        os.makedirs(os.path.join(self.gitroot, "docs", "_templates"))
+        for relpath, content in (
+            ("conf.py", CONF_PY),
+            ("index.rst", "Test\n====\n"),
+            (os.path.join("_templates", "layout.html"), LAYOUT_HTML),
+        ):
+            with open(
+                os.path.join(self.gitroot, "docs", relpath), mode="w"
+            ) as fp:
+                fp.write(content)
+        _git(self.gitroot, "init", "-q", "-b", "main")
+        _git(self.gitroot, "add", "docs")
+        _git(self.gitroot, "commit", "-q", "-m", "Initial commit")
+        _git(self.gitroot, "tag", "v1.0")
+        self.outputdir = os.path.join(self.tmpdir.name, "html")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def build(self, *args, cwd=None, returncode=0, versions=("main", "v1.0")):
+        timings_path = os.path.join(self.tmpdir.name, "timings.json")
+        pythonpath = os.pathsep.join(
+            filter(None, (ROOT, os.environ.get("PYTHONPATH")))
+        )
+        with mock.patch.dict(os.environ, {"PYTHONPATH": pythonpath}):
+            with working_dir(cwd or self.gitroot):
+                actual_returncode = main(
+                    [
+                        os.path.join(self.gitroot, "docs"),
+                        self.outputdir,
+                        "--timings",
+                        timings_path,
+                        "-q",
+                        *args,
+                    ]
+                )
+        self.assertEqual(actual_returncode, returncode)
+
+        for version_name in versions:
+            with open(
+                os.path.join(self.outputdir, version_name, "index.html")
+            ) as fp:
+                self.assertIn("current={}".format(version_name), fp.read())
+
+        with open(timings_path) as fp:
+            return json.load(fp)["stages"]
+
+    def print_json(self, *args):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            with working_dir(self.gitroot):
+                returncode = main(
+                    [os.path.join(self.gitroot, "docs"), self.outputdir, *args]
+                )
+        self.assertEqual(returncode, 0)
+        return json.loads(stdout.getvalue())
+
+    def plan(self, *args):
+        return {
+            entry["name"]: entry for entry in self.print_json("--plan", *args)
+        }
+
+    def test_plan(self):
+        # Symlinked directories are followed, just like Sphinx does
+        os.makedirs(os.path.join(self.gitroot, "src", "api"))
+        with open(os.path.join(self.gitroot, "src", "api", "mod.rst"), "w"):
+            pass
+        os.symlink(
+            os.path.join("..", "src", "api"),
+            os.path.join(self.gitroot, "docs", "api"),
+        )
+        _git(self.gitroot, "add", ".")
+        _git(self.gitroot, "commit", "-q", "-m", "Add API docs")
+
+        plan = self.plan()
+        self.assertEqual(sorted(plan), ["main", "v1.0"])
+        self.assertEqual(plan["main"]["outputdir"], "main")
+        self.assertEqual(plan["main"]["action"], "build")
+        self.assertEqual(plan["main"]["manifest"], "stale")
+
+        metadata = self.print_json("--dump-metadata")
+        self.assertEqual(metadata["main"]["docnames"], ["api/mod", "index"])
+        self.assertEqual(metadata["v1.0"]["docnames"], ["index"])
+
+    def test_shuffled_completion(self):
+        for tag in ("v0.9", "v1.1", "v2.0"):
+            _git(self.gitroot, "tag", tag)
+
+        # Let every job wait for the next one, so that they finish in
+        # reverse order
+        completed = []
+
+        def run_reversed(func, items, jobs=None):
+            items = list(items)
+            events = [threading.Event() for _ in items]
+            events.append(threading.Event())
+            events[-1].set()
+
+            def wrapped(item):
+                index = items.index(item)
+                self.assertTrue(events[index + 1].wait(10))
+                try:
+                    return func(item)
+                finally:
+                    completed.append(index)
+                    events[index].set()
+
+            return run_concurrently(wrapped, items, len(items))
+
+        expected_plan = self.print_json("--plan")
+        expected_metadata = self.print_json("--dump-metadata")
+        with mock.patch(
+            "sphinx_multiversion.main.run_concurrently", run_reversed
+        ):
+            plan = self.print_json("--plan", "--jobs", "4")
+            metadata = self.print_json("--dump-metadata", "--jobs", "4")
+
+        self.assertEqual(completed, [4, 3, 2, 1, 0] * 2)
+        # Results are merged in ref order, not in completion order
+        self.assertEqual(plan, expected_plan)
+        # Checkout paths are temporary, so only compare the other fields
+        fields = ("name", "commit", "outputdir", "docnames")
+        self.assertEqual(
+            [[data[field] for field in fields] for data in metadata.values()],
+            [
+                [data[field] for field in fields]
+                for data in expected_metadata.values()
+            ],
+        )
+
+    def test_config_cache(self):
+        cachedir = os.path.join(self.tmpdir.name, "cache")
+
+        def get_statuses(*args):
+            plan = self.plan("--cache-dir", cachedir, *args)
+            return {entry["config_cache"] for entry in plan.values()}
+
+        # Both refs share the conf dir, so they also share the cached config
+        self.assertIn("miss", get_statuses())
+        self.assertEqual(get_statuses(), {"hit"})
+        self.assertEqual(get_statuses("--no-config-cache"), {"disabled"})
+        # Changed overrides don't use the cached config
+        self.assertIn("miss", get_statuses("-D", "release=2.0"))
+
+    def get_doctree_mtimes(self):
+        return [
+            os.stat(
+                os.path.join(
+                    self.outputdir, version_name, ".doctrees", "index.doctree"
+                )
+            ).st_mtime_ns
+            for version_name in ("main", "v1.0")
+        ]
+
+    def test_alias_commits(self):
+        stages = self.build("--alias-commits")
+        # Both refs are built from a single checkout
+        self.assertEqual(stages["materialize"]["count"], 1)
+        self.assertEqual(stages["build"]["count"], 2)
+
+        # The alias build reused the copied environment, so the doctree
+        # has not been written again
+        mtimes = self.get_doctree_mtimes()
+        self.assertEqual(mtimes[0], mtimes[1])
+
+    def test_different_defines(self):
+        # A define that differs between the refs changes the config, so the
+        # second ref is built on its own
+        self.build("--alias-commits", "-D", "project=${name}")
+        mtimes = self.get_doctree_mtimes()
+        self.assertNotEqual(mtimes[0], mtimes[1])
+
+    def test_dedup_report(self):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            self.build("--dedup", "hardlink")
+        self.assertRegex(
+            stdout.getvalue(), r"Deduplicated output files, saved [1-9]\d* "
+        )
+
+    def test_failed_build(self):
+        # Broken references only fail the build of main with -W
+        with open(os.path.join(self.gitroot, "docs", "index.rst"), "a") as fp:
+            fp.write("\n`missing`_\n")
+        _git(self.gitroot, "commit", "-q", "-a", "-m", "Break main")
+
+        with contextlib.redirect_stderr(io.StringIO()):
+            stages = self.build("-W", returncode=1, versions=("v1.0",))
+        # The failure doesn't prevent the other version from being built
+        self.assertEqual(stages["build"]["count"], 2)
+
+    def test_cwd_outside_sourcedir(self):
+        # The working directory is not materialized, but it's created in
+        # the checkout and not reported as a missing path
+        cwd = os.path.join(self.gitroot, "tools")
+        os.makedirs(cwd)
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(io.StringIO()):
+            with contextlib.redirect_stderr(stderr):
+                self.build("--jobs", "2", cwd=cwd)
+        self.assertNotIn("smv_materialize_paths", stderr.getvalue())
+
+
+class LoadSphinxConfigTaskTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.sitedir = os.path.join(self.tmpdir.name, "site")
+        self.confdir = os.path.join(self.tmpdir.name, "docs")
+        os.makedirs(os.path.join(self.confdir, "ext"))
+        os.makedirs(self.sitedir)
+        for path, content in (
+            (os.path.join(self.sitedir, "smv_test_site.py"), ""),
+            (os.path.join(self.confdir, "ext", "smv_test_local.py"), ""),
+            (
+                os.path.join(self.confdir, "conf.py"),
+                "import os, sys\n"
+                'sys.path.insert(0, os.path.abspath("ext"))\n'
+                "import smv_test_local, smv_test_site\n",
+            ),
+        ):
+            with open(path, mode="w") as fp:
+                fp.write(content)
+        sys.path.insert(0, self.sitedir)
+
+    def tearDown(self):
+        sys.path.remove(self.sitedir)
+        sys.modules.pop("smv_test_site", None)
+        sys.modules.pop("smv_test_local", None)
+        self.tmpdir.cleanup()
+
+    def test_load_sphinx_config_task(self):
+        path = sys.path.copy()
+        _, cpu = load_sphinx_config_task(self.confdir, {}, False)
+        self.assertGreaterEqual(cpu, 0.0)
+        self.assertEqual(sys.path, path)
+        # Only modules from paths added by the conf.py are removed
+        self.assertNotIn("smv_test_local", sys.modules)
+        self.assertIn("smv_test_site", sys.modules)
+
+
+class GetDocnamesTestCase(unittest.TestCase):
+    def test_get_docnames(self):
+        self.assertEqual(
+            get_docnames(
+                [
+                    "index.rst",
+                    "api/mod.rst",
+                    "api/mod.txt",
+                    "notes.md",
+                    ".#draft.rst",
+                    "api/_sources/mod.rst",
+                    "e\u0301.rst",
+                ],
+                (".rst", ".md"),
+            ),
+            ["api/mod", "index", "notes", "\u00e9"],
+        )
+
+
+class RunConcurrentlyTestCase(unittest.TestCase):
+    def test_order(self):
+        # The first item finishes last, but results keep the item order
+        started = threading.Event()
+
+        def func(item):
+            if item == 0:
+                self.assertTrue(started.wait(10))
+            else:
+                started.set()
+            return item * 2
+
+        self.assertEqual(run_concurrently(func, range(4), 4), [0, 2, 4, 6])
+        self.assertEqual(run_concurrently(func, [1, 0]), [2, 0])
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import os
+import tempfile
+import unittest
+
+import sphinx_multiversion
+
+
+class IsUpToDateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.outputroot = self.tmpdir.name
+        self.outputdir = os.path.join(self.outputroot, "v1.0")
+        self.data = {
+            "name": "v1.0",
+            "version": "1.0",
+            "release": "1.0.0",
+            "rst_prolog": None,
+            "is_released": True,
+            "source": "tags",
+            "creatordate": "2020-08-07 07:45:20 -0700",
+            "commit": "a" * 40,
+            "outputdir": self.outputdir,
+        }
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def get_key(self, **kwargs):
+        return sphinx_multiversion.manifest.get_version_key(
+            dict(self.data, **kwargs), self.outputroot, "config", "versions"
+        )
+
+    def is_up_to_date(self, key):
+        build_manifest = {"versions": {"v1.0": {"key": self.get_key()}}}
+        return sphinx_multiversion.manifest.is_up_to_date(
+            build_manifest, "v1.0", key, self.outputdir
+        )
+
+    def test_is_up_to_date(self):
+        # Missing and empty output dirs are rebuilt
+        self.assertFalse(self.is_up_to_date(self.get_key()))
+        os.makedirs(self.outputdir)
+        self.assertFalse(self.is_up_to_date(self.get_key()))
+
+        with open(os.path.join(self.outputdir, "index.html"), "w"):
+            pass
+        self.assertTrue(self.is_up_to_date(self.get_key()))
+        self.assertFalse(
+            sphinx_multiversion.manifest.is_up_to_date(
+                {"versions": {}}, "v1.0", self.get_key(), self.outputdir
+            )
+        )
+
+        # Any change of the key triggers a rebuild
+        self.assertFalse(self.is_up_to_date(self.get_key(commit="b" * 40)))
+        self.assertFalse(self.is_up_to_date(self.get_key(release="1.0.1")))
+        for key in (
+            sphinx_multiversion.manifest.get_version_key(
+                self.data, self.outputroot, "changed", "versions"
+            ),
+            sphinx_multiversion.manifest.get_version_key(
+                self.data, self.outputroot, "config", "changed"
+            ),
+        ):
+            self.assertFalse(self.is_up_to_date(key))
+
+
+class PruneVersionsTestCase(unittest.TestCase):
+    def test_prune_versions(self):
+        with tempfile.TemporaryDirectory() as outputroot:
+            for name in ("v1.0", "v2.0", "removed"):
+                os.makedirs(os.path.join(outputroot, name))
+            build_manifest = {
+                "versions": {
+                    name: {"key": {"outputdir": name}}
+                    for name in ("v1.0", "removed")
+                },
+            }
+
+            sphinx_multiversion.manifest.prune_versions(
+                build_manifest,
+                outputroot,
+                [
+                    os.path.join(outputroot, "v1.0"),
+                    os.path.join(outputroot, "v2.0"),
+                ],
+            )
+
+            self.assertEqual(list(build_manifest["versions"]), ["v1.0"])
+            self.assertEqual(sorted(os.listdir(outputroot)), ["v1.0", "v2.0"])
+
+    def test_prune_versions_keeps_parent_dirs(self):
+        with tempfile.TemporaryDirectory() as outputroot:
+            os.makedirs(os.path.join(outputroot, "v1.0"))
+            build_manifest = {
+                "versions": {"latest": {"key": {"outputdir": "."}}},
+            }
+
+            sphinx_multiversion.manifest.prune_versions(
+                build_manifest,
+                outputroot,
+                [os.path.join(outputroot, "v1.0")],
+            )
+
+            self.assertEqual(build_manifest["versions"], {})
+            self.assertEqual(os.listdir(outputroot), ["v1.0"])
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import json
+import os
+import pickle
+import tempfile
+import unittest
+
+from sphinx_multiversion import metadata as metadata_store
+
+
+class MetadataStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.metadata = {
+            "master": {
+                "name": "master",
+                "version": "",
+                "docnames": ["index", "changelog", "api/reference"],
+            },
+            "v0.1.0": {
+                "name": "v0.1.0",
+                "version": "0.1.0",
+                "docnames": ["index", "ünicode"],
+            },
+        }
+
+    def test_roundtrip(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "versions.smv")
+            metadata_store.write(path, self.metadata)
+            store = metadata_store.load(path)
+
+            self.assertEqual(list(store), ["master", "v0.1.0"])
+            self.assertEqual(store["v0.1.0"]["version"], "0.1.0")
+            self.assertIn("changelog", store["master"]["docnames"])
+            self.assertNotIn("changelog", store["v0.1.0"]["docnames"])
+            self.assertIn("ünicode", store["v0.1.0"]["docnames"])
+            self.assertNotIn("missing", store["master"]["docnames"])
+            self.assertEqual(len(store["master"]["docnames"]), 3)
+
+            expected = {
+                name: dict(data, docnames=sorted(data["docnames"]))
+                for name, data in self.metadata.items()
+            }
+            self.assertEqual(
+                {
+                    name: dict(record, docnames=list(record["docnames"]))
+                    for name, record in store.items()
+                },
+                expected,
+            )
+
+            copy = pickle.loads(pickle.dumps(store))
+            self.assertIn("index", copy["v0.1.0"]["docnames"])
+
+    def test_load_json(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "versions.json")
+            with open(path, mode="w") as fp:
+                json.dump(self.metadata, fp)
+
+            self.assertEqual(metadata_store.load(path), self.metadata)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import argparse
+import os
+import tempfile
+import unittest
+
+import sphinx_multiversion
+
+
+class ShardArgumentTestCase(unittest.TestCase):
+    def test_shard_argument(self):
+        self.assertEqual(
+            sphinx_multiversion.shard.shard_argument("2/4"), (2, 4)
+        )
+        for value in ("0/4", "5/4", "2", "a/b"):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                sphinx_multiversion.shard.shard_argument(value)
+
+
+class PartitionTestCase(unittest.TestCase):
+    def test_partition(self):
+        weights = {"a": 5, "b": 4, "c": 3, "d": 3, "e": 2, "f": 1}
+        shards = sphinx_multiversion.shard.partition(weights, 3)
+        loads = [0, 0, 0]
+        for name, index in shards.items():
+            loads[index] += weights[name]
+        self.assertEqual(sorted(loads), [6, 6, 6])
+
+    def test_get_weights(self):
+        metadata = {
+            "a": {"docnames": ["index", "page"]},
+            "b": {"docnames": ["index", "page", "other", "faq"]},
+            "c": {"docnames": []},
+        }
+        self.assertEqual(
+            sphinx_multiversion.shard.get_weights(metadata),
+            {"a": 2, "b": 4, "c": 1},
+        )
+        self.assertEqual(
+            sphinx_multiversion.shard.get_weights(metadata, {"b": 8.0}),
+            {"a": 4.0, "b": 8.0, "c": 2.0},
+        )
+
+
+class MergeTestCase(unittest.TestCase):
+    def write_files(self, root, files):
+        for path, content in files.items():
+            path = os.path.join(root, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, mode="w") as fp:
+                fp.write(content)
+
+    def test_merge(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            shard1 = os.path.join(tmpdir, "shard1")
+            shard2 = os.path.join(tmpdir, "shard2")
+            outputroot = os.path.join(tmpdir, "html")
+            self.write_files(
+                shard1,
+                {"v1.0/index.html": "v1.0", "_shared/ab/cd.css": "css"},
+            )
+            self.write_files(
+                shard2,
+                {"v2.0/index.html": "v2.0", "_shared/ab/cd.css": "css"},
+            )
+            for sharddir, name in ((shard1, "v1.0"), (shard2, "v2.0")):
+                sphinx_multiversion.manifest.save_manifest(
+                    sphinx_multiversion.manifest.get_manifest_path(sharddir),
+                    {
+                        "format": sphinx_multiversion.manifest.MANIFEST_FORMAT,
+                        "versions": {name: {"key": {}}},
+                        "versions_hash": "abc",
+                    },
+                )
+
+            conflicts = sphinx_multiversion.shard.merge(
+                outputroot, [shard1, shard2]
+            )
+            self.assertEqual(conflicts, [])
+            self.assertEqual(
+                sorted(os.listdir(outputroot)),
+                [".smv-manifest.json", "_shared", "v1.0", "v2.0"],
+            )
+            merged = sphinx_multiversion.manifest.load_manifest(
+                sphinx_multiversion.manifest.get_manifest_path(outputroot)
+            )
+            self.assertEqual(sorted(merged["versions"]), ["v1.0", "v2.0"])
+
+            self.write_files(shard2, {"v1.0/index.html": "other"})
+            conflicts = sphinx_multiversion.shard.merge(
+                outputroot, [shard1, shard2]
+            )
+            self.assertEqual(conflicts, ["v1.0/index.html"])
+
+    def test_merge_into_previous_output(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            shard1 = os.path.join(tmpdir, "shard1")
+            shard2 = os.path.join(tmpdir, "shard2")
+            outputroot = os.path.join(tmpdir, "html")
+            self.write_files(shard1, {"v1.0/index.html": "old"})
+            self.write_files(shard2, {"v2.0/index.html": "v2.0"})
+            self.write_files(outputroot, {"CNAME": "example.com"})
+            self.assertEqual(
+                sphinx_multiversion.shard.merge(outputroot, [shard1, shard2]),
+                [],
+            )
+
+            # The changed page is replaced and pages that no longer exist
+            # in any shard are removed
+            self.write_files(shard1, {"v1.0/index.html": "new"})
+            self.assertEqual(
+                sphinx_multiversion.shard.merge(outputroot, [shard1]), []
+            )
+            with open(os.path.join(outputroot, "v1.0", "index.html")) as fp:
+                self.assertEqual(fp.read(), "new")
+            self.assertEqual(
+                sorted(os.listdir(outputroot)),
+                [".smv-manifest.json", "CNAME", "v1.0"],
+            )
@@ -25,10 +25,17 @@
 #
 # SPDX-License-Identifier: BSD-2-Clause
 
+import io
+import json
 import os.path
 import posixpath
+import re
+import sys
 import tempfile
 import unittest
+from unittest import mock
+
+from sphinx import application as sphinx_application
 
 import sphinx_multiversion
 
@@ -141,3 +148,170 @@ class VersionInfoTestCase(unittest.TestCase):
             self.versioninfo.vpathto("branch-with/slash"),
             posixpath.join("..", "..", "branch-with/slash", "index.html"),
         )
+
+    def test_shared_table(self):
+        versioninfo = sphinx_multiversion.sphinx.VersionInfo(
+            app=None,
+            context={"pagename": "appendix/faq"},
+            metadata=self.versioninfo.metadata,
+            current_version_name="master",
+            table=self.versioninfo.table,
+        )
+        self.assertEqual(
+            versioninfo["v0.1.0"].url,
+            posixpath.join("..", "..", "v0.1.0", "appendix", "faq.html"),
+        )
+
+        versioninfo.context["pagename"] = "testpage"
+        self.assertEqual(
+            [version.url for version in versioninfo.tags],
+            [posixpath.join("..", "v0.1.0", "index.html")],
+        )
+        self.assertIsNone(versioninfo["missing"])
+
+    def test_versions_index(self):
+        index = sphinx_multiversion.sphinx.get_versions_index(
+            self.versioninfo.metadata,
+            os.path.join(tempfile.gettempdir(), "build", "html"),
+        )
+        self.assertEqual(
+            index["docnames"], ["appendix/faq", "old_testpage", "testpage"]
+        )
+        self.assertEqual(
+            [
+                (version["name"], version["outputdir"], version["docnames"])
+                for version in index["versions"]
+            ],
+            [
+                ("master", "master", "BQ=="),
+                ("v0.1.0", "v0.1.0", "Aw=="),
+                ("branch-with/slash", "branch-with/slash", "BA=="),
+            ],
+        )
+
+
+class ReadMonitorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.basedir = os.path.join(tempfile.gettempdir(), "master")
+        self.monitor = sphinx_multiversion.sphinx.ReadMonitor(
+            self.basedir,
+            [
+                os.path.join(self.basedir, "docs"),
+                os.path.join(self.basedir, "src", "pkg"),
+            ],
+        )
+
+    def test_is_missing(self):
+        for path, expected in (
+            (os.path.join(self.basedir, "docs", "conf.py"), False),
+            (os.path.join(self.basedir, "src", "pkg"), False),
+            (os.path.join(self.basedir, "src"), False),
+            (os.path.join(self.basedir, "src", "pkg2"), True),
+            (os.path.join(self.basedir, "README.rst"), True),
+            (os.path.join(tempfile.gettempdir(), "other"), False),
+        ):
+            self.assertEqual(self.monitor.is_missing(path), expected, path)
+
+    def test_cwd_and_sys_path(self):
+        cwd = os.path.join(self.basedir, "tools")
+        monitor = sphinx_multiversion.sphinx.ReadMonitor(
+            self.basedir, [os.path.join(self.basedir, "docs")], cwd=cwd
+        )
+        self.assertFalse(monitor.is_missing(cwd))
+        self.assertTrue(monitor.is_missing(os.path.join(cwd, "setup.py")))
+
+        path = os.path.join(self.basedir, "src")
+        with mock.patch.object(sys, "path", [path, *sys.path]):
+            self.assertFalse(monitor.is_missing(path, listing=True))
+            self.assertTrue(monitor.is_missing(path))
+
+    def test_warn_once(self):
+        path = os.path.join(self.basedir, "README.rst")
+        with self.assertLogs(sphinx_multiversion.sphinx.logger) as cm:
+            self.monitor("open", (path, "r", 0))
+            self.monitor("open", (path, "rb", 0))
+            self.monitor("os.listdir", (self.basedir,))
+            self.monitor("os.listdir", (os.path.join(self.basedir, "tests"),))
+        self.assertEqual(len(cm.output), 2)
+
+    def test_ignore_writes(self):
+        path = os.path.join(self.basedir, "README.rst")
+        self.monitor("open", (path, "w", 0))
+        self.monitor("open", (path, None, os.O_WRONLY | os.O_CREAT))
+        self.monitor("compile", (b"", path))
+        self.assertEqual(self.monitor.reported, set())
+
+
+class StaticVersionsTestCase(unittest.TestCase):
+    def test_build(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            srcdir = os.path.join(tmpdir, "src")
+            outputroot = os.path.join(tmpdir, "html")
+            outputdir = os.path.join(outputroot, "branch-with", "slash")
+            os.makedirs(os.path.join(srcdir, "sub"))
+            with open(os.path.join(srcdir, "conf.py"), "w") as fp:
+                fp.write('extensions = ["sphinx_multiversion"]\n')
+            for docname in ("index", "sub/page"):
+                with open(os.path.join(srcdir, docname + ".rst"), "w") as fp:
+                    fp.write("Title\n=====\n\n.. toctree::\n\n   sub/page\n")
+
+            metadata_path = os.path.join(tmpdir, "versions.smv")
+            with open(metadata_path, "w") as fp:
+                json.dump(
+                    {
+                        "branch-with/slash": {
+                            "name": "branch-with/slash",
+                            "version": "",
+                            "release": "1.0",
+                            "rst_prolog": None,
+                            "is_released": False,
+                            "source": "heads",
+                            "creatordate": "2020-08-07 07:45:20 -0700",
+                            "basedir": tmpdir,
+                            "sourcedir": srcdir,
+                            "outputdir": outputdir,
+                            "confdir": srcdir,
+                            "docnames": ["index", "sub/page"],
+                        },
+                    },
+                    fp,
+                )
+
+            app = sphinx_application.Sphinx(
+                srcdir,
+                srcdir,
+                outputdir,
+                os.path.join(tmpdir, "doctrees"),
+                "html",
+                confoverrides={
+                    "smv_metadata_path": metadata_path,
+                    "smv_current_version": "branch-with/slash",
+                    "smv_versions_index_path": os.path.join(
+                        outputroot, "versions.json"
+                    ),
+                },
+                status=None,
+                warning=io.StringIO(),
+            )
+            app.build()
+
+            with open(os.path.join(outputdir, "sub", "page.html")) as fp:
+                page = fp.read()
+            self.assertIn(
+                '<meta name="smv-pagename" content="sub/page">', page
+            )
+            self.assertIn(
+                '<meta name="smv-versions-index" '
+                'content="../../../versions.json">',
+                page,
+            )
+            (script,) = re.findall(
+                r"<script [^>]*smv_versions\.js[^>]*>", page
+            )
+            self.assertIn('data-current-version="branch-with/slash"', script)
+            self.assertNotIn("data-index", script)
+            self.assertTrue(
+                os.path.exists(
+                    os.path.join(outputdir, "_static", "smv_versions.js")
+                )
+            )
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import json
+import os
+import tempfile
+import unittest
+
+from sphinx_multiversion import timings
+
+
+class RecorderTestCase(unittest.TestCase):
+    def test_write(self):
+        recorder = timings.Recorder()
+        with recorder.span("refs"):
+            pass
+        for name in ("v1.0", "v2.0"):
+            with recorder.span("materialize", name) as span:
+                span["bytes"] = 100
+        start = recorder.origin + 10.0
+        recorder.add("build", "v1.0", start, start + 2, cpu=1.5, peak_rss=10)
+        recorder.add("build", "v2.0", start, start + 1, cpu=0.5, peak_rss=20)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            timings_path = os.path.join(tmpdir, "timings.json")
+            trace_path = os.path.join(tmpdir, "trace.json")
+            recorder.write_timings(timings_path)
+            recorder.write_trace(trace_path)
+
+            with open(timings_path) as fp:
+                data = json.load(fp)
+            with open(trace_path) as fp:
+                trace = json.load(fp)
+
+        self.assertEqual(
+            list(data["stages"]), ["refs", "materialize", "build"]
+        )
+        self.assertEqual(data["stages"]["materialize"]["count"], 2)
+        self.assertEqual(data["stages"]["materialize"]["bytes"], 200)
+        self.assertEqual(data["stages"]["build"]["wall_seconds"], 3.0)
+        self.assertEqual(data["stages"]["build"]["cpu_seconds"], 2.0)
+        self.assertEqual(data["stages"]["build"]["peak_rss"], 20)
+        self.assertEqual(len(data["spans"]), 5)
+
+        events = [
+            event for event in trace["traceEvents"] if event["ph"] == "X"
+        ]
+        self.assertEqual(len(events), 5)
+        self.assertIn("materialize v1.0", [event["name"] for event in events])
+
+    def test_cpu_override(self):
+        recorder = timings.Recorder()
+        with recorder.span("config", "v1.0") as span:
+            span["cpu"] = 0.25
+        with recorder.span("materialize", "v1.0") as span:
+            span["cpu"] = None
+
+        summary = recorder.get_summary()
+        self.assertEqual(summary["config"]["cpu_seconds"], 0.25)
+        # Unknown CPU time is not reported as 0
+        self.assertIsNone(summary["materialize"]["cpu_seconds"])
+        self.assertEqual([span.args for span in recorder.spans], [{}, {}])
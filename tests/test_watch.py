@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from sphinx_multiversion import watch
+
+
+def _write_ref(gitdir, name, commit):
+    path = os.path.join(gitdir, "refs", "heads", name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode="w") as fp:
+        fp.write("{}\n".format(commit))
+
+
+class WatchTestCase(unittest.TestCase):
+    def test_get_changes(self):
+        with tempfile.TemporaryDirectory() as gitdir:
+            _write_ref(gitdir, "main", "a" * 40)
+            state = watch.get_refs_state(gitdir)
+            self.assertEqual(watch.get_changes(state, state), set())
+
+            _write_ref(gitdir, "dev", "b" * 40)
+            with open(os.path.join(gitdir, "packed-refs"), mode="w") as fp:
+                fp.write("{} refs/tags/v1.0\n".format("c" * 40))
+            self.assertEqual(
+                watch.get_changes(state, watch.get_refs_state(gitdir)),
+                {
+                    os.path.join(gitdir, "refs", "heads", "dev"),
+                    os.path.join(gitdir, "packed-refs"),
+                },
+            )
+
+    def test_watch(self):
+        with tempfile.TemporaryDirectory() as gitdir:
+            _write_ref(gitdir, "main", "a" * 40)
+            status_path = os.path.join(gitdir, "status.json")
+            runs = []
+
+            def run():
+                runs.append(watch.get_refs_state(gitdir))
+                if len(runs) == 1:
+                    # Simulate a push of several refs during the first build
+                    for name in ("dev", "feature"):
+                        threading.Timer(
+                            0.05, _write_ref, (gitdir, name, "b" * 40)
+                        ).start()
+                return 0
+
+            returncode = watch.watch(
+                run,
+                gitdir,
+                interval=0.02,
+                debounce=0.1,
+                status_path=status_path,
+                max_builds=2,
+            )
+            with open(status_path) as fp:
+                status = json.load(fp)
+
+        self.assertEqual(returncode, 0)
+        self.assertEqual(len(runs), 2)
+        self.assertEqual(len(runs[1]), 3)
+        self.assertEqual(status["state"], "stopped")
+        self.assertEqual(status["builds"], 2)
+        self.assertEqual(status["changes_detected"], 2)
+        self.assertEqual(status["last_exit_code"], 0)
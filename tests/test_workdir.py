@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2025 Jan Holthuis <jan.holthuis@rub.de>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+import errno
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import sphinx_multiversion
+
+from .test_git import _git
+
+
+class WorkdirTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.gitroot = os.path.join(self.tmpdir.name, "repo")
+        self.path = os.path.join(self.tmpdir.name, "workdir")
+        os.makedirs(os.path.join(self.gitroot, "docs"))
+        _git(self.gitroot, "init", "-q", "-b", "main")
+        for filename in ("docs/conf.py", "README.rst"):
+            with open(os.path.join(self.gitroot, filename), "w") as fp:
+                fp.write("x" * 100)
+        _git(self.gitroot, "add", ".")
+        _git(self.gitroot, "commit", "-q", "-m", "Initial commit")
+        (self.gitref,) = sphinx_multiversion.git.get_refs(
+            self.gitroot, None, r"^main$", None
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_checkout(self):
+        with sphinx_multiversion.workdir.Workdir(self.path) as checkouts:
+            self.assertEqual(
+                checkouts.checkout(self.gitroot, self.gitref, ["docs"]), 100
+            )
+            path = checkouts.get_checkout_path(self.gitref.commit, ["docs"])
+            self.assertEqual(os.listdir(path), ["docs"])
+
+        # Trees are reused by later runs
+        with sphinx_multiversion.workdir.Workdir(self.path) as checkouts:
+            self.assertEqual(
+                checkouts.checkout(self.gitroot, self.gitref, ["docs"]), 0
+            )
+            self.assertEqual(
+                checkouts.checkout(self.gitroot, self.gitref), 200
+            )
+
+    def test_evict(self):
+        first = sphinx_multiversion.workdir.Workdir(self.path)
+        second = sphinx_multiversion.workdir.Workdir(self.path)
+        first.checkout(self.gitroot, self.gitref)
+        path = first.get_checkout_path(self.gitref.commit)
+
+        # Trees that are in use by another run are kept
+        second.evict(0)
+        self.assertTrue(os.path.isdir(path))
+
+        first.close()
+        second.evict(0)
+        self.assertEqual(os.listdir(self.path), [])
+
+
+@unittest.skipIf(
+    sphinx_multiversion.workdir.fcntl is None, "requires file locks"
+)
+class LockTestCase(unittest.TestCase):
+    def test_lock_error(self):
+        opened = []
+
+        def open_file(*args, **kwargs):
+            opened.append(open(*args, **kwargs))
+            return opened[-1]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with mock.patch.object(
+                sphinx_multiversion.workdir, "open", open_file, create=True
+            ):
+                with mock.patch.object(
+                    sphinx_multiversion.workdir.fcntl,
+                    "flock",
+                    side_effect=OSError(errno.ENOLCK, "No locks available"),
+                ):
+                    with self.assertRaises(OSError):
+                        sphinx_multiversion.workdir._lock(
+                            os.path.join(tmpdir, "tree.lock")
+                        )
+        self.assertEqual(len(opened), 1)
+        self.assertTrue(opened[0].closed)